@@ -27,6 +27,15 @@ class DatabaseBackup:
             os.makedirs(self.backup_dir)
             logger.info(f"Создана папка для бэкапов: {self.backup_dir}")
     
+    def checkpoint_wal(self):
+        """Перенос журнала WAL в основной файл БД перед копированием"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Не удалось выполнить checkpoint WAL: {e}")
+    
     def create_backup(self, compress: bool = True) -> Optional[str]:
         """
         Создание бэкапа базы данных
@@ -42,6 +51,9 @@ class DatabaseBackup:
             return None
         
         try:
+            # БД работает в режиме WAL - сначала переносим журнал в файл
+            self.checkpoint_wal()
+            
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             
             if compress:
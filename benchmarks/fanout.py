@@ -0,0 +1,223 @@
+"""
+fanout.py - Бенчмарк рассылки уведомлений на синтетических популяциях
+
+Каждый сценарий (размер популяции x тип поста) выполняется в отдельном
+процессе на копии синтетической базы: строится индекс подписок, затем
+вызывается process_food_notification / process_totem_notification - тот же
+путь, что и для поста канала (рендер, outbox, пул воркеров).
+
+Бот по умолчанию - заглушка без ограничителя (измеряется собственная
+скорость пути рассылки), с --api-url - настоящий Bot с RateLimitMiddleware
+против tools/fake_bot_api.py.
+
+Результат - JSON: время рассылки, время до первой отправки, число SQL
+запросов, пиковый RSS и отправок в секунду по каждому сценарию.
+
+    python benchmarks/fanout.py --users 10000 100000 --kind food totem --output fanout.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config
+from benchmarks.population import ensure_population
+
+# Пост для каждого типа сценария
+FOOD_POST = [
+    {"name": "Pineapple", "quantity": 3},
+    {"name": "Dragon Fruit", "quantity": 1},
+    {"name": "Pumpkin", "quantity": 2}
+]
+TOTEM_POST = ("free", "Free totem", "https://www.roblox.com/share?code=bench&type=Server")
+
+class MockBot:
+    """Заглушка Bot: send_message ждет latency и всегда успешна"""
+    
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+    
+    async def send_message(self, chat_id: int, text: str, parse_mode: Optional[str] = None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+
+def database_fingerprint(path: str) -> Dict[str, List[int]]:
+    """Число строк и максимальный rowid каждой таблицы (проверка, что база не менялась)"""
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return {
+            table: list(conn.execute(f'SELECT COUNT(*), MAX(rowid) FROM "{table}"').fetchone())
+            for table in tables
+        }
+    finally:
+        conn.close()
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux - килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def run_scenario(db_path: str, kind: str, latency: float, api_url: Optional[str], rate: Optional[float]) -> Dict:
+    """Один сценарий в текущем процессе (база уже скопирована)"""
+    Config.DATABASE_PATH = db_path
+    Config.SENDER_PROCESSES = 0
+    if rate:
+        Config.TELEGRAM_GLOBAL_RATE = rate
+    
+    from database import AsyncDatabase, ConnectionPool, Database
+    
+    # Считаем SQL-операторы всех подключений (trace callback вызывается на каждое выполнение)
+    queries = {"count": 0}
+    open_connection = ConnectionPool.open_connection
+    
+    def traced_open_connection(pool):
+        conn = open_connection(pool)
+        conn.set_trace_callback(lambda statement: queries.__setitem__("count", queries["count"] + 1))
+        return conn
+    
+    ConnectionPool.open_connection = traced_open_connection
+    
+    import handlers.channel as channel
+    from utils.outbox import outbox
+    from utils.subscription_index import subscription_index
+    
+    # Своя AsyncDatabase на копию: путь async_db модуля database мог быть задан
+    # раньше Config.DATABASE_PATH, а рассылка не должна писать в рабочую database.db
+    bench_db = AsyncDatabase(db_path)
+    channel.db = bench_db
+    outbox.db = bench_db
+    
+    start = time.perf_counter()
+    subscription_index.load(Database(db_path))
+    index_load = time.perf_counter() - start
+    
+    if api_url:
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        from utils.rate_limiter import RateLimitMiddleware, RateLimiter
+        bot = Bot(token=Config.BOT_TOKEN or "1:bench", session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+        bot.session.middleware(RateLimitMiddleware(RateLimiter()))
+    else:
+        bot = MockBot(latency)
+    
+    rss_before = peak_rss_mb()
+    queries["count"] = 0
+    start = time.perf_counter()
+    try:
+        if kind == "food":
+            result = await channel.process_food_notification(FOOD_POST, bot, 1, time.time())
+        else:
+            result = await channel.process_totem_notification(*TOTEM_POST, bot, 1, time.time())
+    finally:
+        if api_url:
+            await bot.session.close()
+    wall = time.perf_counter() - start
+    bench_db.close()
+    
+    return {
+        "kind": kind,
+        "recipients": result.total,
+        "sent": result.sent,
+        "errors": result.errors,
+        "index_load_s": round(index_load, 4),
+        "wall_s": round(wall, 4),
+        "first_send_ms": round(result.first_send * 1000, 2) if result.first_send is not None else None,
+        "sends_per_sec": round(result.sent / wall, 1) if wall > 0 else 0.0,
+        "queries": queries["count"],
+        "rss_before_mb": round(rss_before, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+
+def scenario_main(args):
+    """Дочерний процесс: копия базы, один сценарий, JSON в stdout"""
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        shutil.copyfile(ensure_population(args.scenario_users), db_path)
+        result = asyncio.run(run_scenario(db_path, args.scenario_kind, args.latency, args.api_url, args.rate))
+    result["users"] = args.scenario_users
+    print(json.dumps(result))
+
+def run_matrix(args) -> List[Dict]:
+    results = []
+    for users in args.users:
+        # Базу готовим заранее, чтобы генерация не попала в RSS сценария
+        ensure_population(users)
+        for kind in args.kind:
+            command = [
+                sys.executable, os.path.abspath(__file__),
+                "--scenario-users", str(users), "--scenario-kind", kind,
+                "--latency", str(args.latency)
+            ]
+            if args.api_url:
+                command += ["--api-url", args.api_url]
+            if args.rate:
+                command += ["--rate", str(args.rate)]
+            output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{users:>8} {kind:<6} wall {result['wall_s']:.2f}s, first send {result['first_send_ms']} ms, "
+                f"{result['sends_per_sec']:.0f} sends/s, {result['queries']} queries, peak RSS {result['peak_rss_mb']} MB",
+                file=sys.stderr
+            )
+            results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк рассылки уведомлений")
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--kind", nargs="+", choices=("food", "totem"), default=["food", "totem"])
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка заглушки send_message, сек")
+    parser.add_argument("--api-url", default=None, help="адрес tools/fake_bot_api.py вместо заглушки")
+    parser.add_argument("--rate", type=float, default=None, help="глобальный лимит отправок для --api-url")
+    parser.add_argument("--output", default=None, help="файл JSON (по умолчанию stdout)")
+    parser.add_argument("--scenario-users", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--scenario-kind", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.scenario_users:
+        scenario_main(args)
+        return
+    
+    # Сценарии работают с копиями - рабочая база бота не должна измениться
+    repo_db = os.path.join(ROOT, Config.DATABASE_PATH)
+    repo_db_before = database_fingerprint(repo_db)
+    scenarios = run_matrix(args)
+    if database_fingerprint(repo_db) != repo_db_before:
+        sys.exit(f"Бенчмарк изменил рабочую базу {repo_db}")
+    
+    report = {
+        "benchmark": "fanout",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "bot": args.api_url or f"mock (latency {args.latency}s)",
+        "scenarios": scenarios
+    }
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+
+if __name__ == "__main__":
+    main()
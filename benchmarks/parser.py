@@ -0,0 +1,105 @@
+"""
+parser.py - Сравнение разбора постов о стоке: StockParser против прежней реализации
+
+Прогоняет тексты из benchmarks/corpus/*.jsonl через прежний построчный
+extract_fruits (скопирован сюда как эталон) и через StockParser, проверяет,
+что все найденные прежде фрукты находятся и сейчас, и печатает JSON со
+скоростью обоих вариантов.
+
+    python benchmarks/parser.py --repeat 2000
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config
+from utils.corpus import load_corpus
+from utils.filters import stock_parser
+
+CORPUS_GLOB = os.path.join(ROOT, "benchmarks", "corpus", "*.jsonl")
+
+def legacy_clean_fruit_name(fruit_name: str) -> str:
+    if fruit_name.startswith("@"):
+        fruit_name = fruit_name[1:]
+    for old, new in Config.REPLACE_WORDS.items():
+        if old in fruit_name:
+            fruit_name = fruit_name.replace(old, new)
+            break
+    fruit_name = fruit_name.replace("DragonFruit", "Dragon Fruit")
+    fruit_name = fruit_name.replace("BloodstoneCycad", "Bloodstone Cycad")
+    fruit_name = fruit_name.replace("ColossalPinecone", "Colossal Pinecone")
+    fruit_name = fruit_name.replace("FrankenKiwi", "Franken Kiwi")
+    fruit_name = fruit_name.replace("DeepseaPearlFruit", "Deepsea Pearl Fruit")
+    fruit_name = fruit_name.replace("VoltGinkgo", "Volt Ginkgo")
+    fruit_name = fruit_name.replace("CandyCorn", "Candy Corn")
+    fruit_name = fruit_name.replace("Candycane", "Candycane")
+    return fruit_name.strip()
+
+def legacy_extract_fruits(text: str) -> List[Dict]:
+    """Прежний MessageFilter.extract_fruits"""
+    fruits = []
+    for line in text.split('\n'):
+        line = line.strip()
+        match = re.match(r'x(\d+)\s+(.+)', line)
+        if match:
+            quantity = int(match.group(1))
+            raw_fruit_name = match.group(2).strip()
+            fruit_name = legacy_clean_fruit_name(raw_fruit_name)
+            if fruit_name in Config.AVAILABLE_FRUITS_EN:
+                fruits.append({"name": fruit_name, "quantity": quantity, "raw_name": raw_fruit_name})
+    return fruits
+
+def covers(new: List[Dict], old: List[Dict]) -> bool:
+    """Новый результат содержит все фрукты прежнего с теми же полями и в том же порядке"""
+    remaining = iter(new)
+    return all(any(fruit == candidate for candidate in remaining) for fruit in old)
+
+def measure(parse: Callable[[str], List], texts: List[str], repeat: int) -> Dict:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            parse(text)
+    elapsed = time.perf_counter() - start
+    messages = len(texts) * repeat
+    return {
+        "seconds": round(elapsed, 4),
+        "messages_per_sec": round(messages / elapsed),
+        "us_per_message": round(elapsed / messages * 1e6, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора постов о стоке")
+    parser.add_argument("--corpus", default=CORPUS_GLOB, help="шаблон файлов корпуса (формат - utils/corpus.py)")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    
+    texts = [entry["text"] for entry in load_corpus(args.corpus)]
+    if not texts:
+        sys.exit(f"Корпус пуст: {args.corpus}")
+    
+    # Все, что находил прежний разбор, должно находиться и сейчас (алиасов стало больше)
+    mismatches = [text for text in texts if not covers(stock_parser.parse(text), legacy_extract_fruits(text))]
+    
+    report = {
+        "benchmark": "stock_parser",
+        "messages": len(texts),
+        "repeat": args.repeat,
+        "mismatches": len(mismatches),
+        "legacy": measure(legacy_extract_fruits, texts, args.repeat),
+        "compiled": measure(stock_parser.parse, texts, args.repeat)
+    }
+    report["speedup"] = round(report["legacy"]["seconds"] / report["compiled"]["seconds"], 2)
+    print(json.dumps(report, indent=2))
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
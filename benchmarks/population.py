@@ -0,0 +1,108 @@
+"""
+population.py - Синтетические базы пользователей для бенчмарков
+
+База создается через обычную схему Database, а пользователи вставляются
+пакетами напрямую (add_user по одному для миллиона строк слишком долгий).
+Смесь приближена к реальной: языки, подписка на группу, 'all', несколько
+фруктов с перекосом к популярным, настройки тотемов, исключения.
+
+    python benchmarks/population.py --users 100000 --output benchmarks/data/users_100000.db
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+# Доли в популяции
+LANGUAGE_RUS_SHARE = 0.7
+SUBSCRIBED_SHARE = 0.9
+ALL_FRUITS_SHARE = 0.25
+NO_FRUITS_SHARE = 0.15
+FREE_TOTEMS_SHARE = 0.8
+PAID_TOTEMS_SHARE = 0.5
+EXCEPTION_SHARE = 0.01
+
+# Популярность фруктов: первые в списке выбирают чаще
+FRUIT_WEIGHTS = [1 / (rank + 1) for rank in range(len(Config.AVAILABLE_FRUITS_EN))]
+
+CHUNK = 10000
+
+def population_path(users: int) -> str:
+    """Путь кэшированной базы на users пользователей"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", f"users_{users}.db")
+
+def generate(path: str, users: int, seed: int = 1) -> str:
+    """Создать базу с users пользователями (существующий файл перезаписывается)"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    
+    # database импортируется только здесь: импорт population (например, из
+    # benchmarks/fanout.py) не должен создавать объекты модуля database
+    from database import Database
+    
+    rng = random.Random(seed)
+    db = Database(path)
+    with db.get_connection() as conn:
+        for start in range(1, users + 1, CHUNK):
+            user_rows, fruit_rows, exception_rows = [], [], []
+            for user_id in range(start, min(start + CHUNK, users + 1)):
+                user_rows.append((
+                    user_id,
+                    f"user{user_id}",
+                    "RUS" if rng.random() < LANGUAGE_RUS_SHARE else "ENG",
+                    int(rng.random() < SUBSCRIBED_SHARE),
+                    int(rng.random() < FREE_TOTEMS_SHARE),
+                    int(rng.random() < PAID_TOTEMS_SHARE)
+                ))
+                roll = rng.random()
+                if roll < ALL_FRUITS_SHARE:
+                    fruit_rows.append((user_id, "all"))
+                elif roll >= ALL_FRUITS_SHARE + NO_FRUITS_SHARE:
+                    count = rng.randint(1, 5)
+                    fruits = set(rng.choices(Config.AVAILABLE_FRUITS_EN, weights=FRUIT_WEIGHTS, k=count))
+                    fruit_rows.extend((user_id, fruit) for fruit in fruits)
+                if rng.random() < EXCEPTION_SHARE:
+                    exception_rows.append((user_id, Config.ADMIN_ID))
+            
+            conn.executemany(
+                'INSERT INTO users (user_id, username, language, is_subscribed, free_totems, paid_totems) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                user_rows
+            )
+            conn.executemany('INSERT INTO user_fruits (user_id, fruit_name) VALUES (?, ?)', fruit_rows)
+            conn.executemany(
+                'INSERT INTO subscription_exceptions (user_id, admin_id) VALUES (?, ?)', exception_rows
+            )
+            conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return path
+
+def ensure_population(users: int, seed: int = 1) -> str:
+    """Кэшированная база на users пользователей (создается при первом запросе)"""
+    path = population_path(users)
+    if not os.path.exists(path):
+        generate(path, users, seed)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетическая база пользователей для бенчмарков")
+    parser.add_argument("--users", type=int, required=True)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    
+    path = args.output or population_path(args.users)
+    start = time.perf_counter()
+    generate(path, args.users, args.seed)
+    print(f"{path}: {args.users} users in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
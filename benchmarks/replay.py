@@ -0,0 +1,139 @@
+"""
+replay.py - Прогон корпуса постов канала через разбор и форматирование
+
+Для каждой записи корпуса (формат - utils/corpus.py):
+- classify_message (с entities записи, если они есть) сравнивается с expected;
+- для еды и тотема рендерятся тексты уведомлений на обоих языках.
+
+Отчет (JSON): расхождения, сообщений в секунду на полный путь
+(классификация + рендер) и пиковый объем памяти на сообщение по
+tracemalloc. Код возврата 1, если есть расхождения.
+
+    python benchmarks/replay.py --repeat 500
+    python benchmarks/replay.py --corpus captured.jsonl --update   # принять текущие результаты как ожидаемые
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.corpus import load_corpus
+from utils.filters import MessageFilter
+
+CORPUS_GLOB = os.path.join(ROOT, "benchmarks", "corpus", "*.jsonl")
+LANGUAGES = ("RUS", "ENG")
+
+def process(entry: Dict) -> Dict:
+    """Полный путь поста: классификация и рендер уведомлений"""
+    classification = MessageFilter.classify_message(entry["text"], entry.get("entities"))
+    if classification["type"] == "food":
+        for language in LANGUAGES:
+            MessageFilter.format_food_message(classification["data"], language)
+    elif classification["type"] == "totem":
+        for language in LANGUAGES:
+            MessageFilter.format_totem_message(
+                classification["subtype"], classification["text"], classification["link"], language
+            )
+    return classification
+
+def check(entries: List[Dict]) -> List[Dict]:
+    mismatches = []
+    for entry in entries:
+        # Через JSON - чтобы сравнивать так же, как записано в корпусе
+        actual = json.loads(json.dumps(process(entry), ensure_ascii=False))
+        if actual != entry["expected"]:
+            mismatches.append({
+                "message_id": entry.get("message_id"),
+                "text": entry["text"][:120],
+                "expected": entry["expected"],
+                "actual": actual
+            })
+    return mismatches
+
+def measure_speed(entries: List[Dict], repeat: int) -> Dict:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for entry in entries:
+            process(entry)
+    elapsed = time.perf_counter() - start
+    messages = len(entries) * repeat
+    return {
+        "seconds": round(elapsed, 4),
+        "messages_per_sec": round(messages / elapsed),
+        "us_per_message": round(elapsed / messages * 1e6, 3)
+    }
+
+def measure_memory(entries: List[Dict]) -> Dict:
+    """Пик выделенной памяти при обработке одного сообщения (tracemalloc)"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for entry in entries:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            process(entry)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_bytes_avg": round(sum(peaks) / len(peaks)),
+        "peak_bytes_max": max(peaks)
+    }
+
+def update_expected(pattern: str):
+    """Перезаписать expected текущими результатами - каждый файл корпуса отдельно"""
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        sys.exit(f"Нет файлов корпуса: {pattern}")
+    for path in paths:
+        entries = load_corpus(path)
+        with open(path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                entry["expected"] = json.loads(json.dumps(MessageFilter.classify_message(entry["text"], entry.get("entities")), ensure_ascii=False))
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        print(f"{path}: {len(entries)} entries updated")
+
+def main():
+    parser = argparse.ArgumentParser(description="Прогон корпуса постов канала")
+    parser.add_argument("--corpus", default=CORPUS_GLOB, help="шаблон файлов корпуса")
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--update", action="store_true", help="принять текущие результаты как ожидаемые")
+    args = parser.parse_args()
+    
+    if args.update:
+        update_expected(args.corpus)
+        return
+    
+    entries = load_corpus(args.corpus)
+    if not entries:
+        sys.exit(f"Корпус пуст: {args.corpus}")
+    
+    mismatches = check(entries)
+    types: Dict[str, int] = {}
+    for entry in entries:
+        types[entry["expected"]["type"]] = types.get(entry["expected"]["type"], 0) + 1
+    
+    report = {
+        "benchmark": "corpus_replay",
+        "messages": len(entries),
+        "types": types,
+        "repeat": args.repeat,
+        "mismatches": len(mismatches),
+        "speed": measure_speed(entries, args.repeat),
+        "memory": measure_memory(entries),
+        "mismatch_details": mismatches[:20]
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
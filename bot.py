@@ -6,12 +6,21 @@ from datetime import datetime
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.types import BufferedInputFile
 
 from config import Config
-from database import Database
+from database import Database, ConnectionPool, async_db
+from backup_utils import backup_manager
 from utils.subscription import daily_subscription_check
+from utils.subscription_index import subscription_index
+from utils.rate_limiter import rate_limiter, RateLimitMiddleware
+from utils.outbox import outbox
+from utils.sender_pool import sender_pool
+from utils.shadow import ShadowMiddleware, shadow_recorder
+from utils.dedup import post_deduplicator
 from handlers.start import get_user_language
 
 # Настройка логирования
@@ -36,6 +45,9 @@ async def create_backup():
         backup_name = f"database_backup_{timestamp}.db.gz"
         backup_path = os.path.join(backup_dir, backup_name)
         
+        # БД в режиме WAL - переносим журнал в основной файл перед копированием
+        backup_manager.checkpoint_wal()
+        
         with open("database.db", 'rb') as f_in:
             with gzip.open(backup_path, 'wb') as f_out:
                 shutil.copyfileobj(f_in, f_out)
@@ -143,12 +155,46 @@ async def main():
             logger.error(f"❌ Ошибка инициализации БД: {e}")
             return
     
+    # Строим индекс подписок в памяти (маршрутизация рассылок без запросов к БД)
+    try:
+        subscription_index.load(db)
+        logger.info("✅ Индекс подписок построен")
+    except Exception as e:
+        logger.error(f"❌ Ошибка построения индекса подписок: {e}")
+    
+    # Отпечатки недавно разосланных постов (защита от повторов после перезапуска)
+    try:
+        post_deduplicator.load(db)
+    except Exception as e:
+        logger.error(f"❌ Ошибка загрузки отпечатков постов: {e}")
+    
     # Создаем бота
+    session = None
+    if Config.BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(Config.BOT_API_URL))
+        logger.info(f"🧪 Bot API: {Config.BOT_API_URL}")
     bot = Bot(
         token=Config.BOT_TOKEN,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
+    # Все отправки идут через общий ограничитель лимитов Telegram
+    bot.session.middleware(RateLimitMiddleware(rate_limiter))
+    
+    # Теневой режим: после ограничителя вызов Bot API заменяется записью
+    if Config.SHADOW_MODE:
+        bot.session.middleware(ShadowMiddleware(shadow_recorder))
+        logger.warning(f"🕶 Теневой режим: отправки не выполняются, журнал - {Config.SHADOW_LOG_PATH}")
+    
+    # Процессы-отправители: рассылки уходят из отдельных процессов с общим лимитом
+    if sender_pool.enabled:
+        try:
+            sender_pool.start()
+            asyncio.create_task(sender_pool.supervise())
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска процессов-отправителей: {e}")
+    
     # Проверяем доступ к каналу
     try:
         chat = await bot.get_chat(Config.SOURCE_CHANNEL_ID)
@@ -167,6 +213,7 @@ async def main():
         from handlers.channel import router as channel_router
         from handlers.group_commands import router as group_commands_router
         from handlers.publish import router as publish_router
+        from handlers.membership import router as membership_router
         
         dp.include_router(group_commands_router)
         dp.include_router(start_router)
@@ -174,6 +221,7 @@ async def main():
         dp.include_router(admin_router)
         dp.include_router(channel_router)
         dp.include_router(publish_router)
+        dp.include_router(membership_router)
         
         logger.info("✅ Все роутеры зарегистрированы")
         
@@ -190,6 +238,10 @@ async def main():
         asyncio.create_task(auto_backup_task(bot))
         logger.info("✅ Автобэкапы запущены")
         
+        # Досылка рассылок, прерванных прошлым перезапуском
+        asyncio.create_task(outbox.resume(bot))
+        logger.info("✅ Очередь рассылок (outbox) запущена")
+        
     except Exception as e:
         logger.error(f"❌ Ошибка запуска фоновых задач: {e}")
     
@@ -200,7 +252,8 @@ async def main():
         bot_info = await bot.get_me()
         logger.info(f"👤 Бот: @{bot_info.username}")
         
-        await dp.start_polling(bot)
+        # chat_member не приходит без явного запроса в allowed_updates
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
         
     except KeyboardInterrupt:
         logger.info("🛑 Бот остановлен пользователем")
@@ -218,8 +271,14 @@ async def main():
         logger.error(f"💥 Критическая ошибка: {e}")
         
     finally:
+        # Сохраняем отметки о доставке, чтобы после перезапуска не слать повторно
+        await outbox.flush()
+        await sender_pool.stop()
+        shadow_recorder.close()
         await bot.session.close()
         logger.info("👋 Сессия бота закрыта")
+        async_db.close()
+        ConnectionPool.close_all_pools()
 
 if __name__ == "__main__":
     print("=" * 50)
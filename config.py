@@ -7,6 +7,18 @@ class Config:
     # Токен бота (единственная переменная из .env)
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     
+    # Другой сервер Bot API, например tools/fake_bot_api.py для нагрузочных
+    # тестов (необязательно, по умолчанию - api.telegram.org)
+    BOT_API_URL = os.getenv("BOT_API_URL")
+    
+    # Теневой режим: бот обрабатывает все как обычно, но вызовы Bot API с
+    # последствиями (отправки, правки) только записываются в SHADOW_LOG_PATH
+    SHADOW_MODE = os.getenv("SHADOW_MODE", "0") == "1"
+    SHADOW_LOG_PATH = "shadow_sends.jsonl"
+    
+    # Запись постов канала в корпус для benchmarks/replay.py (путь JSONL, по умолчанию выключено)
+    CORPUS_CAPTURE_PATH = os.getenv("CORPUS_CAPTURE_PATH")
+    
     # ID канала-источника (встроенные в код)
     # Получить можно через @username_to_id_bot или forwardbot
     SOURCE_CHANNEL_ID = -1003291808303  # ЗАМЕНИТЕ НА ВАШ ID КАНАЛА
@@ -21,6 +33,13 @@ class Config:
     # Настройки базы данных
     DATABASE_PATH = "database.db"
     
+    # Пул подключений к SQLite (подключения открываются один раз и переиспользуются)
+    DB_POOL_SIZE = 4               # Максимум открытых подключений в пуле
+    DB_BUSY_TIMEOUT_MS = 5000      # Сколько ждать снятия блокировки записи
+    DB_CACHE_SIZE_KB = 16384       # Размер кэша страниц на подключение (16 MB)
+    DB_MMAP_SIZE = 64 * 1024 * 1024  # Размер memory-mapped области (64 MB)
+    DB_READER_THREADS = 4          # Потоки чтения AsyncDatabase (запись - всегда 1 поток)
+    
     # Английские названия фруктов (без @)
     AVAILABLE_FRUITS_EN = [
         "Pear", "Pineapple", "Gold Mango", "Dragon Fruit", 
@@ -130,8 +149,59 @@ class Config:
         "@Candycane": "Candycane"
     }
     
-    # Интервал проверки подписок (в секундах)
-    SUBSCRIPTION_CHECK_INTERVAL = 21600  # 24 часа
+    # Лимиты Bot API для исходящих сообщений
+    TELEGRAM_GLOBAL_RATE = 30          # Сообщений в секунду на бота
+    TELEGRAM_PRIVATE_CHAT_RATE = 1     # Сообщений в секунду в один личный чат
+    TELEGRAM_GROUP_PER_MINUTE = 20     # Сообщений в минуту в одну группу
+    
+    # Рассылка уведомлений
+    FANOUT_WORKERS = 20                # Одновременных отправок в одной рассылке
+    FANOUT_QUEUE_SIZE = 1000           # Заданий, подготовленных заранее (остальные ждут в генераторе)
+    RENDER_CACHE_SIZE = 256            # Различных текстов одного поста в кэше рендера
+    SEND_MAX_ATTEMPTS = 5              # Попыток доставки одному получателю
+    SEND_RETRY_BASE_DELAY = 1.0        # Первая задержка повтора при сетевой ошибке (сек)
+    SEND_RETRY_MAX_DELAY = 60.0        # Максимальная задержка повтора (сек)
+    
+    # Очередь рассылок в БД (outbox)
+    OUTBOX_INSERT_CHUNK = 500          # Максимум доставок в одной вставке (первая порция меньше)
+    OUTBOX_FLUSH_BATCH = 200           # Результатов доставки в одной транзакции
+    OUTBOX_FLUSH_INTERVAL = 1.0        # Не реже чем раз в столько секунд
+    OUTBOX_RETENTION_DAYS = 7          # Сколько хранить завершенные задания
+    # Максимальный возраст задания для досылки после перезапуска (сек)
+    OUTBOX_MAX_AGE = {
+        "food": 600,
+        "totem": 120
+    }
+    
+    # Отдельные процессы-отправители (0 - рассылка в процессе бота)
+    SENDER_PROCESSES = 0
+    SENDER_CLAIM_BATCH = 200           # Доставок, забираемых процессом за раз
+    SENDER_POLL_INTERVAL = 0.2         # Пауза опроса outbox, когда работы нет (сек)
+    SENDER_CLAIM_TIMEOUT = 300         # Через сколько секунд забранные, но не отмеченные доставки возвращаются в очередь
+    
+    # Защита от повторных постов канала: сколько помнить отпечаток поста (сек)
+    DEDUP_WINDOW = {
+        "food": 120,
+        "totem": 900
+    }
+    DEDUP_MAX_ENTRIES = 1000           # Максимум отпечатков в памяти
+    
+    # Окно объединения постов о еде в одно уведомление (сек, 0 - выключено)
+    FOOD_COALESCE_WINDOW = 0
+    
+    # За сколько секунд непрерывная проверка проходит всех пользователей
+    SUBSCRIPTION_CHECK_INTERVAL = 21600  # 6 часов
+    # Подписка отслеживается по chat_member, проверка только сверяет пропущенные события
+    SWEEP_CONCURRENCY = 2              # Одновременных запросов get_chat_member при проверке
+    SWEEP_RATE = 5                     # Запросов get_chat_member в секунду при проверке
+    SWEEP_TICK = 60                    # Как часто проверяется очередной срез пользователей (сек)
+    SWEEP_UPDATE_CHUNK = 500           # Проверенных пользователей в одной транзакции
+    SWEEP_PROGRESS_EVERY = 5000        # Как часто писать прогресс проверки в лог (пользователей)
+    
+    # Кэш get_chat_member (подписка на группу)
+    MEMBERSHIP_CACHE_TTL = 300         # Сколько помнить, что пользователь в группе (сек)
+    MEMBERSHIP_CACHE_NEGATIVE_TTL = 10 # Сколько помнить, что не в группе (сек)
+    MEMBERSHIP_CACHE_SIZE = 10000      # Максимум записей
     
     # Настройки группы для публикации
     PUBLISH_GROUP_ID = -5212603352  # Тот же ID что и для проверки подписок
@@ -1,21 +1,189 @@
 import sqlite3
+import asyncio
+import functools
+import json
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import AsyncIterator, List, Dict, Optional, Set, Tuple
 from config import Config
+from utils.subscription_index import subscription_index
 
 logger = logging.getLogger(__name__)
 
+# Статусы строк outbox_deliveries
+OUTBOX_PENDING = 0
+OUTBOX_SENT = 1
+OUTBOX_FAILED = 2
+OUTBOX_CLAIMED = 3  # Забрана процессом-отправителем, результат еще не отмечен
+
+class ConnectionPool:
+    """Пул долгоживущих подключений к одному файлу SQLite"""
+    
+    # Один пул на файл БД, общий для всех экземпляров Database
+    _pools: Dict[str, "ConnectionPool"] = {}
+    _pools_lock = threading.Lock()
+    
+    def __init__(self, db_path: str, size: int = Config.DB_POOL_SIZE):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+    
+    @classmethod
+    def for_path(cls, db_path: str) -> "ConnectionPool":
+        """Получение общего пула для файла БД"""
+        with cls._pools_lock:
+            pool = cls._pools.get(db_path)
+            if pool is None:
+                pool = cls(db_path)
+                cls._pools[db_path] = pool
+            return pool
+    
+    @classmethod
+    def close_all_pools(cls):
+        """Закрытие всех пулов (при остановке бота)"""
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.close()
+    
+    def open_connection(self) -> sqlite3.Connection:
+        """Открытие нового подключения с настроенными PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=Config.DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{int(Config.DB_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size = {int(Config.DB_MMAP_SIZE)}")
+        conn.execute(f"PRAGMA busy_timeout = {int(Config.DB_BUSY_TIMEOUT_MS)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Взять подключение из пула (открывает новое, пока не достигнут лимит)"""
+        start = time.perf_counter()
+        waited = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self.open_connection()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                # Все подключения заняты - ждем возврата
+                waited = True
+                conn = self._idle.get()
+        
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._wait_total += elapsed
+            self._wait_max = max(self._wait_max, elapsed)
+            if waited:
+                self._waits += 1
+        return conn
+    
+    def release(self, conn: sqlite3.Connection):
+        """Вернуть подключение в пул"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+    
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: взять подключение и вернуть после использования"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Закрытие всех свободных подключений"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+    
+    def stats(self) -> Dict:
+        """Статистика пула: выдачи, ожидание, открытые подключения"""
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "idle": self._idle.qsize(),
+                "checkouts": checkouts,
+                "waits": self._waits,
+                "wait_total_ms": self._wait_total * 1000,
+                "wait_avg_ms": (self._wait_total / checkouts * 1000) if checkouts else 0.0,
+                "wait_max_ms": self._wait_max * 1000
+            }
+
 class Database:
     def __init__(self, db_path: str = Config.DATABASE_PATH):
         self.db_path = db_path
+        self.pool = ConnectionPool.for_path(db_path)
+        self._local = threading.local()
+        self._pinned = []
+        self._pinned_lock = threading.Lock()
         self.init_db()
     
+    def pin_thread_connection(self):
+        """Закрепить за текущим потоком собственное подключение (потоки AsyncDatabase)"""
+        conn = self.pool.open_connection()
+        self._local.conn = conn
+        with self._pinned_lock:
+            self._pinned.append(conn)
+    
+    def close_pinned_connections(self):
+        """Закрытие подключений, закрепленных за потоками"""
+        with self._pinned_lock:
+            pinned = self._pinned
+            self._pinned = []
+        for conn in pinned:
+            conn.close()
+    
+    @contextmanager
     def get_connection(self):
-        """Создание подключения к БД"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Подключение из пула (транзакция фиксируется при выходе из блока)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            # Поток с закрепленным подключением - пул не нужен
+            with conn:
+                yield conn
+            return
+        
+        with self.pool.connection() as conn:
+            with conn:
+                yield conn
     
     def init_db(self):
         """Инициализация таблиц базы данных"""
@@ -57,11 +225,99 @@ class Database:
                 )
             ''')
             
+            # Очередь рассылок (outbox): задание на каждый пост канала
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox_jobs (
+                    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    source_message_id INTEGER,
+                    posted_at REAL,
+                    status TEXT DEFAULT 'pending',
+                    total INTEGER DEFAULT 0,
+                    stored INTEGER DEFAULT 0,
+                    source TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+            
+            # Тексты рассылки (один текст на много получателей)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox_payloads (
+                    payload_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    parse_mode TEXT,
+                    FOREIGN KEY (job_id) REFERENCES outbox_jobs (job_id) ON DELETE CASCADE
+                )
+            ''')
+            
+            # Доставка каждому получателю
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox_deliveries (
+                    delivery_id INTEGER PRIMARY KEY,
+                    job_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    payload_id INTEGER NOT NULL,
+                    status INTEGER DEFAULT 0,
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT,
+                    claimed_by INTEGER,
+                    claimed_at REAL,
+                    sent_at REAL,
+                    UNIQUE (job_id, user_id)
+                )
+            ''')
+            
+            # Задержка доставки по постам (сводка гистограммы одного прогона рассылки)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS post_latency (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER,
+                    kind TEXT NOT NULL,
+                    source_message_id INTEGER,
+                    delivered INTEGER,
+                    p50 REAL,
+                    p90 REAL,
+                    p99 REAL,
+                    max REAL,
+                    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Отпечатки уже разосланных постов канала (защита от повторов)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS seen_posts (
+                    fingerprint TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            
+            # Положение непрерывной проверки подписок (переживает перезапуск)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sweep_state (
+                    name TEXT PRIMARY KEY,
+                    rotation INTEGER DEFAULT 0,
+                    rotation_started REAL,
+                    rotation_checked INTEGER DEFAULT 0,
+                    last_tick REAL
+                )
+            ''')
+            
             # Создаем индексы для ускорения запросов
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_subscribed ON users(is_subscribed)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_check ON users(last_check, user_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_fruits_user ON user_fruits(user_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_fruits_fruit ON user_fruits(fruit_name)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_exceptions_user ON subscription_exceptions(user_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_jobs_status ON outbox_jobs(status)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_payloads_job ON outbox_payloads(job_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_deliveries_job ON outbox_deliveries(job_id)')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outbox_deliveries_open
+                ON outbox_deliveries(job_id, delivery_id) WHERE status IN (0, 3)
+            ''')
             
             conn.commit()
         logger.info("Database initialized with indexes")
@@ -89,6 +345,8 @@ class Database:
                     ''', (user_id, username, language))
                 
                 conn.commit()
+                if not existing_user:
+                    subscription_index.on_user_added(user_id, language)
                 logger.info(f"User {user_id} added/updated with username: {username}")
                 return True
             except Exception as e:
@@ -103,6 +361,7 @@ class Database:
                 UPDATE users SET language = ? WHERE user_id = ?
             ''', (language, user_id))
             conn.commit()
+        subscription_index.on_language_changed(user_id, language)
     
     def update_subscription(self, user_id: int, is_subscribed: bool):
         """Обновление статуса подписки"""
@@ -114,6 +373,30 @@ class Database:
                 WHERE user_id = ?
             ''', (1 if is_subscribed else 0, datetime.now(), user_id))
             conn.commit()
+        subscription_index.on_subscription_changed(user_id, is_subscribed)
+    
+    def update_subscriptions(self, rows: List[Tuple[int, bool]], checked: List[int] = ()):
+        """
+        Пакетное обновление статуса подписки одной транзакцией
+        
+        Args:
+            rows: список (user_id, is_subscribed) - только изменившиеся
+            checked: проверенные без изменений (обновляется только last_check)
+        """
+        now = datetime.now()
+        with self.get_connection() as conn:
+            conn.executemany('''
+                UPDATE users 
+                SET is_subscribed = ?, last_check = ?
+                WHERE user_id = ?
+            ''', [(1 if is_subscribed else 0, now, user_id) for user_id, is_subscribed in rows])
+            conn.executemany(
+                'UPDATE users SET last_check = ? WHERE user_id = ?',
+                [(now, user_id) for user_id in checked]
+            )
+            conn.commit()
+        for user_id, is_subscribed in rows:
+            subscription_index.on_subscription_changed(user_id, is_subscribed)
     
     def get_user(self, user_id: int) -> Optional[Dict]:
         """Получение информации о пользователе"""
@@ -146,6 +429,7 @@ class Database:
                     INSERT INTO user_fruits (user_id, fruit_name) VALUES (?, ?)
                 ''', (user_id, fruit))
             conn.commit()
+        subscription_index.on_fruits_changed(user_id, fruits)
     
     def update_totem_settings(self, user_id: int, free_totems: bool = None, paid_totems: bool = None):
         """Обновление настроек тотемов"""
@@ -167,6 +451,7 @@ class Database:
                 query = f"UPDATE users SET {', '.join(updates)} WHERE user_id = ?"
                 cursor.execute(query, params)
                 conn.commit()
+        subscription_index.on_totems_changed(user_id, free_totems, paid_totems)
     
     def get_all_users(self) -> List[Dict]:
         """Получение списка всех пользователей"""
@@ -213,6 +498,108 @@ class Database:
             ''')
             return [row[0] for row in cursor.fetchall()]
     
+    def resolve_food_recipients(self, fruit_names: List[str]) -> List[Dict]:
+        """
+        Получатели уведомления о еде одним запросом
+        
+        Returns:
+            Список {"user_id", "language", "fruits"}, где fruits - фрукты поста
+            (в порядке поста), на которые подписан пользователь (с учетом 'all')
+        """
+        names = list(dict.fromkeys(fruit_names))
+        if not names:
+            return []
+        
+        placeholders = ", ".join("?" for _ in names)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT u.user_id, u.language, GROUP_CONCAT(uf.fruit_name, '|') AS matched
+                FROM users u
+                JOIN user_fruits uf ON u.user_id = uf.user_id
+                WHERE u.is_subscribed = 1
+                AND uf.fruit_name IN ({placeholders}, 'all')
+                GROUP BY u.user_id
+            ''', names)
+            
+            recipients = []
+            for user_id, language, matched in cursor:
+                subscribed = set(matched.split("|"))
+                if "all" in subscribed:
+                    fruits = names
+                else:
+                    fruits = [name for name in names if name in subscribed]
+                recipients.append({
+                    "user_id": user_id,
+                    "language": language or "RUS",
+                    "fruits": fruits
+                })
+            return recipients
+    
+    def resolve_totem_recipients(self, is_free: bool) -> List[Dict]:
+        """Получатели уведомления о тотеме с языком одним запросом"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            column = "free_totems" if is_free else "paid_totems"
+            cursor.execute(f'''
+                SELECT user_id, language FROM users 
+                WHERE is_subscribed = 1 AND {column} = 1
+            ''')
+            return [
+                {"user_id": user_id, "language": language or "RUS"}
+                for user_id, language in cursor
+            ]
+    
+    def load_subscription_snapshot(self) -> Tuple[List[Tuple], List[Tuple]]:
+        """Снимок users + user_fruits для построения индекса подписок"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, language, is_subscribed, free_totems, paid_totems FROM users
+            ''')
+            users = [tuple(row) for row in cursor.fetchall()]
+            cursor.execute('SELECT user_id, fruit_name FROM user_fruits')
+            fruits = [tuple(row) for row in cursor.fetchall()]
+            return users, fruits
+    
+    def get_sweep_users(self) -> List[Tuple[int, int, str]]:
+        """Пользователи для проверки подписок: (user_id, is_subscribed, language)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT user_id, is_subscribed, language FROM users ORDER BY user_id')
+            return [tuple(row) for row in cursor.fetchall()]
+    
+    def get_stalest_users(self, limit: int) -> List[Tuple[int, int, str]]:
+        """Пользователи, дольше всех не проверявшиеся (сначала ни разу не проверенные)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, is_subscribed, language FROM users
+                ORDER BY last_check, user_id
+                LIMIT ?
+            ''', (limit,))
+            return [tuple(row) for row in cursor.fetchall()]
+    
+    def count_users(self) -> int:
+        with self.get_connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    
+    def get_sweep_state(self, name: str) -> Optional[Dict]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM sweep_state WHERE name = ?', (name,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+    
+    def save_sweep_state(self, name: str, state: Dict):
+        """Контрольная точка проверки подписок"""
+        with self.get_connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO sweep_state (name, rotation, rotation_started, rotation_checked, last_tick)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (name, state["rotation"], state["rotation_started"], state["rotation_checked"], state["last_tick"]))
+            conn.commit()
+    
     def get_statistics(self) -> Dict:
         """Получение статистики"""
         with self.get_connection() as conn:
@@ -277,6 +664,13 @@ class Database:
             cursor.execute('SELECT * FROM subscription_exceptions WHERE user_id = ?', (user_id,))
             return cursor.fetchone() is not None
     
+    def get_exception_ids(self) -> Set[int]:
+        """Множество user_id в исключениях (одним запросом)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT user_id FROM subscription_exceptions')
+            return {row[0] for row in cursor.fetchall()}
+    
     def add_exception(self, user_id: int, admin_id: int) -> bool:
         """Добавление пользователя в исключения"""
         with self.get_connection() as conn:
@@ -321,4 +715,463 @@ class Database:
         user = self.get_user(user_id)
         if user:
             user['is_exception'] = self.is_exception(user_id)
-        return user
\ No newline at end of file
+        return user
+    
+    # ========== ОЧЕРЕДЬ РАССЫЛОК (OUTBOX) ==========
+    
+    def create_outbox_job(
+        self,
+        kind: str,
+        source_message_id: Optional[int],
+        posted_at: Optional[float] = None,
+        source: Optional[Dict] = None
+    ) -> int:
+        """
+        Создание пустого задания рассылки (доставки добавляются порциями)
+        
+        Args:
+            source: описание поста (JSON), по которому можно заново построить
+                доставки, если запись задания прервалась
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO outbox_jobs (kind, source_message_id, posted_at, source) VALUES (?, ?, ?, ?)',
+                (kind, source_message_id, posted_at, json.dumps(source, ensure_ascii=False) if source is not None else None)
+            )
+            conn.commit()
+            return cursor.lastrowid
+    
+    def add_outbox_deliveries(self, job_id: int, deliveries: List[Tuple], payload_ids: Dict) -> int:
+        """
+        Пакетная вставка порции доставок задания
+        
+        Args:
+            deliveries: список (user_id, text, parse_mode)
+            payload_ids: {(text, parse_mode): payload_id} - общий для всех порций
+                задания, чтобы одинаковые тексты сохранялись один раз
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            rows = []
+            for user_id, text, parse_mode in deliveries:
+                key = (text, parse_mode)
+                payload_id = payload_ids.get(key)
+                if payload_id is None:
+                    cursor.execute(
+                        'INSERT INTO outbox_payloads (job_id, text, parse_mode) VALUES (?, ?, ?)',
+                        (job_id, text, parse_mode)
+                    )
+                    payload_id = payload_ids[key] = cursor.lastrowid
+                rows.append((job_id, user_id, payload_id))
+            
+            # Уже записанные получатели (дозапись после сбоя) пропускаются
+            cursor.executemany(
+                'INSERT OR IGNORE INTO outbox_deliveries (job_id, user_id, payload_id) VALUES (?, ?, ?)',
+                rows
+            )
+            inserted = cursor.rowcount
+            cursor.execute('UPDATE outbox_jobs SET total = total + ? WHERE job_id = ?', (inserted, job_id))
+            conn.commit()
+            return inserted
+    
+    def get_pending_deliveries(self, job_id: int, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        """Порция неотправленных доставок задания с текстом (в порядке записи, после after_id)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT d.delivery_id, d.user_id, d.attempts, p.text, p.parse_mode
+                FROM outbox_deliveries d
+                JOIN outbox_payloads p ON d.payload_id = p.payload_id
+                WHERE d.job_id = ? AND d.delivery_id > ? AND d.status = ?
+                ORDER BY d.delivery_id
+                LIMIT ?
+            ''', (job_id, after_id, OUTBOX_PENDING, limit))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def mark_deliveries(self, rows: List[Tuple]):
+        """
+        Пакетная отметка результатов доставки
+        
+        Args:
+            rows: список (status, attempts, error, sent_at, job_id, user_id)
+        """
+        with self.get_connection() as conn:
+            conn.executemany('''
+                UPDATE outbox_deliveries
+                SET status = ?, attempts = ?, error = ?, sent_at = ?, claimed_by = NULL
+                WHERE job_id = ? AND user_id = ?
+            ''', rows)
+            conn.commit()
+    
+    def mark_outbox_stored(self, job_id: int):
+        """Все доставки задания записаны (задание можно закрыть, когда они разосланы)"""
+        with self.get_connection() as conn:
+            conn.execute('UPDATE outbox_jobs SET stored = 1 WHERE job_id = ?', (job_id,))
+            conn.commit()
+    
+    def claim_deliveries(self, worker_id: int, limit: int, stale_before: float) -> List[Dict]:
+        """
+        Забрать порцию доставок для процесса-отправителя
+        
+        Берутся неотправленные строки незавершенных заданий (тотемы раньше еды)
+        и забранные другим процессом до stale_before - его считаем упавшим.
+        Выбор и отметка выполняются в одной транзакции записи, поэтому
+        одну строку не заберут два процесса.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('''
+                    SELECT d.delivery_id, d.job_id, d.user_id, d.attempts, p.text, p.parse_mode,
+                           j.kind, j.source_message_id, j.posted_at
+                    FROM outbox_deliveries d
+                    JOIN outbox_jobs j ON d.job_id = j.job_id
+                    JOIN outbox_payloads p ON d.payload_id = p.payload_id
+                    WHERE j.status = 'pending' AND d.status IN (0, 3)
+                      AND (d.status = ? OR d.claimed_at < ?)
+                    ORDER BY CASE j.kind WHEN 'totem' THEN 0 WHEN 'food' THEN 1 ELSE 2 END, d.delivery_id
+                    LIMIT ?
+                ''', (OUTBOX_PENDING, stale_before, limit))
+                rows = [dict(row) for row in cursor.fetchall()]
+                cursor.executemany(
+                    'UPDATE outbox_deliveries SET status = ?, claimed_by = ?, claimed_at = ? WHERE delivery_id = ?',
+                    [(OUTBOX_CLAIMED, worker_id, time.time(), row["delivery_id"]) for row in rows]
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return rows
+    
+    def release_claims(self, worker_id: int) -> int:
+        """Вернуть в очередь доставки, забранные процессом, но не отправленные"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE outbox_deliveries SET status = ?, claimed_by = NULL WHERE status = ? AND claimed_by = ?',
+                (OUTBOX_PENDING, OUTBOX_CLAIMED, worker_id)
+            )
+            conn.commit()
+            return cursor.rowcount
+    
+    def complete_outbox_jobs(self) -> List[Dict]:
+        """Закрыть записанные задания без открытых доставок, вернуть закрытые"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT job_id, kind, source_message_id, posted_at FROM outbox_jobs j
+                WHERE status = 'pending' AND stored = 1 AND NOT EXISTS (
+                    SELECT 1 FROM outbox_deliveries d
+                    WHERE d.job_id = j.job_id AND d.status IN (0, 3)
+                )
+            ''')
+            jobs = [dict(row) for row in cursor.fetchall()]
+            cursor.executemany(
+                "UPDATE outbox_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE job_id = ?",
+                [(job["job_id"],) for job in jobs]
+            )
+            conn.commit()
+            return jobs
+    
+    def get_delivery_latencies(self, job_id: int) -> List[float]:
+        """Задержки успешных доставок задания: от поста в канале до отправки (сек)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT d.sent_at - j.posted_at
+                FROM outbox_deliveries d
+                JOIN outbox_jobs j ON d.job_id = j.job_id
+                WHERE d.job_id = ? AND d.status = ? AND d.sent_at IS NOT NULL AND j.posted_at IS NOT NULL
+            ''', (job_id, OUTBOX_SENT))
+            return [row[0] for row in cursor.fetchall()]
+    
+    def finish_outbox_job(self, job_id: int, status: str = "done"):
+        """Закрытие задания (done - разослано, expired - устарело)"""
+        with self.get_connection() as conn:
+            conn.execute(
+                'UPDATE outbox_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE job_id = ?',
+                (status, job_id)
+            )
+            conn.commit()
+    
+    def get_unfinished_outbox_jobs(self) -> List[Dict]:
+        """Незавершенные задания с возрастом в секундах (для продолжения после перезапуска)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT job_id, kind, total, stored, source, source_message_id, posted_at,
+                       (julianday('now') - julianday(created_at)) * 86400 AS age
+                FROM outbox_jobs
+                WHERE status = 'pending'
+                ORDER BY job_id
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def prune_outbox(self, days: int) -> int:
+        """Удаление закрытых заданий старше days дней"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT job_id FROM outbox_jobs
+                WHERE status != 'pending' AND created_at < datetime('now', ?)
+            ''', (f"-{days} days",))
+            job_ids = [(row[0],) for row in cursor.fetchall()]
+            if job_ids:
+                cursor.executemany('DELETE FROM outbox_deliveries WHERE job_id = ?', job_ids)
+                cursor.executemany('DELETE FROM outbox_payloads WHERE job_id = ?', job_ids)
+                cursor.executemany('DELETE FROM outbox_jobs WHERE job_id = ?', job_ids)
+            conn.commit()
+            return len(job_ids)
+    
+    def get_outbox_stats(self) -> Dict:
+        """Состояние очереди рассылок"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, COUNT(*) FROM outbox_jobs GROUP BY status')
+            jobs = {status: count for status, count in cursor.fetchall()}
+            cursor.execute('''
+                SELECT COUNT(*) FROM outbox_deliveries d
+                JOIN outbox_jobs j ON d.job_id = j.job_id
+                WHERE j.status = 'pending' AND d.status IN (?, ?)
+            ''', (OUTBOX_PENDING, OUTBOX_CLAIMED))
+            return {
+                "pending_jobs": jobs.get("pending", 0),
+                "done_jobs": jobs.get("done", 0),
+                "expired_jobs": jobs.get("expired", 0),
+                "pending_deliveries": cursor.fetchone()[0]
+            }
+    
+    # ========== ЗАДЕРЖКА ДОСТАВКИ ==========
+    
+    def save_post_latency(self, job_id: int, kind: str, source_message_id: Optional[int], summary: Dict):
+        """Сохранение сводки задержки доставки одного поста"""
+        with self.get_connection() as conn:
+            conn.execute('''
+                INSERT INTO post_latency (job_id, kind, source_message_id, delivered, p50, p90, p99, max)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                job_id, kind, source_message_id, summary["count"],
+                summary["p50"], summary["p90"], summary["p99"], summary["max"]
+            ))
+            conn.commit()
+    
+    def get_recent_post_latency(self, limit: int = 10) -> List[Dict]:
+        """Последние сводки задержки по постам"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM post_latency ORDER BY id DESC LIMIT ?', (limit,))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    # ========== ОТПЕЧАТКИ ПОСТОВ ==========
+    
+    def load_seen_posts(self, now: float) -> List[Tuple]:
+        """Неистекшие отпечатки постов (fingerprint, kind, expires_at); истекшие удаляются"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM seen_posts WHERE expires_at <= ?', (now,))
+            cursor.execute('''
+                SELECT fingerprint, kind, expires_at FROM seen_posts
+                WHERE expires_at > ? ORDER BY expires_at
+            ''', (now,))
+            rows = [tuple(row) for row in cursor.fetchall()]
+            conn.commit()
+            return rows
+    
+    def remember_post(self, fingerprint: str, kind: str, expires_at: float):
+        """Сохранение отпечатка разосланного поста (заодно удаляются истекшие)"""
+        with self.get_connection() as conn:
+            conn.execute('DELETE FROM seen_posts WHERE expires_at <= ?', (time.time(),))
+            conn.execute(
+                'INSERT OR REPLACE INTO seen_posts (fingerprint, kind, expires_at) VALUES (?, ?, ?)',
+                (fingerprint, kind, expires_at)
+            )
+            conn.commit()
+    
+    def get_pool_stats(self) -> Dict:
+        """Статистика пула подключений"""
+        return self.pool.stats()
+
+
+def _read(name: str):
+    """Асинхронная обертка метода Database для пула потоков чтения"""
+    method = getattr(Database, name)
+    
+    async def wrapper(self, *args, **kwargs):
+        return await self._call("reads", method, args, kwargs)
+    
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+def _write(name: str):
+    """Асинхронная обертка метода Database для единственного потока записи"""
+    method = getattr(Database, name)
+    
+    async def wrapper(self, *args, **kwargs):
+        return await self._call("writes", method, args, kwargs)
+    
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+class AsyncDatabase:
+    """
+    Неблокирующий фасад над Database для обработчиков aiogram.
+    
+    Чтение выполняется в отдельном пуле потоков (у каждого потока свое подключение),
+    запись - в единственном потоке записи, поэтому медленный запрос или
+    блокировка записи не останавливают event loop.
+    
+    База (миграция схемы) и потоки открываются при первом обращении: импорт
+    модуля, например в процессе-отправителе, ничего не создает.
+    """
+    
+    def __init__(self, db_path: str = Config.DATABASE_PATH, readers: int = Config.DB_READER_THREADS):
+        self.db_path = db_path
+        self.readers = readers
+        self._db: Optional[Database] = None
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._open_lock = threading.Lock()
+        self._stats = {
+            "reads": {"calls": 0, "pending": 0, "total": 0.0},
+            "writes": {"calls": 0, "pending": 0, "total": 0.0}
+        }
+    
+    @property
+    def db(self) -> Database:
+        """Database и пулы потоков (создаются при первом обращении)"""
+        if self._db is None:
+            with self._open_lock:
+                if self._db is None:
+                    db = Database(self.db_path)
+                    self._executors = {
+                        "reads": ThreadPoolExecutor(
+                            max_workers=self.readers,
+                            thread_name_prefix="db-reader",
+                            initializer=db.pin_thread_connection
+                        ),
+                        "writes": ThreadPoolExecutor(
+                            max_workers=1,
+                            thread_name_prefix="db-writer",
+                            initializer=db.pin_thread_connection
+                        )
+                    }
+                    self._db = db
+        return self._db
+    
+    async def _call(self, kind: str, method, args, kwargs):
+        """Выполнение метода Database в пуле потоков kind (reads - чтение, writes - запись)"""
+        db = self.db
+        executor = self._executors[kind]
+        stats = self._stats[kind]
+        stats["pending"] += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                executor, functools.partial(method, db, *args, **kwargs)
+            )
+        finally:
+            stats["pending"] -= 1
+            stats["calls"] += 1
+            stats["total"] += time.perf_counter() - start
+    
+    def stats(self) -> Dict:
+        """Статистика фасада: число вызовов, очередь и среднее время"""
+        result = {"pool": self.db.get_pool_stats()}
+        for kind, stats in self._stats.items():
+            calls = stats["calls"]
+            result[kind] = {
+                "calls": calls,
+                "pending": stats["pending"],
+                "avg_ms": (stats["total"] / calls * 1000) if calls else 0.0
+            }
+        return result
+    
+    def close(self):
+        """Остановка потоков и закрытие их подключений"""
+        if self._db is None:
+            return
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+        self._db.close_pinned_connections()
+    
+    async def resolve_food_recipients(self, fruit_names: List[str]) -> List[Dict]:
+        """Получатели уведомления о еде (из индекса подписок, если он загружен)"""
+        if subscription_index.loaded:
+            return subscription_index.resolve_food_recipients(fruit_names)
+        return await self._call("reads", Database.resolve_food_recipients, (fruit_names,), {})
+    
+    async def resolve_totem_recipients(self, is_free: bool) -> List[Dict]:
+        """Получатели уведомления о тотеме (из индекса подписок, если он загружен)"""
+        if subscription_index.loaded:
+            return subscription_index.resolve_totem_recipients(is_free)
+        return await self._call("reads", Database.resolve_totem_recipients, (is_free,), {})
+    
+    async def iter_food_recipients(self, fruit_names: List[str]) -> AsyncIterator[Dict]:
+        """Получатели уведомления о еде потоком (для рассылки без списка в памяти)"""
+        if subscription_index.loaded:
+            for recipient in subscription_index.iter_food_recipients(fruit_names):
+                yield recipient
+            return
+        for recipient in await self.resolve_food_recipients(fruit_names):
+            yield recipient
+    
+    async def iter_totem_recipients(self, is_free: bool) -> AsyncIterator[Dict]:
+        """Получатели уведомления о тотеме потоком"""
+        if subscription_index.loaded:
+            for recipient in subscription_index.iter_totem_recipients(is_free):
+                yield recipient
+            return
+        for recipient in await self.resolve_totem_recipients(is_free):
+            yield recipient
+    
+    # Чтение
+    get_user = _read("get_user")
+    get_user_fruits = _read("get_user_fruits")
+    get_all_users = _read("get_all_users")
+    get_active_subscribers = _read("get_active_subscribers")
+    get_users_for_fruit = _read("get_users_for_fruit")
+    get_users_for_totem = _read("get_users_for_totem")
+    get_statistics = _read("get_statistics")
+    get_sweep_users = _read("get_sweep_users")
+    get_stalest_users = _read("get_stalest_users")
+    count_users = _read("count_users")
+    get_sweep_state = _read("get_sweep_state")
+    is_exception = _read("is_exception")
+    get_exceptions = _read("get_exceptions")
+    get_exception_ids = _read("get_exception_ids")
+    get_user_with_exception_status = _read("get_user_with_exception_status")
+    get_pending_deliveries = _read("get_pending_deliveries")
+    get_unfinished_outbox_jobs = _read("get_unfinished_outbox_jobs")
+    get_outbox_stats = _read("get_outbox_stats")
+    get_recent_post_latency = _read("get_recent_post_latency")
+    get_delivery_latencies = _read("get_delivery_latencies")
+    
+    # Запись
+    add_user = _write("add_user")
+    update_user_language = _write("update_user_language")
+    update_subscription = _write("update_subscription")
+    update_subscriptions = _write("update_subscriptions")
+    save_sweep_state = _write("save_sweep_state")
+    update_user_fruits = _write("update_user_fruits")
+    update_totem_settings = _write("update_totem_settings")
+    update_username = _write("update_username")
+    add_exception = _write("add_exception")
+    remove_exception = _write("remove_exception")
+    create_outbox_job = _write("create_outbox_job")
+    add_outbox_deliveries = _write("add_outbox_deliveries")
+    mark_deliveries = _write("mark_deliveries")
+    finish_outbox_job = _write("finish_outbox_job")
+    mark_outbox_stored = _write("mark_outbox_stored")
+    claim_deliveries = _write("claim_deliveries")
+    release_claims = _write("release_claims")
+    complete_outbox_jobs = _write("complete_outbox_jobs")
+    prune_outbox = _write("prune_outbox")
+    remember_post = _write("remember_post")
+    save_post_latency = _write("save_post_latency")
+
+# Общий экземпляр для обработчиков и фоновых задач
+async_db = AsyncDatabase()
\ No newline at end of file
@@ -5,18 +5,30 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime, timedelta
 import logging
-import asyncio
 from typing import List, Dict
 from backup_utils import backup_manager
 import os
 
-from database import Database
+from database import async_db
 from config import Config
 from utils.messages import locale_manager
+from utils.subscription_index import subscription_index
+from utils.rate_limiter import rate_limiter, send_lane
+from utils.outbox import outbox
+from utils.sender_pool import sender_pool
+from utils.shadow import shadow_recorder
+from handlers.membership import membership_stats
+from utils.subscription import subscription_sweep
+from utils.membership_cache import membership_cache
+from utils.render_cache import render_stats
+from utils.dedup import post_deduplicator
+from utils.coalesce import food_coalescer
+from utils.latency import latency_tracker, format_seconds
+from aiogram.exceptions import TelegramRetryAfter
 
 logger = logging.getLogger(__name__)
 router = Router()
-db = Database()
+db = async_db
 
 # ========== СПИСОК АДМИНИСТРАТОРОВ ==========
 ADMIN_IDS = [1835558263]  # ВАШ ID
@@ -50,7 +62,7 @@ active_chats = {}  # {user_id: admin_id}
 
 async def get_user_page(page: int = 0) -> tuple[str, InlineKeyboardMarkup, int]:
     """Получение страницы пользователей"""
-    users = db.get_all_users()
+    users = await db.get_all_users()
     total_pages = (len(users) + USER_PER_PAGE - 1) // USER_PER_PAGE if users else 1
     
     start_idx = page * USER_PER_PAGE
@@ -126,7 +138,7 @@ async def show_stats(message_or_callback):
         return
     
     try:
-        stats = db.get_statistics()
+        stats = await db.get_statistics()
         
         # Форматируем статистику фруктов
         fruit_stats_text = ""
@@ -139,7 +151,7 @@ async def show_stats(message_or_callback):
         
         # Получаем пользователей за последние 7 дней
         week_ago = datetime.now() - timedelta(days=7)
-        all_users = db.get_all_users()
+        all_users = await db.get_all_users()
         recent_users = []
         
         for user in all_users:
@@ -341,7 +353,7 @@ async def broadcast_by_language(message_or_callback, state: FSMContext, lang_fil
             await message.answer("⛔ У вас нет прав администратора")
         return
     
-    users = db.get_all_users()
+    users = await db.get_all_users()
     
     if lang_filter:
         if lang_filter == "RUS":
@@ -546,34 +558,40 @@ async def broadcast_confirmation(callback: types.CallbackQuery, state: FSMContex
     failed_count = 0
     failed_list = []
     
-    # Рассылаем сообщение
-    for user in users:
-        try:
-            # Получаем оригинальное сообщение
-            original_message = await callback.bot.copy_message(
-                chat_id=user["user_id"],
-                from_chat_id=chat_id,
-                message_id=message_id
-            )
-            success_count += 1
-            
-            # Задержка чтобы не превысить лимиты Telegram
-            await asyncio.sleep(0.05)
-            
-        except Exception as e:
-            failed_count += 1
-            error_msg = str(e)
-            user_info = f"ID: {user['user_id']}"
-            
-            if user.get("username"):
-                user_info += f" (@{user['username']})"
-            
-            if "Forbidden" in error_msg or "bot was blocked" in error_msg:
-                failed_list.append(f"{user_info} (заблокировал бота)")
-            elif "chat not found" in error_msg:
-                failed_list.append(f"{user_info} (чат не найден)")
-            else:
-                failed_list.append(f"{user_info} ({error_msg[:30]}...)")
+    # Рассылаем сообщение (темп задает общий ограничитель лимитов Telegram,
+    # полоса broadcast уступает уведомлениям о тотемах и еде)
+    with send_lane("broadcast"):
+        for user in users:
+            try:
+                try:
+                    await callback.bot.copy_message(
+                        chat_id=user["user_id"],
+                        from_chat_id=chat_id,
+                        message_id=message_id
+                    )
+                except TelegramRetryAfter:
+                    # Ограничитель уже поставил паузу - повторяем один раз
+                    await callback.bot.copy_message(
+                        chat_id=user["user_id"],
+                        from_chat_id=chat_id,
+                        message_id=message_id
+                    )
+                success_count += 1
+                
+            except Exception as e:
+                failed_count += 1
+                error_msg = str(e)
+                user_info = f"ID: {user['user_id']}"
+                
+                if user.get("username"):
+                    user_info += f" (@{user['username']})"
+                
+                if "Forbidden" in error_msg or "bot was blocked" in error_msg:
+                    failed_list.append(f"{user_info} (заблокировал бота)")
+                elif "chat not found" in error_msg:
+                    failed_list.append(f"{user_info} (чат не найден)")
+                else:
+                    failed_list.append(f"{user_info} ({error_msg[:30]}...)")
     
     # Формируем отчет
     report = (
@@ -609,7 +627,7 @@ async def admin_exceptions_callback(callback: types.CallbackQuery):
         await callback.answer("⛔ У вас нет прав администратора", show_alert=True)
         return
     
-    exceptions = db.get_exceptions() if hasattr(db, 'get_exceptions') else []
+    exceptions = await db.get_exceptions() if hasattr(db, 'get_exceptions') else []
     
     text = "📋 <b>Управление исключениями</b>\n\n"
     
@@ -685,7 +703,7 @@ async def exc_remove_start_callback(callback: types.CallbackQuery, state: FSMCon
         await callback.answer("⛔ У вас нет прав администратора", show_alert=True)
         return
     
-    exceptions = db.get_exceptions() if hasattr(db, 'get_exceptions') else []
+    exceptions = await db.get_exceptions() if hasattr(db, 'get_exceptions') else []
     
     if not exceptions:
         text = "📭 Нет исключений для удаления"
@@ -761,7 +779,7 @@ async def process_exception_input(message: Message, state: FSMContext):
         username = input_text[1:].lower()
         logger.info(f"Поиск по username: {username}")
         
-        users = db.get_all_users()
+        users = await db.get_all_users()
         for u in users:
             if u.get("username") and u["username"].lower() == username:
                 user = u
@@ -777,7 +795,7 @@ async def process_exception_input(message: Message, state: FSMContext):
         user_id = int(input_text)
         logger.info(f"Поиск по ID: {user_id}")
         
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         
         if not user:
             await message.answer(f"❌ Пользователь с ID {user_id} не найден.")
@@ -795,11 +813,11 @@ async def process_exception_input(message: Message, state: FSMContext):
     
     if action == "add":
         # Проверяем, есть ли уже исключение
-        if db.is_exception(user_id):
+        if await db.is_exception(user_id):
             await message.answer(f"⚠️ Пользователь @{username} уже в исключениях!")
         else:
             # Добавляем исключение
-            success = db.add_exception(user_id, message.from_user.id)
+            success = await db.add_exception(user_id, message.from_user.id)
             if success:
                 await message.answer(f"✅ Пользователь @{username} добавлен в исключения!")
             else:
@@ -807,7 +825,7 @@ async def process_exception_input(message: Message, state: FSMContext):
     
     elif action == "remove":
         # Удаляем исключение
-        success = db.remove_exception(user_id)
+        success = await db.remove_exception(user_id)
         if success:
             await message.answer(f"✅ Пользователь @{username} удален из исключений!")
         else:
@@ -863,7 +881,7 @@ async def process_user_selection(message: Message, state: FSMContext):
     
     # Ищем пользователя
     user = None
-    users = db.get_all_users()
+    users = await db.get_all_users()
     
     # По номеру
     if input_text.isdigit() and len(input_text) < 6:  # Номер из списка
@@ -885,7 +903,7 @@ async def process_user_selection(message: Message, state: FSMContext):
     # По ID (прямой ID пользователя)
     elif input_text.isdigit() and len(input_text) >= 6:
         user_id = int(input_text)
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
     
     if not user:
         await message.answer("❌ Пользователь не найден. Попробуйте еще раз или отправьте /cancel")
@@ -953,7 +971,7 @@ async def forward_admin_message(message: Message, state: FSMContext):
     
     if message.text == "/stop":
         # Завершаем чат
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         user_lang = user.get("language", "RUS") if user else "RUS"
         lang_code = "ru" if user_lang == "RUS" else "en"
         
@@ -1009,7 +1027,7 @@ async def handle_user_to_admin(message: Message):
         # Пользователь завершил чат
         try:
             user_info = f"ID: {user_id}"
-            user = db.get_user(user_id)
+            user = await db.get_user(user_id)
             if user and user.get("username"):
                 user_info += f" (@{user['username']})"
             
@@ -1027,7 +1045,7 @@ async def handle_user_to_admin(message: Message):
     try:
         # Получаем информацию о пользователе
         user_info = f"ID: {user_id}"
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         if user and user.get("username"):
             user_info += f" (@{user['username']})"
         
@@ -1115,8 +1133,8 @@ async def admin_detailed_stats_callback(callback: types.CallbackQuery):
         await callback.answer("⛔ У вас нет прав администратора", show_alert=True)
         return
     
-    stats = db.get_statistics()
-    exceptions = db.get_exceptions() if hasattr(db, 'get_exceptions') else []
+    stats = await db.get_statistics()
+    exceptions = await db.get_exceptions() if hasattr(db, 'get_exceptions') else []
     
     text = "📊 <b>Детальная статистика:</b>\n\n"
     text += f"👥 <b>Общая информация:</b>\n"
@@ -1407,6 +1425,9 @@ async def cmd_backup(message: Message):
         backup_name = f"database_backup_{timestamp}.db.gz"
         backup_path = os.path.join(backup_dir, backup_name)
         
+        # БД в режиме WAL - переносим журнал в основной файл перед копированием
+        backup_manager.checkpoint_wal()
+        
         with open("database.db", 'rb') as f_in:
             with gzip.open(backup_path, 'wb') as f_out:
                 shutil.copyfileobj(f_in, f_out)
@@ -1527,7 +1548,7 @@ async def cmd_test_exception(message: Message):
         return
     
     user_id = 1012045768  # @sakyrbaevnaa
-    is_exc = db.is_exception(user_id)
+    is_exc = await db.is_exception(user_id)
     
     await message.answer(f"🔍 Проверка исключения для {user_id}: {'✅ ЕСТЬ' if is_exc else '❌ НЕТ'}")
 
@@ -1540,7 +1561,7 @@ async def cmd_broadcast(message: Message, state: FSMContext):
         await message.answer("⛔ У вас нет прав администратора")
         return
     
-    users = db.get_all_users()
+    users = await db.get_all_users()
     
     await message.answer(
         f"📢 <b>Команда рассылки</b>\n\n"
@@ -1567,6 +1588,131 @@ async def cmd_exceptions(message: Message):
         data="admin_exceptions"
     ))
 
+@router.message(Command("perf"))
+async def cmd_perf(message: Message):
+    """Метрики производительности бота"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет прав администратора")
+        return
+    
+    db_stats = db.stats()
+    pool_stats = db_stats["pool"]
+    index_stats = subscription_index.stats()
+    limiter_stats = rate_limiter.stats()
+    outbox_db_stats = await db.get_outbox_stats()
+    outbox_stats = outbox.stats()
+    sender_stats = sender_pool.stats()
+    pool_line = (
+        f"• Процессов-отправителей: {sender_stats['alive']}/{sender_stats['processes']}, "
+        f"перезапусков {sender_stats['restarts']}, закрыто заданий {sender_stats['completed_jobs']}\n"
+        if sender_pool.enabled else "• Рассылка в процессе бота\n"
+    )
+    if Config.SHADOW_MODE:
+        shadow_stats = shadow_recorder.stats()
+        pool_line += (
+            f"• 🕶 Теневой режим: записано {shadow_stats['recorded']} отправок, "
+            f"{shadow_stats['sends_per_sec']:.1f}/с\n"
+        )
+    lane_lines = "".join(
+        f"• {lane}: в очереди {lane_stats['depth']}, отправок {lane_stats['granted']}, "
+        f"ожидание {lane_stats['wait_avg_ms']:.0f} мс (макс {lane_stats['wait_max_ms']:.0f})\n"
+        for lane, lane_stats in limiter_stats["lanes"].items()
+    )
+    dedup_stats = post_deduplicator.stats()
+    coalesce_stats = food_coalescer.stats()
+    member_stats = membership_stats()
+    sweep_stats = subscription_sweep.stats()
+    member_cache = membership_cache.stats()
+    latency_lines = "".join(
+        f"• {kind}: p50 {format_seconds(stats['p50'])}, p90 {format_seconds(stats['p90'])}, "
+        f"p99 {format_seconds(stats['p99'])} ({stats['count']} доставок)\n"
+        for kind, stats in latency_tracker.stats().items()
+    ) or "• Доставок еще не было\n"
+    render = render_stats.stats()
+    render_lines = "".join(
+        f"• {kind}: постов {stats['posts']}, текстов {stats['misses']} на "
+        f"{stats['hits'] + stats['misses']} получателей (попаданий {stats['hit_rate']:.0%})\n"
+        for kind, stats in render.items()
+    ) or "• Рассылок еще не было\n"
+    
+    text = (
+        "⚙️ <b>Производительность</b>\n\n"
+        "🗄 <b>Пул подключений SQLite:</b>\n"
+        f"• Открыто: {pool_stats['open']}/{pool_stats['size']} (свободно {pool_stats['idle']})\n"
+        f"• Выдач подключений: {pool_stats['checkouts']}\n"
+        f"• Ожиданий свободного: {pool_stats['waits']}\n"
+        f"• Среднее время получения: {pool_stats['wait_avg_ms']:.3f} мс\n"
+        f"• Максимальное время: {pool_stats['wait_max_ms']:.1f} мс\n\n"
+        "🧵 <b>Потоки БД:</b>\n"
+        f"• Чтение: {db_stats['reads']['calls']} запросов, в очереди {db_stats['reads']['pending']}, "
+        f"среднее {db_stats['reads']['avg_ms']:.2f} мс\n"
+        f"• Запись: {db_stats['writes']['calls']} запросов, в очереди {db_stats['writes']['pending']}, "
+        f"среднее {db_stats['writes']['avg_ms']:.2f} мс\n\n"
+        "🗂 <b>Индекс подписок:</b>\n"
+        f"• Загружен: {'✅' if index_stats['loaded'] else '❌'} ({index_stats['load_ms']:.0f} мс)\n"
+        f"• Пользователей: {index_stats['users']}, подписаны: {index_stats['subscribed']}\n"
+        f"• Подписка 'все фрукты': {index_stats['all_bucket']}\n"
+        f"• Поисков получателей: {index_stats['lookups']}, среднее {index_stats['lookup_avg_us']:.0f} мкс\n\n"
+        "🚦 <b>Лимиты Telegram:</b>\n"
+        f"• Отправок через ограничитель: {limiter_stats['acquired']}\n"
+        f"• Задержано: {limiter_stats['delayed']}, среднее ожидание {limiter_stats['wait_avg_ms']:.0f} мс\n"
+        f"• Ответов 429: {limiter_stats['retry_after']} "
+        f"(пауз: глобальных {limiter_stats['global_pauses']}, чатов {limiter_stats['chat_pauses']})\n\n"
+        "🛣 <b>Полосы приоритета:</b>\n"
+        f"{lane_lines}\n"
+        "📬 <b>Очередь рассылок (outbox):</b>\n"
+        f"• Заданий: в работе {outbox_db_stats['pending_jobs']} (активно {outbox_stats['active_jobs']}), "
+        f"завершено {outbox_db_stats['done_jobs']}, устарело {outbox_db_stats['expired_jobs']}\n"
+        f"• Ожидают доставки: {outbox_db_stats['pending_deliveries']}\n"
+        f"• Не записано результатов: {outbox_stats['buffered']}\n"
+        f"{pool_line}\n"
+        "🧩 <b>Кэш рендера уведомлений:</b>\n"
+        f"{render_lines}\n"
+        "♻️ <b>Повторы постов:</b>\n"
+        f"• Проверено: {dedup_stats['checked']}, отброшено: {dedup_stats['duplicates']}\n"
+        f"• Отпечатков в памяти: {dedup_stats['entries']}\n\n"
+        "🧺 <b>Объединение постов о еде:</b>\n"
+        f"• Окно: {coalesce_stats['window']} с{' (выключено)' if not coalesce_stats['window'] else ''}\n"
+        f"• Постов: {coalesce_stats['posts']}, присоединено к пачкам: {coalesce_stats['merged_posts']}\n"
+        f"• Сэкономлено отправок: {coalesce_stats['sends_saved']}\n\n"
+        "👥 <b>Подписка на группу (chat_member):</b>\n"
+        f"• Событий: {member_stats['events']}, вступили {member_stats['joined']}, "
+        f"вышли {member_stats['left']}, без изменений {member_stats['ignored']}\n"
+        f"• Кэш get_chat_member: попаданий {member_cache['hits']}, запросов {member_cache['misses']}, "
+        f"объединено {member_cache['coalesced']} ({member_cache['hit_rate']:.0%}), записей {member_cache['entries']}\n"
+        f"• Сверка: круг {sweep_stats['rotation']}, проверено {sweep_stats['rotation_checked']}/{sweep_stats['users']}, "
+        f"по {sweep_stats['slice']} раз в {sweep_stats['tick']:.0f} с "
+        f"(последний срез: исправлено {sweep_stats['last_slice_changed']}, {sweep_stats['last_slice_duration']:.1f} с)\n\n"
+        "⏱ <b>Задержка доставки (пост → получено):</b>\n"
+        f"{latency_lines}"
+    )
+    
+    await message.answer(text, parse_mode="HTML")
+
+@router.message(Command("latency"))
+async def cmd_latency(message: Message):
+    """Задержка доставки уведомлений по последним постам"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет прав администратора")
+        return
+    
+    posts = await db.get_recent_post_latency(10)
+    if not posts:
+        await message.answer("⏱ Данных о задержке доставки пока нет")
+        return
+    
+    text = "⏱ <b>Задержка доставки по последним постам:</b>\n\n"
+    for post in posts:
+        kind_emoji = "🗿" if post["kind"] == "totem" else "🍎"
+        text += (
+            f"{kind_emoji} <b>{post['recorded_at']}</b> (пост {post['source_message_id']}, "
+            f"доставлено {post['delivered']})\n"
+            f"p50 {format_seconds(post['p50'])} • p90 {format_seconds(post['p90'])} • "
+            f"p99 {format_seconds(post['p99'])} • макс {format_seconds(post['max'])}\n\n"
+        )
+    
+    await message.answer(text, parse_mode="HTML")
+
 @router.message(Command("help_admin"))
 async def cmd_help_admin(message: Message):
     """Справка по админ-командам"""
@@ -1584,6 +1730,8 @@ async def cmd_help_admin(message: Message):
         "<b>/broadcast_all</b> - 🌍 Рассылка всем\n"
         "<b>/exceptions</b> - 📋 Управление исключениями\n"
         "<b>/active_chats</b> - 💬 Показать активные чаты\n"
+        "<b>/perf</b> - ⚙️ Метрики производительности\n"
+        "<b>/latency</b> - ⏱ Задержка доставки по постам\n"
         "<b>/help_admin</b> - ❓ Эта справка\n\n"
         f"<b>💬 Активных чатов:</b> {len(active_chats)}\n"
         f"<b>👑 Администраторы:</b> {len(ADMIN_IDS)}\n"
@@ -1,57 +1,25 @@
-import asyncio
 import logging
+from typing import AsyncIterator
 from aiogram import Router, Bot, F  # ДОБАВЬТЕ F СЮДА!
 from aiogram.types import Message
 from aiogram.filters import Command
-from aiogram import exceptions
 from aiogram.enums import ChatType
 
-from database import Database
+from database import async_db
 from config import Config
 from utils.filters import MessageFilter
+from utils.delivery import DeliveryJob, FanoutResult
+from utils.outbox import outbox
+from utils.render_cache import RenderCache, render_stats
+from utils.dedup import post_deduplicator, post_fingerprint
+from utils.coalesce import food_coalescer
+from utils.shadow import shadow_recorder
+from utils.corpus import capture_post
 
 router = Router()
-db = Database()
+db = async_db
 logger = logging.getLogger(__name__)
 
-async def send_with_semaphore(bot: Bot, user_id: int, text: str, parse_mode: str, semaphore: asyncio.Semaphore):
-    """Отправка сообщения с ограничением количества одновременных запросов"""
-    async with semaphore:
-        try:
-            await bot.send_message(user_id, text, parse_mode=parse_mode)
-            return True, None
-        except exceptions.TelegramAPIError as e:
-            # Проверяем, не является ли это ошибкой rate limit
-            error_msg = str(e)
-            if "Too Many Requests" in error_msg or "retry after" in error_msg.lower():
-                # Пытаемся извлечь время ожидания из ошибки
-                import re
-                retry_match = re.search(r'retry after (\d+)', error_msg.lower())
-                if retry_match:
-                    wait_time = int(retry_match.group(1))
-                else:
-                    wait_time = 5  # По умолчанию 5 секунд
-                
-                logger.warning(f"Rate limit hit for user {user_id}, waiting {wait_time} seconds")
-                await asyncio.sleep(wait_time)
-                # Пробуем еще раз после ожидания
-                try:
-                    await bot.send_message(user_id, text, parse_mode=parse_mode)
-                    return True, None
-                except Exception as retry_error:
-                    return False, str(retry_error)
-            else:
-                return False, error_msg
-        except Exception as e:
-            error_msg = str(e)
-            if "Forbidden" in error_msg or "bot was blocked" in error_msg:
-                logger.warning(f"User {user_id} blocked the bot")
-            elif "chat not found" in error_msg:
-                logger.warning(f"Chat with user {user_id} not found")
-            else:
-                logger.error(f"Error sending to user {user_id}: {error_msg}")
-            return False, error_msg
-
 @router.channel_post()
 async def handle_channel_post(message: Message, bot: Bot):
     """Обработка сообщений из каналов"""
@@ -60,17 +28,46 @@ async def handle_channel_post(message: Message, bot: Bot):
         return
     
     text = message.text or message.caption or ""
+    entities = message.entities if message.text else message.caption_entities
     
     if not text:
         return
     
+    # Время поста - точка отсчета задержки доставки
+    posted_at = message.date.timestamp()
+    
     logger.info(f"🚀 ПОЛУЧЕНО СООБЩЕНИЕ ИЗ КАНАЛА!")
     logger.info(f"📝 Текст: {text[:200]}")
     
-    # Классифицируем сообщение
-    classification = MessageFilter.classify_message(text)
+    # Классифицируем сообщение (ссылку тотема берем из entities)
+    classification = MessageFilter.classify_message(text, entities)
     logger.info(f"🔍 Классификация: {classification['type']}")
     
+    if Config.CORPUS_CAPTURE_PATH:
+        await capture_post(message, text, classification)
+    
+    # Повтор уже разосланного поста отбрасываем до поиска получателей
+    fingerprint = post_fingerprint(classification)
+    if fingerprint and post_deduplicator.is_duplicate(classification["type"], fingerprint):
+        logger.info(f"♻️ Повтор поста ({classification['type']}), рассылка пропущена")
+        return
+    
+    try:
+        await dispatch_post(classification, message, bot, posted_at)
+    except BaseException:
+        # Рассылка не удалась - повтор поста не должен отбрасываться
+        if fingerprint:
+            post_deduplicator.release(fingerprint)
+        raise
+    if fingerprint:
+        await post_deduplicator.remember(classification["type"], fingerprint)
+    
+    if Config.SHADOW_MODE:
+        shadow_recorder.flush()
+        logger.info(f"🕶 Теневой режим: записано отправок {shadow_recorder.stats()['recorded']}")
+
+async def dispatch_post(classification: dict, message: Message, bot: Bot, posted_at: float):
+    """Рассылка классифицированного поста канала"""
     if classification["type"] == "food":
         fruits = classification["data"]
         if not fruits:
@@ -78,8 +75,15 @@ async def handle_channel_post(message: Message, bot: Bot):
             return
             
         logger.info(f"🍎 Найдены фрукты ({len(fruits)} шт): {[f['name'] for f in fruits]}")
-        await process_food_notification(fruits, bot)
-        logger.info(f"✅ Рассылка еды завершена")
+        # При включенном окне посты, пришедшие пачкой, уходят одним уведомлением
+        result = await food_coalescer.submit(
+            message.chat.id,
+            fruits,
+            message.message_id,
+            lambda merged, source_message_id: process_food_notification(merged, bot, source_message_id, posted_at)
+        )
+        if result is not None:
+            logger.info(f"✅ Рассылка еды завершена")
         
     elif classification["type"] == "totem":
         logger.info(f"🗿 Найден тотем ({classification['subtype']})")
@@ -87,114 +91,84 @@ async def handle_channel_post(message: Message, bot: Bot):
             classification["subtype"],
             classification["text"],
             classification["link"],
-            bot
+            bot,
+            message.message_id,
+            posted_at
         )
         logger.info(f"✅ Рассылка тотемов завершена")
     else:
         logger.warning(f"❌ Сообщение не распознано")
 
-async def process_food_notification(fruits_data: list, bot: Bot):
-    """Обработка и рассылка уведомлений о еде"""
-    # Собираем всех пользователей для всех фруктов
-    all_user_ids = set()
-    fruit_users = {}
-    
-    for fruit_data in fruits_data:
-        fruit_name = fruit_data["name"]
-        user_ids = db.get_users_for_fruit(fruit_name)
-        fruit_users[fruit_name] = user_ids
-        all_user_ids.update(user_ids)
+async def food_jobs(fruits_data: list, cache: RenderCache) -> AsyncIterator[DeliveryJob]:
+    """Доставки уведомления о еде всем подходящим получателям"""
+    fruit_names = [f["name"] for f in fruits_data]
     
-    logger.info(f"🍎 Рассылка уведомлений для {len(all_user_ids)} пользователей")
-    logger.info(f"🍏 Фрукты для рассылки: {[f['name'] for f in fruits_data]}")
-    
-    if not all_user_ids:
-        logger.warning("⚠️ Нет пользователей для рассылки!")
-        return
-    
-    # Создаем семафор для ограничения одновременных отправок (20 одновременных запросов)
-    semaphore = asyncio.Semaphore(20)
-    tasks = []
-    sent_count = 0
-    error_count = 0
-    
-    for user_id in all_user_ids:
-        user = db.get_user(user_id)
-        if not user:
-            logger.warning(f"❌ Пользователь {user_id} не найден в БД")
-            continue
-        
-        if not user.get("is_subscribed", 0):
-            logger.warning(f"❌ Пользователь {user_id} не подписан, пропускаем")
-            continue
-        
-        lang = user.get("language", "RUS")
-        
+    # Текст зависит только от языка и набора подходящих фруктов - рендерим каждый вариант один раз
+    def render(language: str, fruits: tuple) -> str:
         # Формируем список фруктов для этого пользователя
-        user_fruits = []
-        for fruit_data in fruits_data:
-            fruit_name = fruit_data["name"]
-            if user_id in fruit_users.get(fruit_name, []):
-                user_fruits.append(fruit_data)
-        
-        if not user_fruits:
-            logger.debug(f"🔕 Пользователь {user_id} не подписан на эти фрукты")
-            continue
+        matched = set(fruits)
+        user_fruits = [fruit_data for fruit_data in fruits_data if fruit_data["name"] in matched]
         
         # Форматируем сообщение БЕЗ заголовка
-        message_text = MessageFilter.format_food_message(user_fruits, lang)
-        
-        # Создаем задачу для отправки
-        task = send_with_semaphore(bot, user_id, message_text, "HTML", semaphore)
-        tasks.append(task)
+        return MessageFilter.format_food_message(user_fruits, language)
     
-    # Выполняем все задачи параллельно с ограничением
-    results = await asyncio.gather(*tasks)
+    # Получатели читаются потоком: сообщение берется из кэша, когда до получателя дошла очередь
+    async for recipient in db.iter_food_recipients(fruit_names):
+        key = (recipient["language"], tuple(recipient["fruits"]))
+        message_text = cache.get(key, lambda: render(*key))
+        yield DeliveryJob(recipient["user_id"], message_text, "HTML")
+
+async def totem_jobs(totem_type: str, text: str, link: str, cache: RenderCache) -> AsyncIterator[DeliveryJob]:
+    """Доставки уведомления о тотеме всем подходящим получателям"""
+    # Текст тотема зависит только от языка
+    async for recipient in db.iter_totem_recipients(totem_type == "free"):
+        language = recipient["language"]
+        message_text = cache.get(
+            language, lambda: MessageFilter.format_totem_message(totem_type, text, link, language)
+        )
+        yield DeliveryJob(recipient["user_id"], message_text, "Markdown")
+
+# Дозапись прерванных рассылок после перезапуска - по описанию поста из outbox
+outbox.register_builder("food", lambda source: food_jobs(source["fruits"], RenderCache("food")))
+outbox.register_builder(
+    "totem", lambda source: totem_jobs(source["subtype"], source["text"], source["link"], RenderCache("totem"))
+)
+
+async def process_food_notification(
+    fruits_data: list, bot: Bot, source_message_id: int = None, posted_at: float = None
+) -> FanoutResult:
+    """Обработка и рассылка уведомлений о еде"""
+    logger.info(f"🍏 Фрукты для рассылки: {[f['name'] for f in fruits_data]}")
+    cache = RenderCache("food")
     
-    for success, error in results:
-        if success:
-            sent_count += 1
-        else:
-            error_count += 1
+    # Задания сохраняются в outbox и отправляются пулом воркеров с повторами
+    result = await outbox.publish(
+        bot, "food", source_message_id, food_jobs(fruits_data, cache), posted_at,
+        source={"fruits": fruits_data}
+    )
+    render_stats.record(cache)
     
-    logger.info(f"📊 Итог: отправлено {sent_count}, ошибок {error_count}")
+    if not result.total:
+        logger.warning("⚠️ Нет пользователей для рассылки!")
+    logger.info(f"📊 Итог: {result.summary()}")
+    return result
 
-async def process_totem_notification(totem_type: str, text: str, link: str, bot: Bot):
+async def process_totem_notification(
+    totem_type: str, text: str, link: str, bot: Bot, source_message_id: int = None, posted_at: float = None
+) -> FanoutResult:
     """Обработка и рассылка уведомлений о тотемах"""
-    is_free = totem_type == "free"
-    user_ids = db.get_users_for_totem(is_free)
+    cache = RenderCache("totem")
     
-    logger.info(f"🗿 Рассылка {totem_type} тотемов для {len(user_ids)} пользователей")
+    result = await outbox.publish(
+        bot, "totem", source_message_id, totem_jobs(totem_type, text, link, cache), posted_at,
+        source={"subtype": totem_type, "text": text, "link": link}
+    )
+    render_stats.record(cache)
     
-    if not user_ids:
+    if not result.total:
         logger.warning(f"⚠️ Нет пользователей для рассылки {totem_type} тотемов")
-        return
-    
-    # Создаем семафор для ограничения одновременных отправок
-    semaphore = asyncio.Semaphore(20)
-    tasks = []
-    
-    for user_id in user_ids:
-        user = db.get_user(user_id)
-        if not user or not user.get("is_subscribed", 0):
-            continue
-        
-        lang = user.get("language", "RUS")
-        
-        # Форматируем сообщение
-        message_text = MessageFilter.format_totem_message(totem_type, text, link, lang)
-        
-        # Создаем задачу для отправки
-        task = send_with_semaphore(bot, user_id, message_text, "Markdown", semaphore)
-        tasks.append(task)
-    
-    # Выполняем все задачи параллельно с ограничением
-    results = await asyncio.gather(*tasks)
-    
-    sent_count = sum(1 for success, _ in results if success)
-    error_count = sum(1 for success, _ in results if not success)
-    
-    logger.info(f"📊 Итог тотемы: отправлено {sent_count}, ошибок {error_count}")
+    logger.info(f"📊 Итог тотемы ({totem_type}): {result.summary()}")
+    return result
 
 
 # ========== КОМАНДЫ ТОЛЬКО В ЛИЧНЫХ СООБЩЕНИЯХ ==========
@@ -208,8 +182,8 @@ async def test_channel_command(message: Message, bot: Bot):
 async def debug_fruits_command(message: Message):
     """Отладка выбора фруктов - ТОЛЬКО в личных сообщениях"""
     user_id = message.from_user.id
-    user = db.get_user(user_id)
-    user_fruits = db.get_user_fruits(user_id)
+    user = await db.get_user(user_id)
+    user_fruits = await db.get_user_fruits(user_id)
     
     response = f"🔍 ВАШИ ФРУКТЫ:\n\n"
     response += f"ID: {user_id}\n"
@@ -252,7 +226,7 @@ async def test_format_command(message: Message):
 async def send_test_notification_command(message: Message, bot: Bot):
     """Отправка тестового уведомления - ТОЛЬКО в личных сообщениях"""
     user_id = message.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     
     if not user or not user.get("is_subscribed"):
         await message.answer("❌ Вы не подписаны или не найдены в базе")
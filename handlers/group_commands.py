@@ -9,10 +9,10 @@ from aiogram.enums import ParseMode
 import re
 import logging
 from datetime import datetime
-from database import Database
+from database import async_db
 
 router = Router()
-db = Database()
+db = async_db
 logger = logging.getLogger(__name__)
 
 # ========== ФУНКЦИЯ ФОРМАТИРОВАНИЯ ЧИСЕЛ ==========
@@ -191,9 +191,9 @@ RESULT_EMOJIS = {
 }
 
 # ========== ПОЛУЧЕНИЕ ЯЗЫКА ПОЛЬЗОВАТЕЛЯ ==========
-def get_user_language(user_id: int) -> str:
+async def get_user_language(user_id: int) -> str:
     """Получить язык пользователя из БД"""
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     if user and user.get("language") == "RUS":
         return "ru"
     return "en"
@@ -278,7 +278,7 @@ async def handle_exclamation_command(message: Message):
     
     # Получаем язык пользователя (только для ЛС, в группах используем русский)
     if message.chat.type == "private":
-        lang = get_user_language(message.from_user.id)
+        lang = await get_user_language(message.from_user.id)
     else:
         lang = "ru"  # В группах всегда русский
     
@@ -415,7 +415,7 @@ async def help_mutations_command(message: Message):
     logger.info(f"📖 Запрос помощи от {message.from_user.id}")
     
     # Получаем язык пользователя
-    lang = get_user_language(message.from_user.id)
+    lang = await get_user_language(message.from_user.id)
     texts = TEXTS[lang]
     
     help_text = f"{texts['help_title']}\n\n"
@@ -444,7 +444,7 @@ async def ping_command(message: Message):
     logger.info(f"🏓 Ping команда от {message.from_user.id}")
     
     # Получаем язык пользователя
-    lang = get_user_language(message.from_user.id)
+    lang = await get_user_language(message.from_user.id)
     texts = TEXTS[lang]
     
     current_time = datetime.now().strftime("%H:%M:%S")
@@ -0,0 +1,78 @@
+"""
+membership.py - Подписка на группу по событиям chat_member
+
+Telegram присылает chat_member, когда пользователь вступает в
+Config.REQUIRED_GROUP_ID или выходит из нее (бот должен быть
+администратором группы, а "chat_member" - в allowed_updates). Статус в
+users и индекс подписок обновляются сразу, отписавшийся получает
+уведомление, кэш членства (utils/membership_cache.py) получает новый
+статус. Периодическая проверка в utils/subscription.py лишь сверяет
+пропущенные события.
+"""
+
+import logging
+from collections import Counter
+from typing import Dict
+
+from aiogram import Router, F
+from aiogram.types import ChatMemberUpdated
+
+from database import async_db
+from config import Config
+from utils.messages import locale_manager
+from utils.membership_cache import SUBSCRIBED_STATUSES, membership_cache
+from utils.rate_limiter import send_lane
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+db = async_db
+
+# Счетчики событий (для /perf)
+membership_events: Counter = Counter()
+
+def membership_stats() -> Dict:
+    return {
+        "events": sum(membership_events.values()),
+        "joined": membership_events["joined"],
+        "left": membership_events["left"],
+        "ignored": membership_events["ignored"]
+    }
+
+@router.chat_member(F.chat.id == Config.REQUIRED_GROUP_ID)
+async def handle_group_membership(event: ChatMemberUpdated):
+    """Вступление в обязательную группу или выход из нее"""
+    user_id = event.new_chat_member.user.id
+    is_subscribed = event.new_chat_member.status in SUBSCRIBED_STATUSES
+    membership_cache.set(event.chat.id, user_id, is_subscribed)
+    
+    # Изменились только права участника - подписка та же
+    if is_subscribed == (event.old_chat_member.status in SUBSCRIBED_STATUSES):
+        membership_events["ignored"] += 1
+        return
+    
+    user = await db.get_user(user_id)
+    if not user:
+        # Участник группы, который не пользуется ботом
+        membership_events["ignored"] += 1
+        return
+    
+    # Пользователь в исключениях считается подписанным
+    if not is_subscribed and await db.is_exception(user_id):
+        membership_events["ignored"] += 1
+        return
+    
+    membership_events["joined" if is_subscribed else "left"] += 1
+    if bool(user["is_subscribed"]) == is_subscribed:
+        return
+    
+    await db.update_subscription(user_id, is_subscribed)
+    logger.info(f"{'➕' if is_subscribed else '➖'} Подписка {user_id}: {'вступил в группу' if is_subscribed else 'вышел из группы'}")
+    
+    if not is_subscribed:
+        lang_code = "ru" if user.get("language", "RUS") == "RUS" else "en"
+        try:
+            with send_lane("housekeeping"):
+                await event.bot.send_message(user_id, locale_manager.get_text(lang_code, "notifications.unsubscribed"))
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось уведомить {user_id} об отписке: {e}")
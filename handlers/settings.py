@@ -3,17 +3,17 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
 
-from database import Database
+from database import async_db
 from config import Config
 from utils.messages import locale_manager
 
 router = Router()
-db = Database()
+db = async_db
 
 async def get_settings_keyboard(user_id: int, lang_code: str) -> InlineKeyboardMarkup:
     """Создание клавиатуры настроек с кнопкой отключения"""
-    user = db.get_user(user_id)
-    user_fruits = db.get_user_fruits(user_id)
+    user = await db.get_user(user_id)
+    user_fruits = await db.get_user_fruits(user_id)
     
     builder = InlineKeyboardBuilder()
     
@@ -52,14 +52,14 @@ async def get_settings_keyboard(user_id: int, lang_code: str) -> InlineKeyboardM
 async def disable_all_notifications(callback: types.CallbackQuery):
     """Отключение всех уведомлений"""
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     lang_code = "ru" if user and user.get("language") == "RUS" else "en"
     
     # Отключаем все фрукты
-    db.update_user_fruits(user_id, [])
+    await db.update_user_fruits(user_id, [])
     
     # Отключаем все тотемы
-    db.update_totem_settings(user_id, free_totems=False, paid_totems=False)
+    await db.update_totem_settings(user_id, free_totems=False, paid_totems=False)
     
     # Показываем сообщение об успехе
     if lang_code == "ru":
@@ -84,9 +84,9 @@ async def disable_all_notifications(callback: types.CallbackQuery):
 async def food_settings(callback: types.CallbackQuery):
     """Настройка уведомлений о еде"""
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     lang_code = "ru" if user and user.get("language") == "RUS" else "en"
-    user_fruits = db.get_user_fruits(user_id)
+    user_fruits = await db.get_user_fruits(user_id)
     
     builder = InlineKeyboardBuilder()
     
@@ -145,11 +145,11 @@ async def food_settings(callback: types.CallbackQuery):
 async def disable_fruits(callback: types.CallbackQuery):
     """Отключение всех фруктов"""
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     lang_code = "ru" if user and user.get("language") == "RUS" else "en"
     
     # Отключаем все фрукты
-    db.update_user_fruits(user_id, [])
+    await db.update_user_fruits(user_id, [])
     
     # Обновляем клавиатуру
     await food_settings(callback)
@@ -165,9 +165,9 @@ async def disable_fruits(callback: types.CallbackQuery):
 async def save_fruits(callback: types.CallbackQuery):
     """Сохранение выбранных фруктов"""
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     lang_code = "ru" if user and user.get("language") == "RUS" else "en"
-    user_fruits = db.get_user_fruits(user_id)
+    user_fruits = await db.get_user_fruits(user_id)
     
     if not user_fruits:
         text = locale_manager.get_text(lang_code, "settings.no_fruits_selected")
@@ -206,7 +206,7 @@ async def save_fruits(callback: types.CallbackQuery):
 async def back_to_settings(callback: types.CallbackQuery):
     """Возврат к основным настройкам"""
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     lang_code = "ru" if user and user.get("language") == "RUS" else "en"
     
     text = locale_manager.get_text(lang_code, "settings.title")
@@ -226,7 +226,7 @@ async def back_to_settings(callback: types.CallbackQuery):
 async def toggle_totem(callback: types.CallbackQuery):
     """Переключение настроек тотемов"""
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     totem_type = callback.data.split("_")[1]  # free или paid
     
     if not user:
@@ -241,9 +241,9 @@ async def toggle_totem(callback: types.CallbackQuery):
     
     # Обновляем в БД
     if totem_type == "free":
-        db.update_totem_settings(user_id, free_totems=new_value)
+        await db.update_totem_settings(user_id, free_totems=new_value)
     else:
-        db.update_totem_settings(user_id, paid_totems=new_value)
+        await db.update_totem_settings(user_id, paid_totems=new_value)
     
     # Обновляем клавиатуру
     lang_code = "ru" if user.get("language") == "RUS" else "en"
@@ -265,15 +265,15 @@ async def toggle_fruit(callback: types.CallbackQuery):
     """Переключение выбора фрукта"""
     user_id = callback.from_user.id
     fruit_name = callback.data.split("_", 1)[1]
-    user_fruits = db.get_user_fruits(user_id)
+    user_fruits = await db.get_user_fruits(user_id)
     
     if fruit_name == "all":
         if "all" in user_fruits:
             # Если уже выбрано "все", очищаем выбор
-            db.update_user_fruits(user_id, [])
+            await db.update_user_fruits(user_id, [])
         else:
             # Выбираем все фрукты
-            db.update_user_fruits(user_id, ["all"])
+            await db.update_user_fruits(user_id, ["all"])
     else:
         if "all" in user_fruits:
             # Если был выбран "все", переключаемся на индивидуальный выбор
@@ -281,7 +281,7 @@ async def toggle_fruit(callback: types.CallbackQuery):
             all_fruits = Config.AVAILABLE_FRUITS_EN.copy()
             if fruit_name in all_fruits:
                 all_fruits.remove(fruit_name)
-            db.update_user_fruits(user_id, all_fruits)
+            await db.update_user_fruits(user_id, all_fruits)
         else:
             # Обычный выбор/снятие выбора
             if fruit_name in user_fruits:
@@ -295,9 +295,9 @@ async def toggle_fruit(callback: types.CallbackQuery):
             all_selected = all(fruit in user_fruits for fruit in Config.AVAILABLE_FRUITS_EN)
             if all_selected:
                 # Если выбраны все, переключаемся на режим "все"
-                db.update_user_fruits(user_id, ["all"])
+                await db.update_user_fruits(user_id, ["all"])
             else:
-                db.update_user_fruits(user_id, user_fruits)
+                await db.update_user_fruits(user_id, user_fruits)
     
     # Обновляем клавиатуру
     await food_settings(callback)
\ No newline at end of file
@@ -4,12 +4,12 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.enums import ChatType
 
-from database import Database
+from database import async_db
 from config import Config
 from utils.messages import locale_manager
 
 router = Router()
-db = Database()
+db = async_db
 
 # Ключевые слова для вызова настроек
 KEYWORDS = [
@@ -22,9 +22,9 @@ KEYWORDS = [
 ]
 
 # Функция для получения языка пользователя (используется в group_commands.py)
-def get_user_language(user_id: int) -> str:
+async def get_user_language(user_id: int) -> str:
     """Получить язык пользователя из БД"""
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     if user and user.get("language") == "RUS":
         return "ru"
     return "en"
@@ -39,10 +39,10 @@ async def handle_settings_request(message: types.Message):
     username = message.from_user.username
     
     # Добавляем пользователя в БД
-    db.add_user(user_id, username)
+    await db.add_user(user_id, username)
     
     # Получаем информацию о пользователе
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     
     # Определяем язык
     if user and user.get("language"):
@@ -54,7 +54,7 @@ async def handle_settings_request(message: types.Message):
             lang = "RUS"
         else:
             lang = "ENG"
-        db.update_user_language(user_id, lang)
+        await db.update_user_language(user_id, lang)
     
     lang_code = "ru" if lang == "RUS" else "en"
     
@@ -62,8 +62,8 @@ async def handle_settings_request(message: types.Message):
     text_lower = message.text.lower() if message.text else ""
     if any(word in text_lower for word in ["отключить", "disable", "выкл", "выключить", "off", "Отключить", "Disable", "Выкл", "Выключить", "Off"]):
         # Отключаем все уведомления
-        db.update_user_fruits(user_id, [])
-        db.update_totem_settings(user_id, free_totems=False, paid_totems=False)
+        await db.update_user_fruits(user_id, [])
+        await db.update_totem_settings(user_id, free_totems=False, paid_totems=False)
         
         if lang == "RUS":
             await message.answer("✅ Все уведомления отключены!")
@@ -135,13 +135,13 @@ async def show_settings_menu(message: types.Message, user_id: int, lang: str, la
     is_subscribed = await check_user_subscription(user_id, Config.REQUIRED_GROUP_ID, message.bot)
     
     # Проверяем, есть ли пользователь в исключениях
-    is_exception = db.is_exception(user_id)
+    is_exception = await db.is_exception(user_id)
     
     # Если пользователь в исключениях, считаем его подписанным
     if is_exception:
         is_subscribed = True
     
-    db.update_subscription(user_id, is_subscribed)
+    await db.update_subscription(user_id, is_subscribed)
     
     if not is_subscribed and not is_exception:
         # Показываем сообщение о необходимости подписки
@@ -178,7 +178,7 @@ async def process_language(callback: types.CallbackQuery):
     
     # Сохраняем выбор языка
     language = "RUS" if lang_code == "ru" else "ENG"
-    db.update_user_language(user_id, language)
+    await db.update_user_language(user_id, language)
     
     # Показываем сообщение о необходимости подписки
     text = locale_manager.get_text(lang_code, "subscription.require")
@@ -202,7 +202,7 @@ async def check_subscription(callback: types.CallbackQuery):
     from handlers.settings import get_settings_keyboard
     
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     lang_code = "ru" if user.get("language") == "RUS" else "en"
     
     # Проверяем подписку (не игнорируем исключения для проверки)
@@ -213,13 +213,13 @@ async def check_subscription(callback: types.CallbackQuery):
     )
     
     # Проверяем, есть ли пользователь в исключениях
-    is_exception = db.is_exception(user_id)
+    is_exception = await db.is_exception(user_id)
     
     # Если пользователь в исключениях, считаем его подписанным
     if is_exception:
         is_subscribed = True
     
-    db.update_subscription(user_id, is_subscribed)
+    await db.update_subscription(user_id, is_subscribed)
     
     if is_subscribed:
         # Показываем меню настроек
@@ -0,0 +1,307 @@
+"""
+fake_bot_api.py - Локальная замена Bot API для нагрузочных тестов без Telegram
+
+Реализует методы, которыми пользуется бот: getMe, getUpdates, sendMessage,
+copyMessage, forwardMessage, getChatMember, getChat, sendDocument,
+editMessageText, answerCallbackQuery (остальные методы отвечают True).
+Поведение настраивается ключами запуска:
+
+- задержка ответа (--latency, --jitter);
+- доля ответов 429 с retry_after (--retry-after-rate, --retry-after);
+- доля ответов 403 "bot was blocked by the user" (--forbidden-rate);
+- пропускная способность: как у Telegram, превышение глобального лимита
+  (--max-rate) и лимита личного чата (--chat-rate) дает 429;
+- доля участников группы для getChatMember (--member-rate).
+
+Запуск сервера и бота против него:
+
+    python tools/fake_bot_api.py --port 8081 --latency 0.05 --max-rate 30
+    BOT_API_URL=http://127.0.0.1:8081 python bot.py
+
+Посты канала подаются через POST /_inject (JSON готового update без
+update_id или {"chat_id": ..., "text": ...} - пост канала), счетчики
+отдает GET /_stats.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("fake_bot_api")
+
+# Методы, которые создают сообщения (на них действуют лимиты и ошибки доставки)
+SEND_METHODS = {"sendmessage", "copymessage", "forwardmessage", "senddocument"}
+
+class FakeBotAPI:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        retry_after_rate: float = 0.0,
+        retry_after: int = 1,
+        forbidden_rate: float = 0.0,
+        max_rate: float = 0.0,
+        chat_rate: float = 0.0,
+        member_rate: float = 1.0,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.forbidden_rate = forbidden_rate
+        self.max_rate = max_rate
+        self.chat_rate = chat_rate
+        self.member_rate = member_rate
+        self.random = random.Random(seed)
+        self._message_id = 0
+        self._update_id = 0
+        self._updates: Deque[Dict] = deque()
+        self._new_updates = asyncio.Event()
+        # Время отправок за последнюю секунду: общее и по личным чатам
+        self._recent: Deque[float] = deque()
+        self._chat_last: Dict[int, float] = {}
+        self.started = time.monotonic()
+        self.counters: Counter = Counter()
+        self.first_send: Optional[float] = None
+        self.last_send: Optional[float] = None
+    
+    # ========== HTTP ==========
+    
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/bot{token}/{method}", self.handle_method)
+        app.router.add_post("/_inject", self.handle_inject)
+        app.router.add_get("/_stats", self.handle_stats)
+        app.router.add_post("/_reset", self.handle_reset)
+        return app
+    
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        params.update(request.query)
+        self.counters[f"method:{method}"] += 1
+        
+        if method == "getupdates":
+            return self._ok(await self._get_updates(params))
+        
+        await self._delay()
+        if method in SEND_METHODS:
+            error = self._send_error(self._chat_id(params))
+            if error is not None:
+                return error
+            self.counters["sent"] += 1
+            now = time.monotonic()
+            self.first_send = self.first_send or now
+            self.last_send = now
+        
+        handler = getattr(self, f"_method_{method}", None)
+        return self._ok(handler(params) if handler else True)
+    
+    async def handle_inject(self, request: web.Request) -> web.Response:
+        """Добавить update в очередь getUpdates"""
+        data = await request.json()
+        if "update_id" not in data and "text" in data:
+            data = {"channel_post": self._message(int(data["chat_id"]), data["text"], chat_type="channel")}
+        self._update_id += 1
+        self._updates.append(dict(data, update_id=self._update_id))
+        self._new_updates.set()
+        self.counters["injected"] += 1
+        return self._ok(self._update_id)
+    
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+    
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.counters.clear()
+        self.first_send = self.last_send = None
+        self.started = time.monotonic()
+        return self._ok(True)
+    
+    # ========== ЛИМИТЫ И ОШИБКИ ==========
+    
+    async def _delay(self):
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    def _send_error(self, chat_id: Optional[int]) -> Optional[web.Response]:
+        """Ошибка отправки по лимитам и настроенным долям (None - отправка прошла)"""
+        now = time.monotonic()
+        while self._recent and self._recent[0] <= now - 1:
+            self._recent.popleft()
+        
+        if self.max_rate and len(self._recent) >= self.max_rate:
+            self.counters["429_global"] += 1
+            return self._error(429, "Too Many Requests: retry after 1", retry_after=1)
+        if self.chat_rate and chat_id is not None and chat_id > 0:
+            last = self._chat_last.get(chat_id)
+            if last is not None and now - last < 1 / self.chat_rate:
+                self.counters["429_chat"] += 1
+                return self._error(429, "Too Many Requests: retry after 1", retry_after=1)
+        if self.retry_after_rate and self.random.random() < self.retry_after_rate:
+            self.counters["429_injected"] += 1
+            return self._error(
+                429, f"Too Many Requests: retry after {self.retry_after}", retry_after=self.retry_after
+            )
+        if self.forbidden_rate and self.random.random() < self.forbidden_rate:
+            self.counters["403"] += 1
+            return self._error(403, "Forbidden: bot was blocked by the user")
+        
+        self._recent.append(now)
+        if chat_id is not None:
+            self._chat_last[chat_id] = now
+        return None
+    
+    # ========== МЕТОДЫ ==========
+    
+    async def _get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get("offset", 0) or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout", 0) or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit", 100) or 100)
+        return list(self._updates)[:limit]
+    
+    def _method_getme(self, params: Dict) -> Dict:
+        return {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+    
+    def _method_sendmessage(self, params: Dict) -> Dict:
+        return self._message(self._chat_id(params), params.get("text", ""))
+    
+    def _method_editmessagetext(self, params: Dict) -> Dict:
+        if "inline_message_id" in params:
+            return True
+        message = self._message(self._chat_id(params), params.get("text", ""))
+        message["message_id"] = int(params.get("message_id", message["message_id"]))
+        return message
+    
+    def _method_forwardmessage(self, params: Dict) -> Dict:
+        return self._message(self._chat_id(params), "")
+    
+    def _method_copymessage(self, params: Dict) -> Dict:
+        self._message_id += 1
+        return {"message_id": self._message_id}
+    
+    def _method_senddocument(self, params: Dict) -> Dict:
+        message = self._message(self._chat_id(params), None)
+        message["document"] = {"file_id": f"fake-{message['message_id']}", "file_unique_id": str(message["message_id"])}
+        return message
+    
+    def _method_getchatmember(self, params: Dict) -> Dict:
+        user_id = int(params.get("user_id", 0))
+        status = "member" if self.random.random() < self.member_rate else "left"
+        self.counters[f"member:{status}"] += 1
+        return {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}}
+    
+    def _method_getchat(self, params: Dict) -> Dict:
+        chat_id = self._chat_id(params) or 0
+        return {
+            "id": chat_id,
+            "type": self._chat_type(chat_id),
+            "title": f"Chat {chat_id}",
+            "accent_color_id": 0,
+            "max_reaction_count": 11
+        }
+    
+    def _method_answercallbackquery(self, params: Dict) -> bool:
+        return True
+    
+    # ========== ОТВЕТЫ ==========
+    
+    @staticmethod
+    def _chat_id(params: Dict) -> Optional[int]:
+        try:
+            return int(params["chat_id"])
+        except (KeyError, ValueError):
+            return None
+    
+    @staticmethod
+    def _chat_type(chat_id: int) -> str:
+        return "private" if chat_id > 0 else "supergroup"
+    
+    def _message(self, chat_id: Optional[int], text: Optional[str], chat_type: Optional[str] = None) -> Dict:
+        self._message_id += 1
+        chat_id = chat_id or 0
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type or self._chat_type(chat_id)}
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+    
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+    
+    @staticmethod
+    def _error(code: int, description: str, retry_after: Optional[int] = None) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if retry_after is not None:
+            body["parameters"] = {"retry_after": retry_after}
+        return web.json_response(body, status=code)
+    
+    def stats(self) -> Dict:
+        sending = (self.last_send - self.first_send) if self.first_send and self.last_send else 0.0
+        return {
+            "uptime": time.monotonic() - self.started,
+            "sent": self.counters["sent"],
+            "sends_per_sec": self.counters["sent"] / sending if sending > 0 else 0.0,
+            "counters": dict(self.counters)
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Bot API для нагрузочных тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки, сек")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="доля отправок с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after для --retry-after-rate, сек")
+    parser.add_argument("--forbidden-rate", type=float, default=0.0, help="доля отправок с ответом 403")
+    parser.add_argument("--max-rate", type=float, default=0.0, help="лимит отправок в секунду (0 - без лимита)")
+    parser.add_argument("--chat-rate", type=float, default=0.0, help="лимит отправок в личный чат в секунду")
+    parser.add_argument("--member-rate", type=float, default=1.0, help="доля участников группы в getChatMember")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        stream=sys.stdout
+    )
+    api = FakeBotAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        retry_after_rate=args.retry_after_rate,
+        retry_after=args.retry_after,
+        forbidden_rate=args.forbidden_rate,
+        max_rate=args.max_rate,
+        chat_rate=args.chat_rate,
+        member_rate=args.member_rate,
+        seed=args.seed
+    )
+    logger.info(f"🧪 Fake Bot API: http://{args.host}:{args.port}")
+    try:
+        web.run_app(api.make_app(), host=args.host, port=args.port, print=None)
+    finally:
+        logger.info(f"📊 {json.dumps(api.stats(), ensure_ascii=False)}")
+
+if __name__ == "__main__":
+    main()
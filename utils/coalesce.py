@@ -0,0 +1,117 @@
+"""
+coalesce.py - Объединение пачки постов о еде в одно уведомление
+
+Обновления стока часто приходят несколькими постами подряд. Если включено
+окно Config.FOOD_COALESCE_WINDOW (секунды, 0 - выключено), первый пост
+источника открывает окно, а все посты о еде, пришедшие за это время,
+сливаются в один список фруктов. Каждый пользователь получает одно общее
+сообщение вместо нескольких. Присоединенный пост ждет рассылки пачки, и
+ее ошибка возвращается и ему.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from utils.subscription_index import subscription_index
+
+logger = logging.getLogger(__name__)
+
+def merge_fruits(posts: List[List[Dict]]) -> List[Dict]:
+    """Слияние списков фруктов: порядок первого появления, количество - из последнего поста"""
+    merged: Dict[str, Dict] = {}
+    for fruits in posts:
+        for fruit in fruits:
+            merged[fruit["name"]] = {**merged.get(fruit["name"], {}), **fruit}
+    return list(merged.values())
+
+class FoodCoalescer:
+    def __init__(self, window: float = Config.FOOD_COALESCE_WINDOW):
+        self.window = window
+        self._batches: Dict[int, List[Tuple[List[Dict], int]]] = {}
+        self._done: Dict[int, asyncio.Future] = {}
+        self._stats = {"batches": 0, "posts": 0, "merged_posts": 0, "sends_saved": 0}
+    
+    async def submit(
+        self,
+        source_id: int,
+        fruits: List[Dict],
+        message_id: int,
+        deliver: Callable[[List[Dict], Optional[int]], Awaitable]
+    ):
+        """
+        Передать пост о еде на рассылку
+        
+        Returns:
+            Результат deliver для поста, открывшего окно (или без окна);
+            None, если пост присоединен к уже открытому окну (после рассылки пачки)
+        
+        Raises:
+            Ошибку deliver - и для присоединенных постов
+        """
+        self._stats["posts"] += 1
+        if self.window <= 0:
+            return await deliver(fruits, message_id)
+        
+        batch = self._batches.get(source_id)
+        if batch is not None:
+            batch.append((fruits, message_id))
+            self._stats["merged_posts"] += 1
+            logger.info(f"🧺 Пост {message_id} присоединен к пачке ({len(batch)} постов)")
+            await asyncio.shield(self._done[source_id])
+            return None
+        
+        batch = self._batches[source_id] = [(fruits, message_id)]
+        done = self._done[source_id] = asyncio.get_running_loop().create_future()
+        # Ошибка без присоединенных постов никем не читается - не предупреждать о ней
+        done.add_done_callback(lambda future: future.cancelled() or future.exception())
+        try:
+            result = await self._deliver_batch(source_id, batch, deliver)
+        except asyncio.CancelledError:
+            done.cancel()
+            raise
+        except Exception as e:
+            done.set_exception(e)
+            raise
+        done.set_result(result)
+        return result
+    
+    async def _deliver_batch(
+        self,
+        source_id: int,
+        batch: List[Tuple[List[Dict], int]],
+        deliver: Callable[[List[Dict], Optional[int]], Awaitable]
+    ):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._batches.pop(source_id, None)
+            self._done.pop(source_id, None)
+        
+        merged = merge_fruits([post_fruits for post_fruits, _ in batch])
+        self._stats["batches"] += 1
+        if len(batch) > 1:
+            saved = self._sends_saved([post_fruits for post_fruits, _ in batch], merged)
+            self._stats["sends_saved"] += saved
+            logger.info(f"🧺 Пачка из {len(batch)} постов объединена, сэкономлено отправок: {saved}")
+        
+        return await deliver(merged, batch[0][1])
+    
+    @staticmethod
+    def _sends_saved(posts: List[List[Dict]], merged: List[Dict]) -> int:
+        """Сколько сообщений ушло бы при рассылке каждого поста отдельно, минус одно общее"""
+        if not subscription_index.loaded:
+            return 0
+        separate = sum(
+            subscription_index.count_food_recipients([fruit["name"] for fruit in fruits])
+            for fruits in posts
+        )
+        combined = subscription_index.count_food_recipients([fruit["name"] for fruit in merged])
+        return max(0, separate - combined)
+    
+    def stats(self) -> Dict:
+        return dict(self._stats, window=self.window)
+
+# Глобальный экземпляр
+food_coalescer = FoodCoalescer()
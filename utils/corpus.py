@@ -0,0 +1,74 @@
+"""
+corpus.py - Корпус постов канала для проверки и замеров разбора
+
+Формат - JSONL, одна строка на пост:
+
+    {"message_id": 123, "captured_at": "2025-01-01T12:00:00",
+     "text": "...", "entities": [...], "expected": {...}}
+
+text - сырой текст (или подпись) поста, entities - его entities как в Bot
+API (может отсутствовать; у синтетических записей message_id и
+captured_at - null), expected - результат
+MessageFilter.classify_message на момент записи. Ожидания проверяются
+глазами при добавлении постов; дальше любое изменение разбора, меняющее
+результат, видно в benchmarks/replay.py.
+
+Если задан Config.CORPUS_CAPTURE_PATH, handle_channel_post дописывает в
+этот файл каждый пост канала.
+"""
+
+import asyncio
+import glob
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram.types import Message
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def corpus_entry(
+    text: str,
+    expected: Dict,
+    entities: Optional[List[Dict]] = None,
+    message_id: Optional[int] = None
+) -> Dict:
+    entry = {
+        "message_id": message_id,
+        "captured_at": datetime.now().isoformat(timespec="seconds"),
+        "text": text,
+        "expected": expected
+    }
+    if entities:
+        entry["entities"] = entities
+    return entry
+
+def append_entries(path: str, entries: List[Dict]):
+    with open(path, "a", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def load_corpus(pattern: str) -> List[Dict]:
+    """Все записи файлов, подходящих под шаблон (в порядке имен файлов)"""
+    entries = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    return entries
+
+async def capture_post(message: Message, text: str, classification: Dict):
+    """Дописать пост канала в корпус (Config.CORPUS_CAPTURE_PATH)"""
+    entities = message.entities if message.text else message.caption_entities
+    entry = corpus_entry(
+        text,
+        classification,
+        [entity.model_dump(exclude_none=True, exclude={"user"}) for entity in entities or []],
+        message.message_id
+    )
+    try:
+        await asyncio.to_thread(append_entries, Config.CORPUS_CAPTURE_PATH, [entry])
+    except OSError as e:
+        logger.error(f"❌ Ошибка записи поста в корпус: {e}")
@@ -0,0 +1,107 @@
+"""
+dedup.py - Защита от повторной рассылки одного и того же поста
+
+Отпечаток поста не зависит от оформления текста:
+- еда  - мультимножество (фрукт, количество);
+- тотем - тип и ссылка на сервер Roblox.
+
+Отпечатки хранятся в ограниченном LRU со сроком жизни (Config.DEDUP_WINDOW
+по типу поста) и дублируются в таблицу seen_posts, чтобы переживать
+перезапуск бота.
+
+Новый пост сначала только резервируется в памяти (одновременный повтор
+отсекается), в seen_posts он записывается после успешной передачи на
+рассылку (remember). Если рассылка упала, резерв снимается (release) и
+повтор поста будет разослан.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import Config
+from database import async_db
+
+logger = logging.getLogger(__name__)
+
+def post_fingerprint(classification: Dict) -> Optional[str]:
+    """Нормализованный отпечаток классифицированного поста (None - не дедуплицируется)"""
+    if classification["type"] == "food":
+        items = sorted(f"{fruit['name']}x{fruit['quantity']}" for fruit in classification["data"])
+        key = "food:" + "|".join(items)
+    elif classification["type"] == "totem":
+        key = f"totem:{classification['subtype']}:{classification['link'].strip().lower()}"
+    else:
+        return None
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+class PostDeduplicator:
+    def __init__(self, db=async_db, maxsize: int = Config.DEDUP_MAX_ENTRIES):
+        self.db = db
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._stats = {"checked": 0, "duplicates": 0, "released": 0}
+    
+    def load(self, db):
+        """Загрузка неистекших отпечатков из БД (при старте бота, синхронный Database)"""
+        rows = db.load_seen_posts(time.time())
+        with self._lock:
+            for fingerprint, _, expires_at in rows[-self.maxsize:]:
+                self._seen[fingerprint] = expires_at
+        logger.info(f"Post fingerprints loaded: {len(self._seen)}")
+    
+    def is_duplicate(self, kind: str, fingerprint: str) -> bool:
+        """
+        Проверить пост; новый пост резервируется в памяти, поэтому
+        одновременный повтор тоже отсекается. После рассылки - remember,
+        при ошибке - release
+        """
+        now = time.time()
+        with self._lock:
+            self._stats["checked"] += 1
+            expires_at = self._seen.get(fingerprint)
+            if expires_at is not None and expires_at > now:
+                self._stats["duplicates"] += 1
+                return True
+            
+            expires_at = now + Config.DEDUP_WINDOW.get(kind, 0)
+            self._seen[fingerprint] = expires_at
+            self._seen.move_to_end(fingerprint)
+            self._evict(now)
+        return False
+    
+    async def remember(self, kind: str, fingerprint: str):
+        """Пост передан на рассылку - сохранить отпечаток в БД"""
+        with self._lock:
+            expires_at = self._seen.get(fingerprint)
+        if expires_at is None:
+            return
+        try:
+            await self.db.remember_post(fingerprint, kind, expires_at)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить отпечаток поста: {e}")
+    
+    def release(self, fingerprint: str):
+        """Рассылка не удалась - снять резерв, чтобы повтор поста был разослан"""
+        with self._lock:
+            if self._seen.pop(fingerprint, None) is not None:
+                self._stats["released"] += 1
+    
+    def _evict(self, now: float):
+        # Истекшие записи в начале (самые старые), затем ограничение размера
+        while self._seen:
+            fingerprint, expires_at = next(iter(self._seen.items()))
+            if expires_at > now and len(self._seen) <= self.maxsize:
+                break
+            self._seen.popitem(last=False)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._seen))
+
+# Глобальный экземпляр
+post_deduplicator = PostDeduplicator()
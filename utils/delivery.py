@@ -0,0 +1,241 @@
+"""
+delivery.py - Доставка уведомлений с повторными попытками
+
+Ошибки Bot API делятся на классы:
+- permanent   - пользователь заблокировал бота, удален, чат не найден (повтор бесполезен);
+- retry_after - 429, повтор ровно через retry_after;
+- transient   - сетевые ошибки и 5xx, повтор с экспоненциальной задержкой и джиттером;
+- failed      - прочие ошибки запроса (повтор бесполезен).
+
+Рассылка потоковая: задания читаются из генератора в ограниченную очередь,
+из которой их забирает фиксированный пул воркеров, поэтому память не растет
+с числом получателей, а первое сообщение уходит сразу.
+
+Повторная отправка не занимает воркер на время ожидания: задание
+откладывается через loop.call_later и возвращается в очередь, когда
+подойдет его время.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterable, Deque, Iterable, Optional, Set, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramNotFound,
+    TelegramRetryAfter, TelegramServerError
+)
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PERMANENT = "permanent"
+RETRY_AFTER = "retry_after"
+TRANSIENT = "transient"
+FAILED = "failed"
+
+# Окончательные исходы доставки
+SENT = "sent"
+EXHAUSTED = "exhausted"
+
+# Ответы 400, после которых чат недоступен навсегда
+PERMANENT_BAD_REQUESTS = (
+    "chat not found", "user is deactivated", "peer_id_invalid", "bot was blocked", "user not found"
+)
+
+def classify_send_error(error: BaseException) -> str:
+    """Класс ошибки отправки"""
+    if isinstance(error, TelegramRetryAfter):
+        return RETRY_AFTER
+    if isinstance(error, (TelegramForbiddenError, TelegramNotFound)):
+        return PERMANENT
+    if isinstance(error, TelegramBadRequest):
+        message = str(error).lower()
+        if any(marker in message for marker in PERMANENT_BAD_REQUESTS):
+            return PERMANENT
+        return FAILED
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, OSError)):
+        return TRANSIENT
+    return FAILED
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с джиттером для попытки attempt (с 1)"""
+    delay = min(Config.SEND_RETRY_MAX_DELAY, Config.SEND_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+@dataclass
+class DeliveryJob:
+    """Одна отправка одному получателю"""
+    chat_id: int
+    text: str
+    parse_mode: Optional[str] = None
+    attempt: int = 0
+
+@dataclass
+class FanoutResult:
+    """Итог рассылки по классам результатов"""
+    kind: str
+    total: int = 0
+    sent: int = 0
+    permanent: int = 0
+    failed: int = 0
+    exhausted: int = 0
+    retry_after: int = 0
+    transient: int = 0
+    retries: int = 0
+    first_send: Optional[float] = None
+    duration: float = 0.0
+    
+    @property
+    def errors(self) -> int:
+        """Получатели, которым так и не удалось доставить"""
+        return self.permanent + self.failed + self.exhausted
+    
+    def summary(self) -> str:
+        return (
+            f"{self.kind}: отправлено {self.sent}/{self.total}, "
+            f"недоступны {self.permanent}, ошибки {self.failed}, "
+            f"исчерпаны попытки {self.exhausted}, повторов {self.retries} "
+            f"(429: {self.retry_after}, сеть: {self.transient}), {self.duration:.1f} с"
+            + (f", первое через {self.first_send * 1000:.0f} мс" if self.first_send is not None else "")
+        )
+
+class FanoutSender:
+    """Пул воркеров отправки с ограниченной очередью и планировщиком повторов"""
+    
+    def __init__(
+        self,
+        bot: Bot,
+        kind: str,
+        workers: int = Config.FANOUT_WORKERS,
+        max_attempts: int = Config.SEND_MAX_ATTEMPTS,
+        queue_size: int = Config.FANOUT_QUEUE_SIZE
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.result = FanoutResult(kind=kind)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # Повторы, для которых не нашлось места в заполненной очереди
+        self._retries: Deque[DeliveryJob] = deque()
+        self._retry_handles: Set[asyncio.TimerHandle] = set()
+        self._outstanding = 0
+        self._produced = False
+        self._done = asyncio.Event()
+        self._start = 0.0
+    
+    async def run(self, jobs: Union[Iterable[DeliveryJob], AsyncIterable[DeliveryJob]]) -> FanoutResult:
+        """Отправить все задания источника и дождаться окончательного результата по каждому"""
+        self._start = time.monotonic()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            if hasattr(jobs, "__aiter__"):
+                async for job in jobs:
+                    await self._put(job)
+            else:
+                for job in jobs:
+                    await self._put(job)
+            
+            self._produced = True
+            if self._outstanding:
+                await self._done.wait()
+        finally:
+            for handle in self._retry_handles:
+                handle.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        
+        self.result.duration = time.monotonic() - self._start
+        return self.result
+    
+    async def _put(self, job: DeliveryJob):
+        """Ждет свободного места в очереди - генератор не убегает вперед отправки"""
+        self._outstanding += 1
+        self.result.total += 1
+        await self._queue.put(job)
+    
+    async def send(self, job: DeliveryJob):
+        """Собственно вызов Bot API"""
+        await self.bot.send_message(job.chat_id, job.text, parse_mode=job.parse_mode)
+    
+    async def _worker(self):
+        while True:
+            job = self._retries.popleft() if self._retries else await self._queue.get()
+            try:
+                await self.send(job)
+            except Exception as e:
+                self._on_error(job, e)
+            else:
+                if self.result.first_send is None:
+                    self.result.first_send = time.monotonic() - self._start
+                self.result.sent += 1
+                job.attempt += 1
+                self._finish(job, SENT)
+    
+    def _on_error(self, job: DeliveryJob, error: Exception):
+        error_class = classify_send_error(error)
+        job.attempt += 1
+        
+        if error_class in (RETRY_AFTER, TRANSIENT):
+            if error_class == RETRY_AFTER:
+                self.result.retry_after += 1
+                # Ограничитель уже поставил паузу; возвращаемся чуть позже ее окончания
+                delay = error.retry_after + random.uniform(0, 1)
+            else:
+                self.result.transient += 1
+                delay = backoff_delay(job.attempt)
+            
+            if job.attempt < self.max_attempts:
+                self.result.retries += 1
+                self._schedule_retry(job, delay)
+                return
+            
+            self.result.exhausted += 1
+            logger.warning(f"Giving up on chat {job.chat_id} after {job.attempt} attempts: {error}")
+            self._finish(job, EXHAUSTED, error)
+        elif error_class == PERMANENT:
+            self.result.permanent += 1
+            logger.info(f"Chat {job.chat_id} is unreachable: {error}")
+            self._finish(job, PERMANENT, error)
+        else:
+            self.result.failed += 1
+            logger.error(f"Error sending to chat {job.chat_id}: {error}")
+            self._finish(job, FAILED, error)
+    
+    def _schedule_retry(self, job: DeliveryJob, delay: float):
+        """Отложить задание, не занимая воркер"""
+        loop = asyncio.get_running_loop()
+        
+        def requeue():
+            self._retry_handles.discard(handle)
+            if self._queue.full():
+                self._retries.append(job)
+            else:
+                self._queue.put_nowait(job)
+        
+        handle = loop.call_later(delay, requeue)
+        self._retry_handles.add(handle)
+    
+    def on_complete(self, job: DeliveryJob, outcome: str, error: Optional[Exception] = None):
+        """Окончательный исход задания (для наследников, например outbox)"""
+    
+    def _finish(self, job: DeliveryJob, outcome: str, error: Optional[Exception] = None):
+        # Ошибка хука не должна убивать воркер: иначе задание не закрыто и run() ждет вечно
+        try:
+            self.on_complete(job, outcome, error)
+        except Exception as e:
+            logger.error(f"Completion hook failed for chat {job.chat_id}: {e}")
+        finally:
+            self._outstanding -= 1
+            if self._produced and self._outstanding <= 0:
+                self._done.set()
+
+async def deliver(bot: Bot, kind: str, jobs: Union[Iterable[DeliveryJob], AsyncIterable[DeliveryJob]]) -> FanoutResult:
+    """Рассылка заданий через пул воркеров с повторами"""
+    return await FanoutSender(bot, kind).run(jobs)
@@ -1,69 +1,117 @@
 import re
-from typing import Dict, List, Tuple, Optional
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Tuple, Optional, Sequence, TypedDict
 from config import Config
 
-class MessageFilter:
+class FruitRecord(TypedDict):
+    """Фрукт из поста о стоке"""
+    name: str       # Каноническое английское название (как в Config.AVAILABLE_FRUITS_EN)
+    quantity: int
+    raw_name: str   # Как написано в посте
+
+class StockParser:
+    """
+    Разбор поста о стоке за один проход
+    
+    Строится один раз из Config: строки "x<кол-во> <фрукт>" ищутся одним
+    скомпилированным регулярным выражением по всему тексту, а название
+    фрукта разрешается словарем алиасов за O(1). Ключ алиаса не зависит от
+    @, пробелов и регистра, поэтому "@DragonFruit", "DragonFruit" и
+    "Dragon Fruit" дают "Dragon Fruit".
+    """
+    
+    # Строка "x3 @Pear" (пробелы вокруг - в пределах строки)
+    LINE_PATTERN = re.compile(r'^[^\S\n]*x(\d+)[^\S\n]+(\S.*?)[^\S\n]*$', re.MULTILINE)
+    
+    def __init__(self, fruits: List[str], replace_words: Dict[str, str]):
+        self.aliases: Dict[str, str] = {}
+        for fruit in fruits:
+            self.aliases[self.alias_key(fruit)] = fruit
+        for alias, fruit in replace_words.items():
+            if fruit in fruits:
+                self.aliases.setdefault(self.alias_key(alias), fruit)
+    
+    @classmethod
+    def from_config(cls) -> "StockParser":
+        return cls(Config.AVAILABLE_FRUITS_EN, Config.REPLACE_WORDS)
+    
     @staticmethod
-    def clean_fruit_name(fruit_name: str) -> str:
-        """Очистка названия фрукта от @ и замена по словарю"""
-        # Убираем начальный @ если есть
-        if fruit_name.startswith("@"):
-            fruit_name = fruit_name[1:]
-        
-        # Заменяем по словарю REPLACE_WORDS
-        for old, new in Config.REPLACE_WORDS.items():
-            if old in fruit_name:
-                fruit_name = fruit_name.replace(old, new)
-                break
-        
-        # Дополнительные замены
-        fruit_name = fruit_name.replace("DragonFruit", "Dragon Fruit")
-        fruit_name = fruit_name.replace("BloodstoneCycad", "Bloodstone Cycad")
-        fruit_name = fruit_name.replace("ColossalPinecone", "Colossal Pinecone")
-        fruit_name = fruit_name.replace("FrankenKiwi", "Franken Kiwi")
-        fruit_name = fruit_name.replace("DeepseaPearlFruit", "Deepsea Pearl Fruit")
-        fruit_name = fruit_name.replace("VoltGinkgo", "Volt Ginkgo")
-        fruit_name = fruit_name.replace("CandyCorn", "Candy Corn")
-        fruit_name = fruit_name.replace("Candycane", "Candycane")
-        
-        return fruit_name.strip()
+    def alias_key(name: str) -> str:
+        return "".join(name.replace("@", "").split()).casefold()
+    
+    def resolve(self, raw_name: str) -> Optional[str]:
+        """Каноническое название фрукта или None, если это не известный фрукт"""
+        return self.aliases.get(self.alias_key(raw_name))
+    
+    def parse(self, text: str) -> List[FruitRecord]:
+        fruits: List[FruitRecord] = []
+        for match in self.LINE_PATTERN.finditer(text):
+            raw_name = match.group(2)
+            name = self.aliases.get(self.alias_key(raw_name))
+            if name is not None:
+                fruits.append({"name": name, "quantity": int(match.group(1)), "raw_name": raw_name})
+        return fruits
+
+# Общий разборщик, построенный из Config
+stock_parser = StockParser.from_config()
+
+# Языки рендера: русский и все остальные (английский)
+RENDER_LANGUAGES = ("RUS", "EN")
+
+class FruitRender(NamedTuple):
+    """Готовые HTML-фрагменты фрукта для одного языка"""
+    prefix: str     # "<b>🍍 x" - перед количеством
+    suffix: str     # " Ананас</b> — stock" - после количества
+    display: str    # "🍍 Ананас" - для меню и списков
+
+def render_language(lang: str) -> str:
+    return "RUS" if lang == "RUS" else "EN"
+
+def build_fruit_render(fruit_name: str, lang: str) -> FruitRender:
+    """Фрагменты фрукта по словарям Config (неизвестный фрукт - без перевода, эмодзи 🍎)"""
+    if render_language(lang) == "RUS":
+        name = Config.FRUIT_TRANSLATIONS.get(fruit_name, fruit_name)
+        emoji = Config.FRUIT_EMOJIS_RU.get(name, "🍎")
+    else:
+        name = fruit_name
+        emoji = Config.FRUIT_EMOJIS_EN.get(fruit_name, "🍎")
+    
+    if Config.BOLD_FRUITS.get(fruit_name, False):
+        return FruitRender(f"<b>{emoji} x", f" {name}</b> — stock", f"{emoji} {name}")
+    return FruitRender(f"{emoji} x", f" {name} — stock", f"{emoji} {name}")
+
+def build_fruit_render_table() -> Mapping[Tuple[str, str], FruitRender]:
+    """Таблица (фрукт, язык) -> FruitRender, строится один раз при старте"""
+    return MappingProxyType({
+        (fruit, lang): build_fruit_render(fruit, lang)
+        for fruit in Config.AVAILABLE_FRUITS_EN
+        for lang in RENDER_LANGUAGES
+    })
+
+# Неизменяемая таблица рендера фруктов
+FRUIT_RENDER = build_fruit_render_table()
+
+def fruit_render(fruit_name: str, lang: str) -> FruitRender:
+    render = FRUIT_RENDER.get((fruit_name, render_language(lang)))
+    return render if render is not None else build_fruit_render(fruit_name, lang)
+
+class MessageFilter:
+    # Ссылка на сервер Roblox (обязательна для тотема)
+    ROBLOX_LINK = re.compile(r'(https://www\.roblox\.com/[^\s]+Server)')
     
     @staticmethod
-    def extract_fruits(text: str) -> List[Dict]:
+    def extract_fruits(text: str) -> List[FruitRecord]:
         """
         Извлечение фруктов из сообщения о еде
         Формат: 〔🍇〕stock: FoodStock Update\nx1 @Pear
         """
-        fruits = []
-        lines = text.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            # Ищем паттерн типа x1 @Pear или x2 @Acorn
-            match = re.match(r'x(\d+)\s+(.+)', line)
-            if match:
-                quantity = int(match.group(1))
-                raw_fruit_name = match.group(2).strip()
-                
-                # Очищаем название фрукта
-                fruit_name = MessageFilter.clean_fruit_name(raw_fruit_name)
-                
-                # Проверяем, является ли это известным фруктом
-                if fruit_name in Config.AVAILABLE_FRUITS_EN:
-                    fruits.append({
-                        "name": fruit_name,
-                        "quantity": quantity,
-                        "raw_name": raw_fruit_name
-                    })
-        
-        return fruits
+        return stock_parser.parse(text)
     
     @staticmethod
     def get_fruit_emoji(fruit_name: str, lang: str = "EN") -> str:
         """Получение эмодзи для фрукта"""
         if lang == "RUS":
-            from utils.messages import locale_manager
-            russian_name = locale_manager.translate_fruit(fruit_name, lang)
+            russian_name = Config.FRUIT_TRANSLATIONS.get(fruit_name, fruit_name)
             return Config.FRUIT_EMOJIS_RU.get(russian_name, "🍎")
         else:
             return Config.FRUIT_EMOJIS_EN.get(fruit_name, "🍎")
@@ -76,40 +124,57 @@ class MessageFilter:
     @staticmethod
     def format_food_message(fruits: List[Dict], lang: str = "EN") -> str:
         """Форматирование сообщения о еде для отправки - БЕЗ заголовка"""
-        from utils.messages import locale_manager
-        
+        # Эмодзи, перевод и жирность уже в FRUIT_RENDER - остаются склейки строк
         lines = []
         
         for fruit in fruits:
-            fruit_name = fruit["name"]
-            quantity = fruit["quantity"]
-            
-            # Получаем эмодзи для фрукта
-            emoji = MessageFilter.get_fruit_emoji(fruit_name, lang)
-            
-            # Получаем отображаемое имя (с переводом для русского)
-            if lang == "RUS":
-                fruit_display = locale_manager.translate_fruit(fruit_name, "RUS")
-            else:
-                fruit_display = fruit_name
-            
-            # Проверяем, нужно ли выделять жирным
-            if MessageFilter.should_bold(fruit_name):
-                line = f"<b>{emoji} x{quantity} {fruit_display}</b> — stock"
-            else:
-                line = f"{emoji} x{quantity} {fruit_display} — stock"
-            
-            lines.append(line)
+            render = fruit_render(fruit["name"], lang)
+            lines.append(f"{render.prefix}{fruit['quantity']}{render.suffix}")
         
         # Возвращаем только список фруктов, БЕЗ заголовка
         return "\n".join(lines)
     
     @staticmethod
-    def extract_totem_info(text: str) -> Tuple[Optional[str], str, Optional[str]]:
+    def entity_urls(text: str, entities: Sequence[Any]) -> Iterator[str]:
+        """
+        URL из entities сообщения (MessageEntity или dict из корпуса):
+        url - кусок текста (смещения в UTF-16), text_link - скрытая ссылка
+        """
+        encoded = None
+        for entity in entities:
+            fields = entity if isinstance(entity, dict) else entity.__dict__
+            if fields.get("type") == "text_link" and fields.get("url"):
+                yield fields["url"]
+            elif fields.get("type") == "url":
+                if encoded is None:
+                    encoded = text.encode("utf-16-le")
+                start = fields.get("offset", 0) * 2
+                yield encoded[start:start + fields.get("length", 0) * 2].decode("utf-16-le", errors="ignore")
+    
+    @staticmethod
+    def find_roblox_link(text: str, entities: Optional[Sequence[Any]] = None) -> Optional[str]:
+        """Ссылка на сервер Roblox: из entities, если они есть, иначе поиском по тексту"""
+        if entities:
+            for url in MessageFilter.entity_urls(text, entities):
+                match = MessageFilter.ROBLOX_LINK.match(url)
+                if match:
+                    return match.group(1)
+        
+        match = MessageFilter.ROBLOX_LINK.search(text)
+        return match.group(1) if match else None
+    
+    @staticmethod
+    def extract_totem_info(
+        text: str,
+        entities: Optional[Sequence[Any]] = None,
+        text_lower: Optional[str] = None
+    ) -> Tuple[Optional[str], str, Optional[str]]:
         """Извлечение информации о тотеме - ТОЛЬКО если есть ссылка Roblox"""
         # Определяем тип тотема
-        is_free = "totem-free:" in text.lower()
-        is_paid = "totem-paid:" in text.lower()
+        if text_lower is None:
+            text_lower = text.lower()
+        is_free = "totem-free:" in text_lower
+        is_paid = "totem-paid:" in text_lower
         
         if not (is_free or is_paid):
             return None, text, None
@@ -120,15 +185,15 @@ class MessageFilter:
         cleaned_text = text.replace(f"{totem_type}:", "").strip()
         
         # Ищем ссылку Roblox - ОБЯЗАТЕЛЬНО должна быть!
-        link_pattern = r'(https://www\.roblox\.com/[^\s]+Server)'
-        match = re.search(link_pattern, cleaned_text)
+        # Смещения entities относятся к исходному тексту, поиск по тексту - к очищенному
+        link = MessageFilter.find_roblox_link(text, entities) if entities else None
+        if link is None:
+            link = MessageFilter.find_roblox_link(cleaned_text)
         
         # ЕСЛИ ССЫЛКИ НЕТ - не отправляем тотем
-        if not match:
+        if not link:
             return None, text, None
         
-        link = match.group(1)
-        
         # Удаляем ссылку из текста для чистого сообщения
         if link:
             cleaned_text = cleaned_text.replace(link, "").strip()
@@ -157,7 +222,6 @@ class MessageFilter:
         # Формируем заголовок
         if link:
             # Экранируем специальные символы для Markdown
-            import re
             link_escaped = link.replace('(', '\(').replace(')', '\)')
             title = f"{title_emoji} [{title_base}]({link_escaped}):"
             
@@ -168,14 +232,20 @@ class MessageFilter:
             title = f"{title_emoji} {title_base}:"
     
         # Очищаем текст от лишних пробелов
-        import re
         text = re.sub(r'\s+', ' ', text).strip()
     
         return f"{title}\n\n{text}"
     
     @staticmethod
-    def classify_message(text: str) -> Dict:
-        """Классификация входящего сообщения"""
+    def classify_message(text: str, entities: Optional[Sequence[Any]] = None) -> Dict:
+        """
+        Классификация входящего сообщения
+        
+        entities (message.entities / caption_entities) дают ссылку тотема без
+        поиска по всему тексту, в том числе скрытую ссылку (text_link).
+        Фрукты всегда разбираются по тексту: количество есть только в
+        тексте, а короткие @Pear Telegram не размечает как упоминания.
+        """
         text_lower = text.lower()
         
         if "stock:" in text_lower and "foodstock update" in text_lower:
@@ -186,7 +256,7 @@ class MessageFilter:
                     "data": fruits
                 }
         
-        totem_type, cleaned_text, link = MessageFilter.extract_totem_info(text)
+        totem_type, cleaned_text, link = MessageFilter.extract_totem_info(text, entities, text_lower)
         if totem_type:
             return {
                 "type": "totem",
@@ -0,0 +1,89 @@
+"""
+latency.py - Задержка доставки уведомлений: от поста в канале до получения
+
+Для каждой успешной отправки считается время между message.date исходного
+поста и возвратом send_message. Значения копятся в гистограммах с
+логарифмическими корзинами (p50/p90/p99 с точностью до ширины корзины):
+общая гистограмма по типу уведомления в памяти процесса и отдельная на
+каждый пост, сводка которой сохраняется в таблицу post_latency.
+"""
+
+import bisect
+import logging
+import threading
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин (сек): от 50 мс до ~3 ч, каждая на 15% шире предыдущей
+BUCKET_BOUNDS = tuple(0.05 * 1.15 ** i for i in range(80))
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, seconds: float):
+        seconds = max(0.0, seconds)
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+    
+    def merge(self, other: "LatencyHistogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+    
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля q (0..100) - верхняя граница корзины, не больше максимума"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                bound = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+    
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "avg": self.total / self.count if self.count else 0.0
+        }
+
+class LatencyTracker:
+    """Накопленные гистограммы по типам уведомлений (с момента запуска бота)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+    
+    def record_post(self, kind: str, histogram: LatencyHistogram):
+        with self._lock:
+            self._histograms.setdefault(kind, LatencyHistogram()).merge(histogram)
+    
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {kind: histogram.summary() for kind, histogram in self._histograms.items()}
+
+def format_seconds(seconds: float) -> str:
+    """Короткая запись задержки для админских отчетов"""
+    if seconds < 1:
+        return f"{seconds * 1000:.0f} мс"
+    if seconds < 120:
+        return f"{seconds:.1f} с"
+    return f"{seconds / 60:.1f} мин"
+
+# Глобальный экземпляр
+latency_tracker = LatencyTracker()
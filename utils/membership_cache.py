@@ -0,0 +1,112 @@
+"""
+membership_cache.py - Кэш членства в группе для get_chat_member
+
+Ключ - (chat_id, user_id), значение - является ли пользователь участником.
+Положительный ответ живет Config.MEMBERSHIP_CACHE_TTL, отрицательный -
+Config.MEMBERSHIP_CACHE_NEGATIVE_TTL (короче: только что вступивший не
+должен долго ждать). Одновременные запросы одного ключа объединяются в
+один вызов Bot API (single-flight), ошибки не кэшируются.
+
+Записи обновляют события chat_member и проверка подписок (set /
+invalidate), поэтому вступление и выход видны сразу.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Статусы участника группы, которые считаются подпиской
+SUBSCRIBED_STATUSES = ("member", "administrator", "creator")
+
+class MembershipCache:
+    def __init__(
+        self,
+        positive_ttl: float = Config.MEMBERSHIP_CACHE_TTL,
+        negative_ttl: float = Config.MEMBERSHIP_CACHE_NEGATIVE_TTL,
+        maxsize: int = Config.MEMBERSHIP_CACHE_SIZE
+    ):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[int, int], Tuple[bool, float]]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "updates": 0, "invalidations": 0, "errors": 0}
+    
+    async def is_member(self, bot: Bot, chat_id: int, user_id: int) -> bool:
+        """Членство из кэша или одним запросом get_chat_member на всех ожидающих"""
+        key = (chat_id, user_id)
+        cached = self.get(chat_id, user_id)
+        if cached is not None:
+            self._stats["hits"] += 1
+            return cached
+        
+        task = self._inflight.get(key)
+        if task is None:
+            self._stats["misses"] += 1
+            task = asyncio.ensure_future(self._fetch(bot, chat_id, user_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._stats["coalesced"] += 1
+        
+        # shield: отмена одного ожидающего не отменяет запрос остальных
+        return await asyncio.shield(task)
+    
+    async def _fetch(self, bot: Bot, chat_id: int, user_id: int) -> bool:
+        try:
+            chat_member = await bot.get_chat_member(chat_id, user_id)
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        is_member = chat_member.status in SUBSCRIBED_STATUSES
+        self._store(chat_id, user_id, is_member)
+        return is_member
+    
+    def get(self, chat_id: int, user_id: int) -> Optional[bool]:
+        """Неистекшее значение или None"""
+        key = (chat_id, user_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        is_member, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        return is_member
+    
+    def set(self, chat_id: int, user_id: int, is_member: bool):
+        """Достоверный статус извне (событие chat_member, проверка подписок)"""
+        self._stats["updates"] += 1
+        self._store(chat_id, user_id, is_member)
+    
+    def invalidate(self, chat_id: int, user_id: int):
+        if self._entries.pop((chat_id, user_id), None) is not None:
+            self._stats["invalidations"] += 1
+    
+    def _store(self, chat_id: int, user_id: int, is_member: bool):
+        key = (chat_id, user_id)
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self._entries[key] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict:
+        lookups = self._stats["hits"] + self._stats["misses"] + self._stats["coalesced"]
+        return dict(
+            self._stats,
+            entries=len(self._entries),
+            inflight=len(self._inflight),
+            hit_rate=(self._stats["hits"] + self._stats["coalesced"]) / lookups if lookups else 0.0
+        )
+
+# Глобальный экземпляр
+membership_cache = MembershipCache()
@@ -2,6 +2,7 @@ import json
 import os
 from typing import Dict, Any
 from config import Config
+from utils.filters import MessageFilter, fruit_render
 
 class LocaleManager:
     def __init__(self):
@@ -44,18 +45,11 @@ class LocaleManager:
     
     def get_fruit_emoji(self, fruit_name: str, lang: str) -> str:
         """Получение эмодзи для фрукта"""
-        from utils.filters import MessageFilter
         return MessageFilter.get_fruit_emoji(fruit_name, lang)
     
     def get_fruit_display(self, fruit_name: str, lang: str) -> str:
         """Получение отображаемого названия фрукта с эмодзи"""
-        if lang == "RUS":
-            translated = self.translate_fruit(fruit_name, lang)
-            emoji = self.get_fruit_emoji(fruit_name, lang)
-            return f"{emoji} {translated}"
-        else:
-            emoji = self.get_fruit_emoji(fruit_name, lang)
-            return f"{emoji} {fruit_name}"
+        return fruit_render(fruit_name, lang).display
 
 # Создаем глобальный экземпляр
 locale_manager = LocaleManager()
\ No newline at end of file
@@ -0,0 +1,313 @@
+"""
+outbox.py - Надежная очередь рассылок в SQLite
+
+Каждый пост канала сохраняется как задание (outbox_jobs) со строкой доставки
+на каждого получателя (outbox_deliveries). Отправитель отмечает результаты
+пакетами, поэтому после перезапуска бота незавершенные рассылки
+продолжаются с того места, где остановились. Устаревшие задания
+(старше Config.OUTBOX_MAX_AGE для своего типа) не досылаются.
+
+Доставка - "хотя бы один раз": строки, отправленные, но еще не отмеченные
+на момент падения, будут отправлены повторно.
+
+Если включены процессы-отправители (utils/sender_pool.py), publish только
+записывает задание (queue_only), а рассылают его процессы пула.
+
+Задание считается записанным (stored) только после записи всех доставок.
+Если запись прервалась (ошибка БД, падение бота), задание остается
+незаписанным: при перезапуске resume строит доставки заново по описанию
+поста (source) построителем, зарегистрированным для типа рассылки
+(register_builder), и дописывает недостающие.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+
+from config import Config
+from database import async_db, OUTBOX_SENT, OUTBOX_FAILED
+from utils.delivery import DeliveryJob, FanoutResult, FanoutSender, SENT
+from utils.rate_limiter import send_lane
+from utils.latency import LatencyHistogram, format_seconds, latency_tracker
+
+logger = logging.getLogger(__name__)
+
+class OutboxFanout(FanoutSender):
+    """Рассылка одного задания outbox с отметкой результатов в БД"""
+    
+    def __init__(self, bot: Bot, kind: str, job_id: int, outbox: "Outbox", posted_at: Optional[float] = None):
+        super().__init__(bot, kind)
+        self.job_id = job_id
+        self.outbox = outbox
+        self.posted_at = posted_at
+        self.latency = LatencyHistogram()
+    
+    def on_complete(self, job: DeliveryJob, outcome: str, error: Optional[Exception] = None):
+        if outcome == SENT and self.posted_at is not None:
+            # От поста в канале до возврата send_message
+            self.latency.record(time.time() - self.posted_at)
+        status = OUTBOX_SENT if outcome == SENT else OUTBOX_FAILED
+        self.outbox.record((
+            status, job.attempt, str(error)[:200] if error else None,
+            time.time() if outcome == SENT else None, self.job_id, job.chat_id
+        ))
+
+class StoreProgress:
+    """Ход записи новой рассылки в outbox (для воркеров, читающих ее следом)"""
+    
+    def __init__(self):
+        self.stored = asyncio.Event()
+        self.finished = False
+        self.error: Optional[BaseException] = None
+
+class Outbox:
+    def __init__(self, db=async_db):
+        self.db = db
+        self._buffer: List[Tuple] = []
+        self._last_flush = time.monotonic()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._active: Set[int] = set()
+        self._builders: Dict[str, Callable[[Dict], AsyncIterable[DeliveryJob]]] = {}
+        # Рассылают процессы-отправители, publish только записывает задание
+        self.queue_only = False
+    
+    def register_builder(self, kind: str, builder: Callable[[Dict], AsyncIterable[DeliveryJob]]):
+        """Построитель доставок по описанию поста (source) - для дозаписи прерванных заданий"""
+        self._builders[kind] = builder
+    
+    async def publish(
+        self,
+        bot: Bot,
+        kind: str,
+        source_message_id: Optional[int],
+        jobs: AsyncIterable[DeliveryJob],
+        posted_at: Optional[float] = None,
+        source: Optional[Dict] = None
+    ) -> FanoutResult:
+        """
+        Новая рассылка. Задания записываются в outbox фоновой задачей порциями
+        (не дожидаясь отправки), а воркеры читают их из outbox по мере записи -
+        первое сообщение уходит после первой небольшой порции
+        """
+        job_id = await self.db.create_outbox_job(kind, source_message_id, posted_at, source)
+        if self.queue_only:
+            total = await self._store(job_id, jobs, StoreProgress())
+            logger.info(f"📤 Рассылка {job_id} ({kind}) передана процессам-отправителям: {total} доставок")
+            return FanoutResult(kind=kind, total=total)
+        
+        progress = StoreProgress()
+        store_task = asyncio.create_task(self._store(job_id, jobs, progress))
+        try:
+            return await self._deliver(
+                bot, job_id, kind, self._pending(job_id, progress), source_message_id, posted_at, progress
+            )
+        finally:
+            if not store_task.done():
+                store_task.cancel()
+            elif not store_task.cancelled():
+                # Ошибка записи уже в логе и в progress.error
+                store_task.exception()
+    
+    async def resume_job(self, bot: Bot, job: Dict) -> FanoutResult:
+        """Дослать неотправленные доставки существующего задания (строка outbox_jobs)"""
+        if not job["stored"]:
+            await self._rebuild(job)
+        return await self._deliver(
+            bot, job["job_id"], job["kind"], self._pending(job["job_id"]),
+            job["source_message_id"], job["posted_at"]
+        )
+    
+    async def _store(self, job_id: int, jobs: AsyncIterable[DeliveryJob], progress: "StoreProgress") -> int:
+        """Запись заданий в outbox порциями; порция растет от 16 до OUTBOX_INSERT_CHUNK"""
+        payload_ids = {}
+        chunk_size = 16
+        chunk = []
+        total = 0
+        try:
+            async for job in jobs:
+                chunk.append((job.chat_id, job.text, job.parse_mode))
+                if len(chunk) >= chunk_size:
+                    total += await self.db.add_outbox_deliveries(job_id, chunk, payload_ids)
+                    progress.stored.set()
+                    chunk = []
+                    chunk_size = min(chunk_size * 2, Config.OUTBOX_INSERT_CHUNK)
+            
+            if chunk:
+                total += await self.db.add_outbox_deliveries(job_id, chunk, payload_ids)
+            
+            # Только полностью записанное задание может быть закрыто
+            await self.db.mark_outbox_stored(job_id)
+            logger.info(f"Outbox job {job_id} stored: {total} deliveries")
+        except Exception as e:
+            # Задание остается незаписанным - resume допишет его после перезапуска
+            progress.error = e
+            logger.error(f"❌ Ошибка записи рассылки {job_id} в outbox: {e}")
+            raise
+        finally:
+            progress.finished = True
+            progress.stored.set()
+        
+        return total
+    
+    async def _rebuild(self, job: Dict):
+        """Дописать доставки прерванного задания заново по описанию поста"""
+        builder = self._builders.get(job["kind"])
+        if builder is None or not job["source"]:
+            # Строить не из чего - досылается то, что успели записать
+            logger.warning(
+                f"⚠️ Задание outbox {job['job_id']} ({job['kind']}) записано не полностью "
+                f"и не может быть дописано"
+            )
+            await self.db.mark_outbox_stored(job["job_id"])
+            return
+        
+        added = await self._store(job["job_id"], builder(json.loads(job["source"])), StoreProgress())
+        logger.info(f"🧩 Задание outbox {job['job_id']} ({job['kind']}) дописано: {added} новых доставок")
+    
+    async def _pending(self, job_id: int, progress: Optional["StoreProgress"] = None) -> AsyncIterator[DeliveryJob]:
+        """
+        Неотправленные доставки задания постранично. Если задание еще
+        записывается (progress), ждет следующих порций до конца записи
+        """
+        after_id = 0
+        while True:
+            if progress is not None:
+                progress.stored.clear()
+            rows = await self.db.get_pending_deliveries(job_id, after_id, Config.OUTBOX_INSERT_CHUNK)
+            if rows:
+                for row in rows:
+                    yield DeliveryJob(row["user_id"], row["text"], row["parse_mode"], attempt=row["attempts"])
+                after_id = rows[-1]["delivery_id"]
+                continue
+            
+            if progress is None or progress.finished:
+                return
+            await progress.stored.wait()
+    
+    async def _deliver(
+        self,
+        bot: Bot,
+        job_id: int,
+        kind: str,
+        jobs: AsyncIterable[DeliveryJob],
+        source_message_id: Optional[int] = None,
+        posted_at: Optional[float] = None,
+        progress: Optional[StoreProgress] = None
+    ) -> FanoutResult:
+        sender = OutboxFanout(bot, kind, job_id, self, posted_at)
+        self._active.add(job_id)
+        try:
+            # Тип рассылки (food/totem) - это и полоса приоритета в ограничителе
+            with send_lane(kind):
+                result = await sender.run(jobs)
+        finally:
+            self._active.discard(job_id)
+            # Даже при остановке бота сохраняем то, что уже успели отправить
+            await self.flush()
+        
+        if progress is not None and progress.error is not None:
+            # Разослано только записанное; задание закроется после дозаписи при перезапуске
+            logger.warning(f"⚠️ Рассылка outbox {job_id} ({kind}) записана не полностью и остается открытой")
+            return result
+        
+        await self.db.finish_outbox_job(job_id, "done")
+        await self._save_latency(job_id, kind, source_message_id, sender.latency)
+        return result
+    
+    async def _save_latency(self, job_id: int, kind: str, source_message_id: Optional[int], histogram: LatencyHistogram):
+        """Гистограмма поста - в общую статистику и сводкой в БД"""
+        if not histogram.count:
+            return
+        latency_tracker.record_post(kind, histogram)
+        summary = histogram.summary()
+        logger.info(
+            f"⏱ Задержка {kind} (пост {source_message_id}): p50 {format_seconds(summary['p50'])}, "
+            f"p90 {format_seconds(summary['p90'])}, p99 {format_seconds(summary['p99'])}"
+        )
+        try:
+            await self.db.save_post_latency(job_id, kind, source_message_id, summary)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения задержки доставки: {e}")
+    
+    async def complete_queued_jobs(self) -> int:
+        """Закрыть задания, разосланные процессами-отправителями, и сохранить их задержку"""
+        jobs = await self.db.complete_outbox_jobs()
+        for job in jobs:
+            histogram = LatencyHistogram()
+            for seconds in await self.db.get_delivery_latencies(job["job_id"]):
+                histogram.record(seconds)
+            logger.info(f"📊 Рассылка outbox {job['job_id']} ({job['kind']}) завершена процессами-отправителями")
+            await self._save_latency(job["job_id"], job["kind"], job["source_message_id"], histogram)
+        return len(jobs)
+    
+    def record(self, row: Tuple):
+        """Запомнить результат доставки; в БД пишется пакетами"""
+        self._buffer.append(row)
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        if (
+            len(self._buffer) >= Config.OUTBOX_FLUSH_BATCH
+            or time.monotonic() - self._last_flush >= Config.OUTBOX_FLUSH_INTERVAL
+        ):
+            self._flush_task = asyncio.create_task(self.flush())
+    
+    async def flush(self):
+        """Записать накопленные результаты одной транзакцией"""
+        async with self._flush_lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return
+            rows, self._buffer = self._buffer, []
+            try:
+                await self.db.mark_deliveries(rows)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи результатов outbox ({len(rows)} строк): {e}")
+                self._buffer = rows + self._buffer
+    
+    async def resume(self, bot: Bot):
+        """Продолжить рассылки, прерванные перезапуском бота"""
+        try:
+            removed = await self.db.prune_outbox(Config.OUTBOX_RETENTION_DAYS)
+            if removed:
+                logger.info(f"🧹 Удалено старых заданий outbox: {removed}")
+            
+            for job in await self.db.get_unfinished_outbox_jobs():
+                max_age = Config.OUTBOX_MAX_AGE.get(job["kind"], 0)
+                if job["age"] > max_age:
+                    await self.db.finish_outbox_job(job["job_id"], "expired")
+                    logger.warning(
+                        f"⌛ Задание outbox {job['job_id']} ({job['kind']}) устарело "
+                        f"({job['age']:.0f} с) и не будет дослано"
+                    )
+                    continue
+                
+                try:
+                    if self.queue_only:
+                        # Недописанное задание дописывается, рассылают процессы-отправители
+                        if not job["stored"]:
+                            await self._rebuild(job)
+                        logger.info(f"🔁 Рассылка outbox {job['job_id']} ({job['kind']}) остается процессам-отправителям")
+                        continue
+                    
+                    logger.info(f"🔁 Продолжаю рассылку outbox {job['job_id']} ({job['kind']})")
+                    result = await self.resume_job(bot, job)
+                    logger.info(f"📊 Досылка outbox {job['job_id']}: {result.summary()}")
+                except Exception as e:
+                    logger.error(f"❌ Ошибка продолжения рассылки outbox {job['job_id']}: {e}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка продолжения рассылок outbox: {e}")
+    
+    def stats(self) -> Dict:
+        return {
+            "active_jobs": len(self._active),
+            "queue_only": self.queue_only,
+            "buffered": len(self._buffer)
+        }
+
+# Глобальный экземпляр
+outbox = Outbox()
@@ -0,0 +1,301 @@
+"""
+rate_limiter.py - Общий ограничитель исходящих отправок в Telegram
+
+Лимиты Bot API:
+- глобально ~30 сообщений в секунду на бота;
+- не чаще 1 сообщения в секунду в один личный чат;
+- не более 20 сообщений в минуту в одну группу.
+
+Все отправки (рассылки, уведомления, ответы калькулятора) проходят через
+RateLimitMiddleware, подключенный к сессии бота. При TelegramRetryAfter
+ставится пауза на нужную область (чат или весь бот) ровно на retry_after.
+
+Общий бюджет бота распределяется по полосам приоритета (LANES): пока есть
+ожидающие отправки в более важной полосе, менее важные ждут. Полоса
+задается контекстом (send_lane), по умолчанию - interactive.
+
+Если рассылку ведут отдельные процессы (Config.SENDER_PROCESSES), их
+ограничители и ограничитель бота делят один глобальный бюджет -
+SharedTokenBucket в общей памяти.
+"""
+
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, CopyMessages, ForwardMessage, ForwardMessages, Response, SendAnimation, SendAudio,
+    SendDocument, SendMediaGroup, SendMessage, SendPhoto, SendSticker, SendVideo, SendVoice,
+    TelegramMethod
+)
+from aiogram.methods.base import TelegramType
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые создают сообщения и расходуют лимит
+LIMITED_METHODS = (
+    SendMessage, CopyMessage, CopyMessages, ForwardMessage, ForwardMessages, SendDocument,
+    SendPhoto, SendVideo, SendAnimation, SendAudio, SendVoice, SendSticker, SendMediaGroup
+)
+
+# Полосы приоритета, от самой важной к наименее важной
+LANES = ("totem", "interactive", "food", "broadcast", "housekeeping")
+DEFAULT_LANE = "interactive"
+
+current_lane: contextvars.ContextVar[str] = contextvars.ContextVar("send_lane", default=DEFAULT_LANE)
+
+@contextmanager
+def send_lane(lane: str):
+    """Все отправки внутри блока (и созданных в нем задач) идут в полосе lane"""
+    token = current_lane.set(lane if lane in LANES else DEFAULT_LANE)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+class TokenBucket:
+    """
+    Корзина токенов в форме GCRA: вместо счетчика хранится теоретическое
+    время следующей отправки, поэтому резервирование - одна операция
+    """
+    
+    def __init__(self, rate: float, burst: float = 1):
+        self.interval = 1 / rate
+        self.tolerance = (max(burst, 1) - 1) * self.interval
+        self.tat = 0.0
+        self.last_sent = 0.0
+        self.prev_sent = 0.0
+    
+    def delay(self, now: float) -> float:
+        """Сколько ждать следующей отправки (без резервирования)"""
+        return max(0.0, max(self.tat, now) - self.tolerance - now)
+    
+    def reserve(self, now: float) -> float:
+        """Зарезервировать отправку, вернуть сколько нужно подождать"""
+        tat = max(self.tat, now)
+        wait = max(0.0, tat - self.tolerance - now)
+        self.tat = tat + self.interval
+        self.prev_sent, self.last_sent = self.last_sent, now + wait
+        return wait
+    
+    def pause(self, until: float):
+        """Запретить отправки до момента until"""
+        self.tat = max(self.tat, until + self.tolerance)
+    
+    def is_idle(self, now: float) -> bool:
+        return self.tat <= now
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Та же корзина, но состояние (tat, last_sent, prev_sent) лежит в общей
+    памяти и меняется под межпроцессной блокировкой. time.monotonic() у
+    процессов одной машины общий, поэтому время сравнимо
+    """
+    
+    def __init__(self, rate: float, burst: float = 1, state=None):
+        # Состояние не сбрасываем: в процессе-отправителе оно уже общее
+        self.interval = 1 / rate
+        self.tolerance = (max(burst, 1) - 1) * self.interval
+        # Процессы-отправители запускаются через spawn - блокировка из того же контекста
+        self.state = state if state is not None else multiprocessing.get_context("spawn").Array("d", 3)
+    
+    tat = property(lambda self: self.state[0], lambda self, value: self.state.__setitem__(0, value))
+    last_sent = property(lambda self: self.state[1], lambda self, value: self.state.__setitem__(1, value))
+    prev_sent = property(lambda self: self.state[2], lambda self, value: self.state.__setitem__(2, value))
+    
+    def delay(self, now: float) -> float:
+        with self.state.get_lock():
+            return super().delay(now)
+    
+    def reserve(self, now: float) -> float:
+        with self.state.get_lock():
+            return super().reserve(now)
+    
+    def pause(self, until: float):
+        with self.state.get_lock():
+            super().pause(until)
+
+class RateLimiter:
+    def __init__(
+        self,
+        global_rate: float = Config.TELEGRAM_GLOBAL_RATE,
+        private_rate: float = Config.TELEGRAM_PRIVATE_CHAT_RATE,
+        group_per_minute: float = Config.TELEGRAM_GROUP_PER_MINUTE
+    ):
+        self.global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_per_minute / 60
+        self._chats: Dict[int, TokenBucket] = {}
+        # Очереди ожидающих глобального бюджета: (future, время постановки)
+        self._lanes: Dict[str, Deque] = {lane: deque() for lane in LANES}
+        self._lane_stats = {lane: {"granted": 0, "queued": 0, "wait_total": 0.0, "wait_max": 0.0} for lane in LANES}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats = {
+            "acquired": 0,
+            "delayed": 0,
+            "wait_total": 0.0,
+            "retry_after": 0,
+            "global_pauses": 0,
+            "chat_pauses": 0
+        }
+    
+    @staticmethod
+    def _now() -> float:
+        return time.monotonic()
+    
+    def use_global_bucket(self, bucket: TokenBucket):
+        """Заменить глобальный бюджет (общий с процессами-отправителями)"""
+        self.global_bucket = bucket
+    
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 50000:
+                self._prune()
+            # Положительный ID - личный чат, отрицательный - группа/канал
+            rate = self.private_rate if chat_id > 0 else self.group_rate
+            bucket = TokenBucket(rate)
+            self._chats[chat_id] = bucket
+        return bucket
+    
+    def _prune(self):
+        """Удаление корзин чатов, которые давно не использовались"""
+        now = self._now()
+        self._chats = {
+            chat_id: bucket for chat_id, bucket in self._chats.items()
+            if not bucket.is_idle(now)
+        }
+    
+    async def acquire(self, chat_id: Optional[Union[int, str]] = None):
+        """Дождаться разрешения на отправку в чат"""
+        waited = 0.0
+        
+        if isinstance(chat_id, int):
+            wait = self._chat_bucket(chat_id).reserve(self._now())
+            if wait > 0:
+                waited += wait
+                await asyncio.sleep(wait)
+        
+        waited += await self._acquire_global(current_lane.get())
+        
+        self._stats["acquired"] += 1
+        if waited > 0:
+            self._stats["delayed"] += 1
+            self._stats["wait_total"] += waited
+    
+    async def _acquire_global(self, lane: str) -> float:
+        """Место в глобальном бюджете с учетом приоритета полосы"""
+        stats = self._lane_stats[lane]
+        now = self._now()
+        
+        # Быстрый путь: никто не ждет и бюджет есть
+        if not any(self._lanes.values()) and self.global_bucket.delay(now) == 0:
+            self.global_bucket.reserve(now)
+            stats["granted"] += 1
+            return 0.0
+        
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[lane].append((future, now))
+        stats["queued"] += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        
+        await future
+        waited = self._now() - now
+        stats["granted"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        return waited
+    
+    async def _dispatch(self):
+        """Выдача глобального бюджета ожидающим: всегда самой важной непустой полосе"""
+        while True:
+            lane_queue = next((queue for queue in self._lanes.values() if queue), None)
+            if lane_queue is None:
+                return
+            
+            wait = self.global_bucket.delay(self._now())
+            if wait > 0:
+                # После сна полоса могла смениться (пришел тотем) - выбираем заново
+                await asyncio.sleep(wait)
+                continue
+            
+            future, _ = lane_queue.popleft()
+            if future.done():
+                # Ожидающий отменен
+                continue
+            self.global_bucket.reserve(self._now())
+            future.set_result(None)
+    
+    def on_retry_after(self, chat_id: Optional[Union[int, str]], retry_after: float):
+        """
+        Пауза после 429. Если в чат только что уже отправляли - превышен лимит
+        чата, иначе - глобальный лимит бота
+        """
+        now = self._now()
+        until = now + retry_after
+        self._stats["retry_after"] += 1
+        
+        bucket = self._chats.get(chat_id) if isinstance(chat_id, int) else None
+        chat_window = bucket.interval if bucket else 0
+        if bucket and bucket.prev_sent and bucket.last_sent - bucket.prev_sent < chat_window * 2:
+            bucket.pause(until)
+            self._stats["chat_pauses"] += 1
+            logger.warning(f"Flood control in chat {chat_id}: pause {retry_after}s")
+        else:
+            self.global_bucket.pause(until)
+            self._stats["global_pauses"] += 1
+            logger.warning(f"Global flood control: pause all sends for {retry_after}s")
+    
+    def stats(self) -> Dict:
+        """Статистика ограничителя"""
+        stats = dict(self._stats)
+        stats["tracked_chats"] = len(self._chats)
+        stats["wait_avg_ms"] = (stats["wait_total"] / stats["delayed"] * 1000) if stats["delayed"] else 0.0
+        stats["lanes"] = {
+            lane: {
+                "depth": len(self._lanes[lane]),
+                "granted": lane_stats["granted"],
+                "queued": lane_stats["queued"],
+                "wait_avg_ms": (lane_stats["wait_total"] / lane_stats["queued"] * 1000) if lane_stats["queued"] else 0.0,
+                "wait_max_ms": lane_stats["wait_max"] * 1000
+            }
+            for lane, lane_stats in self._lane_stats.items()
+        }
+        return stats
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: каждая отправка ждет свою очередь в RateLimiter"""
+    
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        if not isinstance(method, LIMITED_METHODS):
+            return await make_request(bot, method)
+        
+        chat_id = getattr(method, "chat_id", None)
+        await self.limiter.acquire(chat_id)
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.limiter.on_retry_after(chat_id, e.retry_after)
+            raise
+
+# Глобальный экземпляр
+rate_limiter = RateLimiter()
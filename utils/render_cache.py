@@ -0,0 +1,78 @@
+"""
+render_cache.py - Кэш текстов уведомлений на время рассылки одного поста
+
+Текст уведомления зависит только от ключа получателя: для еды это
+(язык, набор подходящих фруктов), для тотема - язык. Поэтому каждый
+различный текст форматируется один раз за пост, а остальные получатели
+с тем же ключом получают уже готовую строку.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class RenderCache:
+    """Ограниченный LRU-кэш отрендеренных текстов одного поста"""
+    
+    def __init__(self, kind: str, maxsize: int = Config.RENDER_CACHE_SIZE):
+        self.kind = kind
+        self.maxsize = maxsize
+        self._texts: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: Hashable, render: Callable[[], str]) -> str:
+        """Готовый текст для ключа; render вызывается только при промахе"""
+        text = self._texts.get(key)
+        if text is not None:
+            self.hits += 1
+            self._texts.move_to_end(key)
+            return text
+        
+        self.misses += 1
+        text = render()
+        self._texts[key] = text
+        if len(self._texts) > self.maxsize:
+            self._texts.popitem(last=False)
+            self.evictions += 1
+        return text
+    
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+    
+    def summary(self) -> str:
+        return (
+            f"рендер {self.kind}: {self.misses} текстов на {self.hits + self.misses} получателей "
+            f"(попаданий {self.hit_rate:.0%})"
+        )
+
+class RenderStats:
+    """Накопленная статистика кэшей рендера по всем постам"""
+    
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = {}
+    
+    def record(self, cache: RenderCache):
+        stats = self._stats.setdefault(cache.kind, {"posts": 0, "hits": 0, "misses": 0, "evictions": 0})
+        stats["posts"] += 1
+        stats["hits"] += cache.hits
+        stats["misses"] += cache.misses
+        stats["evictions"] += cache.evictions
+        logger.info(cache.summary())
+    
+    def stats(self) -> Dict[str, Dict]:
+        result = {}
+        for kind, stats in self._stats.items():
+            lookups = stats["hits"] + stats["misses"]
+            result[kind] = dict(stats, hit_rate=stats["hits"] / lookups if lookups else 0.0)
+        return result
+
+# Глобальный экземпляр
+render_stats = RenderStats()
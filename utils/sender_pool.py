@@ -0,0 +1,191 @@
+"""
+sender_pool.py - Процессы-отправители рассылок
+
+Один event loop упирается в CPU задолго до лимитов Telegram при больших
+рассылках. При Config.SENDER_PROCESSES > 0 бот запускает N отдельных
+процессов, у каждого свой Bot и своя aiohttp-сессия:
+
+- процесс бота только записывает задания в outbox (Outbox.queue_only);
+- каждый процесс-отправитель забирает порции доставок из outbox
+  (claim_deliveries - тотемы раньше еды), рассылает их и отмечает
+  результаты пакетами;
+- глобальный лимит бота общий: ограничители всех процессов берут бюджет
+  из одной SharedTokenBucket в общей памяти;
+- процесс бота следит за отправителями (перезапуск упавших), закрывает
+  разосланные задания и сохраняет их задержку доставки.
+
+Доставки упавшего процесса возвращаются в очередь через
+Config.SENDER_CLAIM_TIMEOUT или при его перезапуске.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import sys
+import time
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+
+from config import Config
+from database import AsyncDatabase
+from utils.delivery import DeliveryJob
+from utils.outbox import Outbox, OutboxFanout, outbox
+from utils.rate_limiter import RateLimiter, RateLimitMiddleware, SharedTokenBucket, rate_limiter, send_lane
+from utils.shadow import ShadowMiddleware, shadow_recorder
+
+logger = logging.getLogger(__name__)
+
+def run_sender(worker_id: int, db_path: str, bucket_state, shadow_state, stop_event):
+    """Точка входа процесса-отправителя (запускается через spawn)"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s - sender-{worker_id} - %(levelname)s - %(message)s",
+        stream=sys.stdout
+    )
+    try:
+        asyncio.run(_sender_loop(worker_id, db_path, bucket_state, shadow_state, stop_event))
+    except KeyboardInterrupt:
+        pass
+
+async def _sender_loop(worker_id: int, db_path: str, bucket_state, shadow_state, stop_event):
+    db = AsyncDatabase(db_path)
+    session = None
+    if Config.BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(Config.BOT_API_URL))
+    bot = Bot(
+        token=Config.BOT_TOKEN,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    limiter = RateLimiter()
+    limiter.use_global_bucket(SharedTokenBucket(
+        Config.TELEGRAM_GLOBAL_RATE, burst=Config.TELEGRAM_GLOBAL_RATE, state=bucket_state
+    ))
+    bot.session.middleware(RateLimitMiddleware(limiter))
+    if Config.SHADOW_MODE:
+        # Счетчики общие с процессом бота - /perf видит и эти отправки
+        shadow_recorder.use_shared_state(shadow_state)
+        bot.session.middleware(ShadowMiddleware(shadow_recorder))
+    results = Outbox(db)
+    
+    try:
+        # Доставки, забранные прошлым запуском этого процесса
+        released = await db.release_claims(worker_id)
+        if released:
+            logger.info(f"🔁 Возвращено в очередь доставок прошлого запуска: {released}")
+        logger.info(f"🚀 Процесс-отправитель {worker_id} запущен")
+        
+        while not stop_event.is_set():
+            rows = await db.claim_deliveries(
+                worker_id, Config.SENDER_CLAIM_BATCH, time.time() - Config.SENDER_CLAIM_TIMEOUT
+            )
+            if not rows:
+                await asyncio.sleep(Config.SENDER_POLL_INTERVAL)
+                continue
+            
+            # Порция упорядочена по приоритету; строки одного задания рассылаем вместе
+            groups: Dict[int, List[Dict]] = {}
+            for row in rows:
+                groups.setdefault(row["job_id"], []).append(row)
+            for job_id, group in groups.items():
+                kind = group[0]["kind"]
+                sender = OutboxFanout(bot, kind, job_id, results, group[0]["posted_at"])
+                with send_lane(kind):
+                    await sender.run(
+                        DeliveryJob(row["user_id"], row["text"], row["parse_mode"], attempt=row["attempts"])
+                        for row in group
+                    )
+            await results.flush()
+    except Exception as e:
+        logger.error(f"💥 Ошибка процесса-отправителя {worker_id}: {e}")
+        raise
+    finally:
+        await results.flush()
+        await db.release_claims(worker_id)
+        await bot.session.close()
+        shadow_recorder.close()
+        db.close()
+        logger.info(f"👋 Процесс-отправитель {worker_id} остановлен")
+
+class SenderPool:
+    def __init__(self, processes: int = Config.SENDER_PROCESSES, db_path: str = Config.DATABASE_PATH):
+        self.processes = processes
+        self.db_path = db_path
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: Dict[int, multiprocessing.Process] = {}
+        self._stop_event = None
+        self._bucket: Optional[SharedTokenBucket] = None
+        self._stats = {"restarts": 0, "completed_jobs": 0}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.processes > 0
+    
+    def start(self):
+        """Запуск процессов; с этого момента рассылки только записываются в outbox"""
+        if not self.enabled or self._workers:
+            return
+        self._bucket = SharedTokenBucket(Config.TELEGRAM_GLOBAL_RATE, burst=Config.TELEGRAM_GLOBAL_RATE)
+        rate_limiter.use_global_bucket(self._bucket)
+        outbox.queue_only = True
+        self._stop_event = self._context.Event()
+        for worker_id in range(self.processes):
+            self._spawn(worker_id)
+        logger.info(f"📤 Запущено процессов-отправителей: {self.processes}")
+    
+    def _spawn(self, worker_id: int):
+        process = self._context.Process(
+            target=run_sender,
+            args=(
+                worker_id, self.db_path, self._bucket.state,
+                shadow_recorder.state if Config.SHADOW_MODE else None, self._stop_event
+            ),
+            name=f"sender-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        self._workers[worker_id] = process
+    
+    async def supervise(self, interval: float = 1.0):
+        """Перезапуск упавших отправителей и закрытие разосланных заданий"""
+        while self._workers and not self._stop_event.is_set():
+            await asyncio.sleep(interval)
+            for worker_id, process in list(self._workers.items()):
+                if not process.is_alive() and not self._stop_event.is_set():
+                    logger.warning(
+                        f"⚠️ Процесс-отправитель {worker_id} завершился (код {process.exitcode}), перезапускаю"
+                    )
+                    self._stats["restarts"] += 1
+                    self._spawn(worker_id)
+            try:
+                self._stats["completed_jobs"] += await outbox.complete_queued_jobs()
+            except Exception as e:
+                logger.error(f"❌ Ошибка закрытия заданий outbox: {e}")
+    
+    async def stop(self, timeout: float = 10.0):
+        """Остановка: отправители дописывают результаты и возвращают незавершенное в очередь"""
+        if not self._workers:
+            return
+        self._stop_event.set()
+        loop = asyncio.get_running_loop()
+        for process in self._workers.values():
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+        self._workers.clear()
+        logger.info("👋 Процессы-отправители остановлены")
+    
+    def stats(self) -> Dict:
+        return dict(
+            self._stats,
+            processes=self.processes,
+            alive=sum(process.is_alive() for process in self._workers.values())
+        )
+
+# Глобальный экземпляр
+sender_pool = SenderPool()
@@ -0,0 +1,152 @@
+"""
+shadow.py - Теневой режим: бот работает полностью, но ничего не отправляет
+
+При Config.SHADOW_MODE новая сборка запускается рядом с рабочей: посты
+канала классифицируются, получатели ищутся, тексты рендерятся, отправки
+проходят ограничитель лимитов - и только сам вызов Bot API заменяется
+записью в JSONL (Config.SHADOW_LOG_PATH). По записям сравниваются число
+получателей и расчетная скорость рассылки двух сборок.
+
+ShadowMiddleware подключается к сессии бота после RateLimitMiddleware,
+поэтому время записи - это время, когда отправка ушла бы в Telegram.
+
+Счетчики для /perf лежат в общей памяти: процессы-отправители получают
+массив процесса бота (SenderPool) и пишут в него, поэтому статистика
+учитывает отправки всех процессов.
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import (
+    AnswerCallbackQuery, CopyMessage, CopyMessages, DeleteMessage, EditMessageReplyMarkup,
+    EditMessageText, ForwardMessages, PinChatMessage, Response, SendMediaGroup, TelegramMethod
+)
+from aiogram.methods.base import TelegramType
+from aiogram.types import Chat, Message, MessageId
+
+from config import Config
+from utils.rate_limiter import LANES, LIMITED_METHODS, current_lane
+
+logger = logging.getLogger(__name__)
+
+# Методы с последствиями для пользователей: в теневом режиме не выполняются
+SHADOW_METHODS = LIMITED_METHODS + (
+    EditMessageText, EditMessageReplyMarkup, DeleteMessage, AnswerCallbackQuery, PinChatMessage
+)
+
+class ShadowRecorder:
+    """Запись несостоявшихся вызовов Bot API в JSONL"""
+    
+    def __init__(self, path: str = Config.SHADOW_LOG_PATH, state=None):
+        self.path = path
+        self._file = None
+        self._message_id = 0
+        self._state = state
+    
+    @property
+    def state(self):
+        """(first, last, отправок по полосам LANES) в общей памяти; создается при первой записи"""
+        if self._state is None:
+            # Процессы-отправители запускаются через spawn - как у SharedTokenBucket
+            self._state = multiprocessing.get_context("spawn").Array("d", 2 + len(LANES))
+        return self._state
+    
+    def use_shared_state(self, state):
+        """Процесс-отправитель: считать в общий массив процесса бота"""
+        self._state = state
+    
+    def record(self, method: TelegramMethod, chat_id: Any):
+        now = time.time()
+        text = getattr(method, "text", None) or getattr(method, "caption", None) or ""
+        lane = current_lane.get()
+        entry = {
+            "ts": round(now, 4),
+            "method": method.__api_method__,
+            "chat_id": chat_id,
+            "lane": lane,
+            "chars": len(text),
+            "text_sha1": hashlib.sha1(text.encode("utf-8")).hexdigest()[:12] if text else None
+        }
+        try:
+            if self._file is None:
+                # Построчная запись: строки процессов-отправителей в общем файле не перемешиваются
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"❌ Ошибка записи теневого журнала: {e}")
+        
+        with self.state.get_lock():
+            self.state[2 + (LANES.index(lane) if lane in LANES else 0)] += 1
+            self.state[0] = self.state[0] or now
+            self.state[1] = now
+    
+    def next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+    
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def stats(self) -> Dict:
+        with self.state.get_lock():
+            first, last, *counts = self.state[:]
+        lanes = {lane: int(count) for lane, count in zip(LANES, counts) if count}
+        total = sum(lanes.values())
+        span = (last - first) if first and last else 0.0
+        return {
+            "recorded": total,
+            "lanes": lanes,
+            "sends_per_sec": total / span if span > 0 else 0.0
+        }
+
+class ShadowMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: вместо вызова Bot API - запись и правдоподобный ответ"""
+    
+    def __init__(self, recorder: ShadowRecorder):
+        self.recorder = recorder
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        if not isinstance(method, SHADOW_METHODS):
+            return await make_request(bot, method)
+        
+        chat_id = getattr(method, "chat_id", None)
+        self.recorder.record(method, chat_id)
+        return self._fake_result(bot, method, chat_id)
+    
+    def _fake_result(self, bot: Bot, method: TelegramMethod, chat_id: Any):
+        if isinstance(method, (SendMediaGroup, CopyMessages, ForwardMessages)):
+            return []
+        if isinstance(method, CopyMessage):
+            return MessageId(message_id=self.recorder.next_message_id())
+        if not isinstance(method, LIMITED_METHODS + (EditMessageText,)) or chat_id is None:
+            return True
+        
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "supergroup"
+        return Message(
+            message_id=getattr(method, "message_id", None) or self.recorder.next_message_id(),
+            date=datetime.now(),
+            chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type=chat_type),
+            text=getattr(method, "text", None)
+        ).as_(bot)
+
+# Глобальный экземпляр
+shadow_recorder = ShadowRecorder()
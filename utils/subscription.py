@@ -1,73 +1,321 @@
+"""
+subscription.py - Проверка подписки на обязательную группу
+
+Вступление в группу и выход из нее бот узнает сразу из событий chat_member
+(handlers/membership.py). Проверка через get_chat_member - медленная
+сверка на случай пропущенных событий.
+
+RollingSweep проверяет подписки по кругу: каждые Config.SWEEP_TICK секунд
+берется срез пользователей с самым старым users.last_check (индекс
+idx_users_last_check) такого размера, чтобы вся база проходилась ровно за
+Config.SUBSCRIPTION_CHECK_INTERVAL. Положение круга сохраняется в
+sweep_state, а last_check проверенных обновляется, поэтому после
+перезапуска проверка продолжается с того же места.
+
+Срез проверяет SubscriptionSweep: запросы get_chat_member идут не быстрее
+Config.SWEEP_RATE в секунду, не более Config.SWEEP_CONCURRENCY
+одновременно и расходуют общий бюджет RateLimiter в полосе housekeeping,
+поэтому не мешают уведомлениям. Исключения загружаются одним запросом,
+статусы пишутся пачками в одной транзакции (изменившиеся - целиком,
+остальным - только last_check).
+
+Отписавшимся считается только пользователь со статусом left/kicked или
+с ошибкой про самого пользователя (user not found). Если бот не может
+читать участников группы (удален из нее, нет прав, chat not found),
+проверка прерывается: иначе все пользователи оказались бы отписавшимися.
+"""
+
 from datetime import datetime, timedelta
 import asyncio
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
 from aiogram import Bot
-from database import Database
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from database import async_db
 from config import Config
+from utils.delivery import DeliveryJob, RETRY_AFTER, TRANSIENT, backoff_delay, classify_send_error, deliver
+from utils.membership_cache import SUBSCRIBED_STATUSES, membership_cache
 from utils.messages import locale_manager
+from utils.rate_limiter import TokenBucket, rate_limiter, send_lane
+
+logger = logging.getLogger(__name__)
+
+db = async_db
+
+# Ошибки get_chat_member про самого пользователя - в группе его точно нет
+USER_NOT_FOUND_ERRORS = ("user not found", "participant_id_invalid", "user_id_invalid")
+
+# Ошибки доступа к самой группе - статус пользователей по ним неизвестен
+GROUP_UNAVAILABLE_ERRORS = (
+    "chat not found", "not enough rights", "chat_admin_required",
+    "member list is inaccessible", "bot is not a member", "bot was kicked"
+)
 
-db = Database()
+class GroupUnavailableError(Exception):
+    """Бот не может читать участников обязательной группы"""
 
 async def check_user_subscription(user_id: int, group_id: int, bot: Bot, ignore_exceptions: bool = False) -> bool:
     """Проверка подписки с учетом исключений"""
     # Проверяем, есть ли пользователь в исключениях
-    if not ignore_exceptions and db.is_exception(user_id):
+    if not ignore_exceptions and await db.is_exception(user_id):
         return True
     
     try:
-        chat_member = await bot.get_chat_member(group_id, user_id)
-        return chat_member.status in ["member", "administrator", "creator"]
+        return await membership_cache.is_member(bot, group_id, user_id)
     except Exception as e:
-        print(f"Error checking subscription for {user_id}: {e}")
+        logger.error(f"❌ Ошибка проверки подписки {user_id}: {e}")
         return False
 
-async def daily_subscription_check(bot: Bot):
-    """Ежедневная проверка подписок всех пользователей"""
-    while True:
-        try:
-            users = db.get_all_users()
-            unsubscribed_users = []
+class SubscriptionSweep:
+    """Проверка подписок среза пользователей (по умолчанию - всех)"""
+    
+    def __init__(
+        self,
+        bot: Bot,
+        concurrency: int = Config.SWEEP_CONCURRENCY,
+        rate: float = Config.SWEEP_RATE,
+        chunk: int = Config.SWEEP_UPDATE_CHUNK,
+        max_attempts: int = Config.SEND_MAX_ATTEMPTS
+    ):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.chunk = chunk
+        self.max_attempts = max_attempts
+        self._pace = TokenBucket(rate)
+        self.stats = {"users": 0, "checked": 0, "exceptions": 0, "changed": 0, "unknown": 0, "unsubscribed": 0}
+        self._exceptions: Set[int] = set()
+        self._changes: List[Tuple[int, bool]] = []
+        self._checked: List[int] = []
+        self._unsubscribed: List[Tuple[int, str]] = []
+        self._start = 0.0
+    
+    async def run(self, users: Optional[List[Tuple[int, int, str]]] = None) -> Dict:
+        """
+        Проверить пользователей, записать изменения и уведомить отписавшихся
+        
+        Args:
+            users: срез (user_id, is_subscribed, language); None - все пользователи
+        """
+        self._start = time.monotonic()
+        # Полная проверка пишет в лог, срезы непрерывной проверки - только в debug
+        level = logging.INFO if users is None else logging.DEBUG
+        if users is None:
+            users = await db.get_sweep_users()
+        self._exceptions = await db.get_exception_ids()
+        self.stats["users"] = len(users)
+        logger.log(level, f"🔎 Проверка подписок: {len(users)} пользователей, исключений {len(self._exceptions)}")
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        for user in users:
+            queue.put_nowait(user)
+        
+        # Все запросы проверки и уведомления - в полосе низшего приоритета
+        aborted: Optional[GroupUnavailableError] = None
+        with send_lane("housekeeping"):
+            workers = [asyncio.create_task(self._worker(queue)) for _ in range(min(self.concurrency, len(users)))]
+            try:
+                await asyncio.gather(*workers)
+            except GroupUnavailableError as e:
+                aborted = e
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await self._flush()
+            
+            # Уже проверенные до прерывания статусы достоверны - уведомляем
+            if self._unsubscribed:
+                await self._notify_unsubscribed()
+        
+        if aborted is not None:
+            logger.error(f"⛔ Проверка подписок прервана, группа недоступна: {aborted}")
+            raise aborted
+        
+        self.stats["duration"] = time.monotonic() - self._start
+        logger.log(
+            level,
+            f"✅ Проверка подписок завершена за {self.stats['duration']:.1f} с: проверено {self.stats['checked']}, "
+            f"исправлено пропущенных изменений {self.stats['changed']}, отписались {self.stats['unsubscribed']}, "
+            f"не удалось проверить {self.stats['unknown']}"
+        )
+        return self.stats
+    
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            try:
+                user_id, was_subscribed, language = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
             
-            for user in users:
-                user_id = user["user_id"]
-                
-                # Проверяем подписку (игнорируем исключения для проверки)
-                is_subscribed = await check_user_subscription(
-                    user_id, 
-                    Config.REQUIRED_GROUP_ID, 
-                    bot,
-                    ignore_exceptions=True  # Игнорируем исключения для проверки
+            if user_id in self._exceptions:
+                # Пользователь в исключениях считается подписанным, запрос не нужен
+                self.stats["exceptions"] += 1
+                is_subscribed = True
+            else:
+                is_subscribed = await self._is_member(user_id)
+            
+            self.stats["checked"] += 1
+            if self.stats["checked"] % Config.SWEEP_PROGRESS_EVERY == 0:
+                logger.info(
+                    f"🔎 Проверка подписок: {self.stats['checked']}/{self.stats['users']}, "
+                    f"изменено {self.stats['changed']}, {time.monotonic() - self._start:.0f} с"
                 )
-                
-                # Проверяем, есть ли пользователь в исключениях
-                is_exception = db.is_exception(user_id)
-                
-                # Если пользователь в исключениях, считаем его подписанным
-                if is_exception:
-                    is_subscribed = True
-                
-                # Обновляем статус в БД
-                db.update_subscription(user_id, is_subscribed)
-                
-                # Если пользователь отписался и не в исключениях, отправляем уведомление
-                if user["is_subscribed"] and not is_subscribed and not is_exception:
-                    unsubscribed_users.append(user_id)
             
-            # Отправляем уведомления отписавшимся пользователям
-            for user_id in unsubscribed_users:
-                user = db.get_user(user_id)
-                lang = user.get("language", "RUS")
-                lang_code = "ru" if lang == "RUS" else "en"
-                
-                try:
-                    text = locale_manager.get_text(lang_code, "notifications.unsubscribed")
-                    await bot.send_message(user_id, text)
-                except Exception as e:
-                    print(f"Failed to send unsubscription notification to {user_id}: {e}")
+            if is_subscribed is None:
+                self.stats["unknown"] += 1
+                continue
             
-            print(f"Daily subscription check completed. Checked {len(users)} users.")
+            if is_subscribed != bool(was_subscribed):
+                self._changes.append((user_id, is_subscribed))
+                self.stats["changed"] += 1
+                if not is_subscribed:
+                    self._unsubscribed.append((user_id, language))
+            else:
+                self._checked.append(user_id)
             
-        except Exception as e:
-            print(f"Error in daily subscription check: {e}")
+            if len(self._changes) + len(self._checked) >= self.chunk:
+                await self._flush()
+    
+    async def _is_member(self, user_id: int) -> Optional[bool]:
+        """
+        Статус подписки; None - проверить не удалось (статус в БД не меняется)
+        
+        Raises:
+            GroupUnavailableError: бот не может читать участников группы
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            wait = self._pace.reserve(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await rate_limiter.acquire()
+            try:
+                chat_member = await self.bot.get_chat_member(Config.REQUIRED_GROUP_ID, user_id)
+                is_member = chat_member.status in SUBSCRIBED_STATUSES
+                membership_cache.set(Config.REQUIRED_GROUP_ID, user_id, is_member)
+                return is_member
+            except Exception as e:
+                error_class = classify_send_error(e)
+                if error_class == RETRY_AFTER:
+                    rate_limiter.on_retry_after(None, e.retry_after)
+                elif error_class == TRANSIENT:
+                    await asyncio.sleep(backoff_delay(attempt))
+                else:
+                    membership_cache.invalidate(Config.REQUIRED_GROUP_ID, user_id)
+                    message = str(e).lower()
+                    if isinstance(e, TelegramForbiddenError) or any(marker in message for marker in GROUP_UNAVAILABLE_ERRORS):
+                        raise GroupUnavailableError(str(e)) from e
+                    if isinstance(e, TelegramBadRequest) and any(marker in message for marker in USER_NOT_FOUND_ERRORS):
+                        # Пользователь не найден - не подписан
+                        return False
+                    logger.warning(f"⚠️ Не удалось проверить подписку {user_id}: {e}")
+                    return None
+        
+        membership_cache.invalidate(Config.REQUIRED_GROUP_ID, user_id)
+        logger.warning(f"⚠️ Не удалось проверить подписку {user_id} за {self.max_attempts} попыток")
+        return None
+    
+    async def _flush(self):
+        """Записать накопленные изменения и отметки проверки одной транзакцией"""
+        if not self._changes and not self._checked:
+            return
+        changes, self._changes = self._changes, []
+        checked, self._checked = self._checked, []
+        await db.update_subscriptions(changes, checked)
+    
+    async def _notify_unsubscribed(self):
+        jobs = []
+        for user_id, language in self._unsubscribed:
+            lang_code = "ru" if language == "RUS" else "en"
+            jobs.append(DeliveryJob(user_id, locale_manager.get_text(lang_code, "notifications.unsubscribed")))
+        
+        result = await deliver(self.bot, "housekeeping", jobs)
+        self.stats["unsubscribed"] = result.sent
+        logger.info(f"📨 Уведомления об отписке: {result.summary()}")
+
+class RollingSweep:
+    """Непрерывная проверка подписок по кругу, от давно не проверенных"""
+    
+    def __init__(
+        self,
+        name: str = "subscription",
+        interval: float = Config.SUBSCRIPTION_CHECK_INTERVAL,
+        tick: float = Config.SWEEP_TICK
+    ):
+        self.name = name
+        self.interval = interval
+        self.tick = tick
+        self.state = {"rotation": 0, "rotation_started": None, "rotation_checked": 0, "last_tick": None}
+        self.total_users = 0
+        self.last_slice: Dict = {}
+    
+    async def run(self, bot: Bot):
+        """Бесконечный цикл срезов (фоновая задача бота)"""
+        saved = await db.get_sweep_state(self.name)
+        if saved:
+            self.state.update({key: saved[key] for key in self.state})
+            logger.info(
+                f"🔁 Проверка подписок продолжается: круг {self.state['rotation'] + 1}, "
+                f"проверено {self.state['rotation_checked']}"
+            )
+            # После перезапуска - не раньше, чем подошел бы следующий срез
+            delay = (self.state["last_tick"] or 0) + self.tick - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
         
-        # Ждем 24 часа до следующей проверки
-        await asyncio.sleep(Config.SUBSCRIPTION_CHECK_INTERVAL)
\ No newline at end of file
+        while True:
+            started = time.monotonic()
+            try:
+                await self.run_slice(bot)
+            except Exception as e:
+                logger.error(f"❌ Ошибка проверки подписок: {e}")
+            await asyncio.sleep(max(0.0, self.tick - (time.monotonic() - started)))
+    
+    def slice_size(self, total_users: int) -> int:
+        """Размер среза, при котором вся база проходится за interval"""
+        return max(1, math.ceil(total_users * self.tick / self.interval))
+    
+    async def run_slice(self, bot: Bot) -> Dict:
+        """Проверить один срез и сохранить контрольную точку"""
+        self.total_users = await db.count_users()
+        users = await db.get_stalest_users(self.slice_size(self.total_users))
+        stats = await SubscriptionSweep(bot).run(users)
+        
+        now = time.time()
+        state = self.state
+        if state["rotation_started"] is None:
+            state["rotation_started"] = now
+        state["rotation_checked"] += stats["checked"] - stats["unknown"]
+        state["last_tick"] = now
+        
+        if state["rotation_checked"] >= self.total_users:
+            logger.info(
+                f"✅ Круг проверки подписок {state['rotation'] + 1} завершен за "
+                f"{(now - state['rotation_started']) / 3600:.1f} ч: {self.total_users} пользователей"
+            )
+            state.update(rotation=state["rotation"] + 1, rotation_started=now, rotation_checked=0)
+        elif state["rotation_checked"] // Config.SWEEP_PROGRESS_EVERY > (state["rotation_checked"] - stats["checked"]) // Config.SWEEP_PROGRESS_EVERY:
+            logger.info(f"🔎 Проверка подписок: {state['rotation_checked']}/{self.total_users} в круге {state['rotation'] + 1}")
+        
+        await db.save_sweep_state(self.name, state)
+        self.last_slice = stats
+        return stats
+    
+    def stats(self) -> Dict:
+        return {
+            "rotation": self.state["rotation"] + 1,
+            "rotation_checked": self.state["rotation_checked"],
+            "users": self.total_users,
+            "slice": self.slice_size(self.total_users),
+            "tick": self.tick,
+            "last_slice_changed": self.last_slice.get("changed", 0),
+            "last_slice_duration": self.last_slice.get("duration", 0.0)
+        }
+
+# Глобальный экземпляр
+subscription_sweep = RollingSweep()
+
+async def daily_subscription_check(bot: Bot):
+    """Непрерывная проверка подписок по кругу (весь круг - Config.SUBSCRIPTION_CHECK_INTERVAL)"""
+    await subscription_sweep.run(bot)
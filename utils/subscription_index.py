@@ -0,0 +1,200 @@
+"""
+subscription_index.py - Инвертированный индекс подписок в памяти процесса
+
+Строится один раз при старте из таблиц users + user_fruits и поддерживается
+инкрементально методами записи Database. Поиск получателей поста сводится
+к нескольким объединениям множеств без обращения к SQLite.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+ALL_FRUITS = "all"
+
+class SubscriptionIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self._languages: Dict[int, str] = {}
+        self._subscribed: Set[int] = set()
+        self._free_totems: Set[int] = set()
+        self._paid_totems: Set[int] = set()
+        self._fruits_by_user: Dict[int, Set[str]] = {}
+        self._users_by_fruit: Dict[str, Set[int]] = {}
+        self._load_ms = 0.0
+        self._lookups = 0
+        self._lookup_total = 0.0
+    
+    # ========== ПОСТРОЕНИЕ ==========
+    
+    def load(self, db):
+        """Полное построение индекса из БД (при старте бота)"""
+        start = time.perf_counter()
+        with self._lock:
+            users, fruits = db.load_subscription_snapshot()
+            
+            self._languages = {}
+            self._subscribed = set()
+            self._free_totems = set()
+            self._paid_totems = set()
+            self._fruits_by_user = {}
+            self._users_by_fruit = {}
+            
+            for user_id, language, is_subscribed, free_totems, paid_totems in users:
+                self._languages[user_id] = language or "RUS"
+                if is_subscribed:
+                    self._subscribed.add(user_id)
+                if free_totems:
+                    self._free_totems.add(user_id)
+                if paid_totems:
+                    self._paid_totems.add(user_id)
+            
+            for user_id, fruit_name in fruits:
+                self._fruits_by_user.setdefault(user_id, set()).add(fruit_name)
+                self._users_by_fruit.setdefault(fruit_name, set()).add(user_id)
+            
+            self.loaded = True
+            self._load_ms = (time.perf_counter() - start) * 1000
+        
+        logger.info(
+            f"Subscription index loaded: {len(self._languages)} users, "
+            f"{len(self._subscribed)} subscribed, {self._load_ms:.1f} ms"
+        )
+    
+    # ========== ИНКРЕМЕНТАЛЬНОЕ ОБНОВЛЕНИЕ ==========
+    # Вызываются из Database после фиксации транзакции; до загрузки индекса игнорируются
+    
+    def on_user_added(self, user_id: int, language: str):
+        """Новый пользователь (значения по умолчанию из схемы users)"""
+        with self._lock:
+            if not self.loaded or user_id in self._languages:
+                return
+            self._languages[user_id] = language or "RUS"
+            self._free_totems.add(user_id)
+            self._paid_totems.add(user_id)
+    
+    def on_language_changed(self, user_id: int, language: str):
+        with self._lock:
+            if self.loaded and user_id in self._languages:
+                self._languages[user_id] = language or "RUS"
+    
+    def on_subscription_changed(self, user_id: int, is_subscribed: bool):
+        with self._lock:
+            if not self.loaded or user_id not in self._languages:
+                return
+            if is_subscribed:
+                self._subscribed.add(user_id)
+            else:
+                self._subscribed.discard(user_id)
+    
+    def on_fruits_changed(self, user_id: int, fruits: Iterable[str]):
+        with self._lock:
+            if not self.loaded:
+                return
+            for fruit_name in self._fruits_by_user.pop(user_id, ()):
+                bucket = self._users_by_fruit.get(fruit_name)
+                if bucket is not None:
+                    bucket.discard(user_id)
+            
+            new_fruits = set(fruits)
+            if new_fruits:
+                self._fruits_by_user[user_id] = new_fruits
+                for fruit_name in new_fruits:
+                    self._users_by_fruit.setdefault(fruit_name, set()).add(user_id)
+    
+    def on_totems_changed(self, user_id: int, free_totems: Optional[bool] = None, paid_totems: Optional[bool] = None):
+        with self._lock:
+            if not self.loaded or user_id not in self._languages:
+                return
+            for value, bucket in ((free_totems, self._free_totems), (paid_totems, self._paid_totems)):
+                if value is None:
+                    continue
+                if value:
+                    bucket.add(user_id)
+                else:
+                    bucket.discard(user_id)
+    
+    # ========== ПОИСК ПОЛУЧАТЕЛЕЙ ==========
+    
+    def iter_food_recipients(self, fruit_names: List[str]) -> Iterator[Dict]:
+        """
+        Получатели уведомления о еде по одному. Под блокировкой снимается
+        список (ID, язык, фрукты) - поток записи БД меняет словари индекса,
+        пока идет рассылка; словари получателей создаются по мере чтения
+        """
+        start = time.perf_counter()
+        names = list(dict.fromkeys(fruit_names))
+        if not names:
+            return
+        
+        with self._lock:
+            all_bucket = set(self._users_by_fruit.get(ALL_FRUITS, ()))
+            candidates = set(all_bucket)
+            for name in names:
+                candidates |= self._users_by_fruit.get(name, set())
+            candidates &= self._subscribed
+            
+            snapshot = []
+            for user_id in candidates:
+                if user_id in all_bucket:
+                    fruits = names
+                else:
+                    user_fruits = self._fruits_by_user.get(user_id, ())
+                    fruits = [name for name in names if name in user_fruits]
+                snapshot.append((user_id, self._languages[user_id], fruits))
+        self._record_lookup(start)
+        
+        for user_id, language, fruits in snapshot:
+            yield {"user_id": user_id, "language": language, "fruits": fruits}
+    
+    def count_food_recipients(self, fruit_names: List[str]) -> int:
+        """Число получателей уведомления о еде (без построения списка)"""
+        with self._lock:
+            candidates = set(self._users_by_fruit.get(ALL_FRUITS, ()))
+            for name in set(fruit_names):
+                candidates |= self._users_by_fruit.get(name, set())
+            return len(candidates & self._subscribed) if fruit_names else 0
+    
+    def iter_totem_recipients(self, is_free: bool) -> Iterator[Dict]:
+        """Получатели уведомления о тотеме по одному"""
+        start = time.perf_counter()
+        with self._lock:
+            bucket = self._free_totems if is_free else self._paid_totems
+            snapshot = [(user_id, self._languages[user_id]) for user_id in bucket & self._subscribed]
+        self._record_lookup(start)
+        
+        for user_id, language in snapshot:
+            yield {"user_id": user_id, "language": language}
+    
+    def resolve_food_recipients(self, fruit_names: List[str]) -> List[Dict]:
+        """То же, что Database.resolve_food_recipients, но из памяти"""
+        return list(self.iter_food_recipients(fruit_names))
+    
+    def resolve_totem_recipients(self, is_free: bool) -> List[Dict]:
+        """То же, что Database.resolve_totem_recipients, но из памяти"""
+        return list(self.iter_totem_recipients(is_free))
+    
+    def _record_lookup(self, start: float):
+        self._lookups += 1
+        self._lookup_total += time.perf_counter() - start
+    
+    def stats(self) -> Dict:
+        """Размер индекса и скорость поиска"""
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "users": len(self._languages),
+                "subscribed": len(self._subscribed),
+                "fruit_buckets": len(self._users_by_fruit),
+                "all_bucket": len(self._users_by_fruit.get(ALL_FRUITS, ())),
+                "load_ms": self._load_ms,
+                "lookups": self._lookups,
+                "lookup_avg_us": (self._lookup_total / self._lookups * 1_000_000) if self._lookups else 0.0
+            }
+
+# Глобальный экземпляр
+subscription_index = SubscriptionIndex()